@@ -1,9 +1,28 @@
 from django.contrib import admin
 
 
+from .dashboard import bump_dashboard_version
 from .models import SleepRecord, SleepStatistics, UserData
 
 
+class DashboardInvalidationMixin:
+    """Правка записей сна и статистики в админке сбрасывает кеш дашборда их владельцев"""
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        bump_dashboard_version(obj.user_id)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        bump_dashboard_version(obj.user_id)
+
+    def delete_queryset(self, request, queryset):
+        user_ids = set(queryset.values_list('user_id', flat=True))
+        super().delete_queryset(request, queryset)
+        for user_id in user_ids:
+            bump_dashboard_version(user_id)
+
+
 # Register your models here.
 class UserDataAdmin(admin.ModelAdmin):
     search_fields = ['user_name', 'weight', 'gender', 'height', 'active']
@@ -12,7 +31,7 @@ class UserDataAdmin(admin.ModelAdmin):
         return obj.user.username
 
 
-class SleepRecordAdmin(admin.ModelAdmin):
+class SleepRecordAdmin(DashboardInvalidationMixin, admin.ModelAdmin):
     list_display = ['user_name', 'sleep_date_time', 'sleep_deep_duration', 'sleep_light_duration']
     list_filter = ['user']
     search_fields = ['user', 'sleep_date_time', 'sleep_deep_duration', 'sleep_light_duration']
@@ -21,7 +40,7 @@ class SleepRecordAdmin(admin.ModelAdmin):
         return obj.user.username
 
 
-class SleepStatisticsAdmin(admin.ModelAdmin):
+class SleepStatisticsAdmin(DashboardInvalidationMixin, admin.ModelAdmin):
     list_display = ['user_name', 'sleep_duration', 'sleep_quality', 'health_impact', 'date', 'calories_burned']
     list_filter = ['user', 'sleep_duration', 'sleep_quality']
     search_fields = ['user', 'sleep_duration', 'sleep_quality']
@@ -29,6 +48,7 @@ class SleepStatisticsAdmin(admin.ModelAdmin):
     def delete_model(self, request, obj):
         # Удаляем все записи SleepStatistics, связанные с удаляемым пользователем
         SleepStatistics.objects.filter(user=obj.user).delete()
+        bump_dashboard_version(obj.user_id)
 
     def user_name(self, obj):
         return obj.user.username
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class SleepTrackingAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'sleep_tracking_app'
+
+    def ready(self):
+        from . import signals  # noqa: F401
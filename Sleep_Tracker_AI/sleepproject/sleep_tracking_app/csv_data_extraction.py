@@ -1,133 +1,311 @@
+import csv
+import hashlib
 import json
+import numpy as np
 import pandas as pd
 from celery_progress.backend import ProgressRecorder
-from typing import Tuple
+from collections import defaultdict
+from typing import Iterator, Optional, Tuple
 
-def convert_to_readable_time(list_of_unix_timestamps: list, df_column: pd.DataFrame) -> None:
-    """Преобразует UNIX-метку времени в читаемый формат."""
-    for col in list_of_unix_timestamps:
-        if col in df_column.columns:
-            df_column[col] = pd.to_datetime(df_column[col].astype(int), unit='s', utc=True).dt.tz_convert(
-                'UTC').dt.strftime('%Y-%m-%d %H:%M:%S%z')
+from .sleep_import.compression import ExportFormatError, open_export
+from .sleep_import.json_decoding import loads, loads_many, decode_heart_rate
 
+# Ключи строк экспорта Mi Fitness, которые нужны для импорта сна
+SLEEP_KEY = 'sleep'
+HEART_RATE_KEY = 'heart_rate'
+REQUIRED_COLUMNS = ['Key', 'Time', 'Value']
+# Сколько первых записей сна проверяется на валидность
+SLEEP_ROWS_TO_CHECK = 5
 
-def mask_night(heart_idx: pd.Index, start: pd.Timestamp, end: pd.Timestamp) -> bool:
+
+def assign_night(times: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
     """
-    Создает маску для фильтрации сердечного ритма по ночным интервалам
+    Для каждого отсчёта пульса возвращает позицию ночи [start, end), которой он принадлежит, или -1.
+    starts должны быть отсортированы по возрастанию, ночи не пересекаются.
+    Один проход searchsorted вместо маски по всему индексу для каждой ночи.
     """
+    pos = np.searchsorted(starts, times, side='right') - 1
+    inside = pos >= 0
+    inside[inside] = times[inside] < ends[pos[inside]]
+    return np.where(inside, pos, -1)
 
-    if start < end:
-        return (heart_idx >= start) & (heart_idx < end)
-    else:
-        return (heart_idx >= start) | (heart_idx < end)
+
+def is_valid_sleep_payload(value) -> bool:
+    """
+    Проверяет, что JSON записи сна — version 2 со стадиями сна (has_stage) и items
+    """
+    try:
+        data = loads(value)
+    except (json.JSONDecodeError, AttributeError, TypeError):
+        return False
+    return isinstance(data, dict) and 'items' in data and data.get('version') == 2 and bool(data.get('has_stage'))
 
 
-def sleep_record_from_csv(sleep_data: pd.DataFrame, progress_recorder: ProgressRecorder = None) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+def has_valid_sleep(values: pd.Series) -> bool:
     """
-    Извлекает данные из CSV-файла, фильтруя записи сна и ночной сердечный ритм
-    Возвращает кортеж (meta, items, night_hr, df_day) или None, если данные невалидны
+    Проверяет, что хотя бы одна из первых записей сна имеет валидный JSON с items (version 2, has_stage)
     """
-    # Проверяем наличие обязательных колонок
-    required_columns = ['Key', 'Time', 'Value']
-    if not all(col in sleep_data.columns for col in required_columns):
-        return None
+    return any(is_valid_sleep_payload(value) for value in values.head(SLEEP_ROWS_TO_CHECK))
 
-    # Проверяем наличие хотя бы одной записи сна с валидным JSON
-    sleep_entries = sleep_data[sleep_data['Key'] == 'sleep']
-    if sleep_entries.empty:
-        return None
 
-    # Проверяем, что хотя бы одна запись имеет валидный JSON с items
-    has_valid_sleep = False
-    for value in sleep_entries['Value'].head(5):  # Проверяем только первые 5 записей
-        try:
-            data = json.loads(value)
-            if isinstance(data, dict) and 'items' in data and data.get('version') == 2 and data.get('has_stage'):
-                has_valid_sleep = True
-                break
-        except (json.JSONDecodeError, AttributeError):
-            continue
+def validate_sleep_export(path: str) -> Optional[str]:
+    """
+    Быстрая проверка файла до постановки импорта в очередь: читается только заголовок и строки,
+    пока не найдётся валидная запись сна (среди первых SLEEP_ROWS_TO_CHECK записей sleep).
+    Возвращает текст ошибки или None, если файл похож на экспорт Mi Fitness со сном
+    """
+    checked = 0
+    try:
+        with open_export(path) as f:
+            header = next(csv.reader([f.readline()]), [])
+            if not all(col in header for col in REQUIRED_COLUMNS):
+                return 'В файле нет колонок Key, Time и Value'
+            key_index, value_index = header.index('Key'), header.index('Value')
 
-    if not has_valid_sleep:
-        return None
+            for line in f:
+                # Строки других ключей пропускаются без разбора CSV
+                if SLEEP_KEY not in line:
+                    continue
+                row = next(csv.reader([line]))
+                if len(row) <= max(key_index, value_index) or row[key_index] != SLEEP_KEY:
+                    continue
+                if is_valid_sleep_payload(row[value_index]):
+                    return None
+                checked += 1
+                if checked >= SLEEP_ROWS_TO_CHECK:
+                    break
+    except UnicodeDecodeError:
+        return 'Файл не в кодировке UTF-8'
+    except ExportFormatError as exc:
+        return str(exc)
+    except (OSError, EOFError):
+        return 'Не удалось распаковать файл'
 
-    total_steps = 9
+    if checked:
+        return 'Записи сна в файле не содержат стадий сна (нужен формат version 2)'
+    return 'В файле нет записей сна'
 
-    # Разделяем на sleep и heart_rate
-    df_sleep = sleep_data[sleep_data['Key'] == 'sleep'].copy()
-    df_hr = sleep_data[sleep_data['Key'] == 'heart_rate'].copy()
-    progress_recorder.set_progress(1, total_steps)
 
-    # Преобразуем JSON в столбцы
-    df_sleep['json'] = df_sleep['Value'].apply(json.loads)
+def payload_fingerprint(value: str) -> str:
+    """
+    Отпечаток JSON ночи: по нему повторный импорт пропускает ночи, которые не изменились
+    """
+    return hashlib.blake2b(value.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def parse_sleep_rows(df_sleep: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Разбирает строки sleep в метаданные ночей и сегменты сна.
+    Обе таблицы индексируются временем записи сна (секунды UNIX), время в колонках тоже остаётся
+    в секундах UNIX; в meta добавляется payload_hash
+    """
+    df_sleep = df_sleep.copy()
+    # Преобразуем JSON в столбцы: все ночи декодируются одним вызовом
+    df_sleep['json'] = pd.Series(loads_many(df_sleep['Value']), index=df_sleep.index, dtype=object)
     # Оставляем только version==2 и непустые items (has_stage как флаг, что есть стадии сна)
-    valid_sleep = df_sleep['json'].apply(lambda d: d.get('version') == 2 and d.get('has_stage'))
+    valid_sleep = df_sleep['json'].apply(lambda d: d.get('version') == 2 and bool(d.get('has_stage')))
     df_sleep = df_sleep[valid_sleep]
-    progress_recorder.set_progress(2, total_steps)
 
-    # Конвертируем Time в datetime
-    df_sleep['Time_dt'] = (
-        pd.to_datetime(df_sleep['Time'].astype(int), unit='s', utc=True)
-        .dt.tz_convert('UTC')
-    )
-    progress_recorder.set_progress(3, total_steps)
+    # Время записи сна в секундах UNIX; в datetime переводится только при записи в БД
+    df_sleep['Time_epoch'] = df_sleep['Time'].astype('int64')
+    # Повтор ночи в экспорте (то же время записи сна): остаётся последняя строка. Ранние копии отбрасываются
+    # до разворота сегментов и разметки пульса, так что все этапы импорта видят одну ночь
+    df_sleep = df_sleep[~df_sleep['Time_epoch'].duplicated(keep='last')]
 
     # Метаданные
-    df_meta = pd.json_normalize(df_sleep['json'])
-    df_meta = df_meta.drop(columns=['items', 'version', 'timezone', 'has_stage'])
-    df_meta.index = df_sleep['Time_dt']
+    df_meta = pd.json_normalize(df_sleep['json'].tolist())
+    df_meta = df_meta.drop(columns=['items', 'version', 'timezone', 'has_stage'], errors='ignore')
+    df_meta['payload_hash'] = df_sleep['Value'].map(payload_fingerprint).to_numpy()
+    df_meta.index = df_sleep['Time_epoch']
     df_meta.index.name = 'Time'
-    progress_recorder.set_progress(4, total_steps)
 
     # Разворачиваем список items
     df_sleep['items_list'] = df_sleep['json'].apply(lambda d: d['items'])
     df_items_exp = df_sleep.explode('items_list')
     # Нормализуем вложенные словари
-    df_items = pd.json_normalize(df_items_exp['items_list'])
+    df_items = pd.json_normalize(df_items_exp['items_list'].tolist())
     # Индексируем по тому же времени
-    df_items.index = df_items_exp['Time_dt']
+    df_items.index = df_items_exp['Time_epoch']
     df_items.index.name = 'Time'
+
+    return df_meta, df_items
+
+
+def parse_heart_rate_rows(df_hr: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Разбирает строки heart_rate в массивы (time в секундах UNIX, bpm)
+    """
+    return decode_heart_rate(df_hr['Value'])
+
+
+def night_bounds(df_meta: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Возвращает порядок ночей по началу и отсортированные границы [device_bedtime, device_wake_up_time)
+    """
+    bedtimes = df_meta['device_bedtime'].to_numpy(dtype='int64')
+    order = np.argsort(bedtimes, kind='stable')
+    return order, bedtimes[order], df_meta['device_wake_up_time'].to_numpy(dtype='int64')[order]
+
+
+def night_heart_rate_frame(times: np.ndarray, bpm: np.ndarray, nights: pd.Index) -> pd.DataFrame:
+    """
+    Собирает ночной пульс: индекс — время отсчёта, колонка night — время записи сна, которой он принадлежит
+    (оба в секундах UNIX)
+    """
+    df_night = pd.DataFrame({'bpm': bpm, 'night': np.asarray(nights, dtype='int64')},
+                            index=pd.Index(times, dtype='int64'))
+    df_night.index.name = 'Time'
+    return df_night.sort_index(kind='stable')
+
+
+def sleep_record_from_csv(sleep_data: pd.DataFrame, progress_recorder: ProgressRecorder = None) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Извлекает данные из CSV-файла, фильтруя записи сна и ночной сердечный ритм
+    Возвращает кортеж (meta, items, night_hr) или None, если данные невалидны.
+    В night_hr колонка night — время записи сна (индекс meta), которой принадлежит отсчёт пульса.
+    Всё время — int64 секунды UNIX
+    """
+    # Проверяем наличие обязательных колонок
+    if not all(col in sleep_data.columns for col in REQUIRED_COLUMNS):
+        return None
+
+    # Проверяем наличие хотя бы одной записи сна с валидным JSON
+    sleep_entries = sleep_data[sleep_data['Key'] == SLEEP_KEY]
+    if sleep_entries.empty:
+        return None
+
+    # Проверяем, что хотя бы одна запись имеет валидный JSON с items
+    if not has_valid_sleep(sleep_entries['Value']):
+        return None
+
+    total_steps = 8
+
+    # Разделяем на sleep и heart_rate
+    df_sleep = sleep_entries
+    df_hr = sleep_data[sleep_data['Key'] == HEART_RATE_KEY]
+    progress_recorder.set_progress(1, total_steps)
+
+    # Метаданные и сегменты сна
+    df_meta, df_items = parse_sleep_rows(df_sleep)
     progress_recorder.set_progress(5, total_steps)
 
     # Пульс
-    df_hr['json'] = df_hr['Value'].apply(json.loads)
-    df_heart = pd.json_normalize(df_hr['json'])
-    df_heart.index = pd.to_datetime(df_heart['time'], unit='s', utc=True).dt.tz_convert('UTC')
-    df_heart.index.name = 'Time'
-    df_heart = df_heart.drop(columns=['time'])
+    heart_times, heart_bpm = parse_heart_rate_rows(df_hr)
     progress_recorder.set_progress(6, total_steps)
 
     # Разделение на ночь
-    # Интервалы из метаданных
-    intervals = pd.DataFrame({
-        'start': pd.to_datetime(df_meta['device_bedtime'], unit='s', utc=True).dt.tz_convert('UTC'),
-        'end': pd.to_datetime(df_meta['device_wake_up_time'], unit='s', utc=True).dt.tz_convert('UTC')
-    }, index=df_meta.index)
+    # Интервалы из метаданных, отсортированные по началу ночи
+    order, starts, ends = night_bounds(df_meta)
     progress_recorder.set_progress(7, total_steps)
 
-    night_parts = []
-    for idx, row in intervals.iterrows():
-        mask = mask_night(df_heart.index, row['start'], row['end'])
-        night_parts.append(df_heart[mask])
-
-    df_night = pd.concat(night_parts)
+    # Каждому отсчёту пульса проставляем метку ночи (время записи сна)
+    owner = assign_night(heart_times, starts, ends)
+    inside = owner >= 0
+    df_night = night_heart_rate_frame(heart_times[inside], heart_bpm[inside], df_meta.index[order][owner[inside]])
     progress_recorder.set_progress(8, total_steps)
-    # df_day = df_heart.drop(df_night.index)
 
-    # Преобразование времени к строкам с сохранением информации о временной зоне
-    df_meta.index = df_meta.index.strftime('%Y-%m-%d %H:%M:%S%z')
-    df_items.index = df_items.index.strftime('%Y-%m-%d %H:%M:%S%z')
-    df_night.index = df_night.index.strftime('%Y-%m-%d %H:%M:%S%z')
-    # df_day.index = df_day.index.strftime('%Y-%m-%d %H:%M:%S%z')
+    return df_meta, df_items, df_night
 
-    list_item_time = [c for c in df_items.columns if 'time' in c]
-    list_meta_time = [c for c in df_meta.columns if 'time' in c]
 
-    convert_to_readable_time(list_item_time, df_items)
-    convert_to_readable_time(list_meta_time, df_meta)
-    progress_recorder.set_progress(9, total_steps)
+def _read_key_chunks(csv_path: str, keys: tuple, chunksize: int) -> Iterator[pd.DataFrame]:
+    """
+    Читает CSV (в том числе сжатый) кусками по chunksize строк и оставляет только строки с нужными Key
+    """
+    with open_export(csv_path) as f, pd.read_csv(f, usecols=REQUIRED_COLUMNS, chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield chunk[chunk['Key'].isin(keys)]
 
-    return df_meta, df_items, df_night
+
+def sleep_record_batches_from_csv(csv_path: str, chunksize: int = 50_000,
+                                  batch_nights: int = 100) -> Optional[Tuple[int, Iterator[Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]]]]:
+    """
+    Потоковый разбор экспорта без загрузки всего CSV в память.
+
+    Первый проход читает только строки sleep (одна строка на ночь) и строит границы ночей.
+    Второй проход читает heart_rate кусками и раскладывает отсчёты по ночам. Если пульс в файле
+    упорядочен по времени, ночь считается завершённой, как только поток ушёл дальше её конца,
+    и завершённые ночи отдаются пачками не менее batch_nights ночей.
+    Каждая пачка — кортеж (meta, items, night_hr) в формате sleep_record_from_csv.
+    Возвращает (число ночей, итератор пачек) или None, если данные невалидны.
+    """
+    sleep_parts = []
+    hr_ordered = True
+    last_hr_time = None
+    try:
+        for chunk in _read_key_chunks(csv_path, (SLEEP_KEY, HEART_RATE_KEY), chunksize):
+            sleep_parts.append(chunk[chunk['Key'] == SLEEP_KEY])
+            hr_time = chunk.loc[chunk['Key'] == HEART_RATE_KEY, 'Time'].to_numpy(dtype='int64')
+            if len(hr_time):
+                if (last_hr_time is not None and hr_time[0] < last_hr_time) or np.any(np.diff(hr_time) < 0):
+                    hr_ordered = False
+                last_hr_time = hr_time[-1]
+    except ValueError:
+        # В файле нет обязательных колонок
+        return None
+
+    df_sleep = pd.concat(sleep_parts)
+    if df_sleep.empty or not has_valid_sleep(df_sleep['Value']):
+        return None
+
+    df_meta, df_items = parse_sleep_rows(df_sleep)
+    del sleep_parts, df_sleep
+
+    order, starts, ends = night_bounds(df_meta)
+    df_meta = df_meta.iloc[order]
+
+    return len(df_meta), _iter_night_batches(csv_path, df_meta, df_items, starts, ends, chunksize,
+                                             batch_nights if hr_ordered else len(df_meta) + 1)
+
+
+def _iter_night_batches(csv_path: str, df_meta: pd.DataFrame, df_items: pd.DataFrame, starts: np.ndarray,
+                        ends: np.ndarray, chunksize: int,
+                        batch_nights: int) -> Iterator[Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]]:
+    """
+    Второй проход потокового разбора: накапливает пульс по ночам и отдаёт завершённые ночи пачками
+    """
+    pending = defaultdict(list)  # позиция ночи -> список пар (time, bpm) прочитанных отсчётов
+    flushed = 0  # ночи [0, flushed) уже отданы
+    watermark = None  # максимальное время пульса, прочитанное на текущий момент
+
+    for chunk in _read_key_chunks(csv_path, (HEART_RATE_KEY,), chunksize):
+        times, bpm = parse_heart_rate_rows(chunk)
+        if not len(times):
+            continue
+        watermark = times.max() if watermark is None else max(watermark, times.max())
+
+        owner = assign_night(times, starts, ends)
+        inside = owner >= 0
+        times, bpm, owner = times[inside], bpm[inside], owner[inside]
+        for pos in np.unique(owner):
+            mask = owner == pos
+            pending[int(pos)].append((times[mask], bpm[mask]))
+
+        # Ночи, закончившиеся до watermark, больше не получат отсчётов
+        done = int(np.searchsorted(ends, watermark, side='right'))
+        if done - flushed >= batch_nights:
+            yield _night_batch(df_meta, df_items, pending, flushed, done)
+            flushed = done
+
+    if flushed < len(df_meta):
+        yield _night_batch(df_meta, df_items, pending, flushed, len(df_meta))
+
+
+def _night_batch(df_meta: pd.DataFrame, df_items: pd.DataFrame, pending: dict, start: int,
+                 stop: int) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Собирает пачку ночей [start, stop) и освобождает накопленный для них пульс
+    """
+    parts = [(pos, part) for pos in range(start, stop) for part in pending.pop(pos, [])]
+    if parts:
+        times = np.concatenate([part[0] for _, part in parts])
+        bpm = np.concatenate([part[1] for _, part in parts])
+        positions = np.repeat([pos for pos, _ in parts], [len(part[0]) for _, part in parts])
+    else:
+        times = bpm = positions = np.empty(0, dtype='int64')
+
+    meta = df_meta.iloc[start:stop]
+    items = df_items[df_items.index.isin(meta.index)]
+    return meta, items, night_heart_rate_frame(times, bpm, df_meta.index[positions])
 
 
 def main():
@@ -0,0 +1,275 @@
+import hashlib
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from cursor_pagination import CursorPage, CursorPaginator
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum, prefetch_related_objects
+import numpy as np
+
+from .models import HeartRateAggregate, SleepRecord, SleepStatistics, UserData
+from .sleep_import import HR_LEVELS, RAW_LEVEL, choose_hr_level, level_for_resolution, read_night_heart_rate
+from .sleep_statistic import get_sleep_phases_pie_data, get_heart_rate_bell_curve_data, chronotype_assessment, \
+    sleep_regularity, get_sleep_duration_trend, get_sleep_efficiency_trend, avg_sleep_duration, downsample_min_max
+
+# Отсчёты ночи лежат не дальше этого от времени записи сна (как CHILD_TIME_MARGIN импорта)
+NIGHT_HR_MARGIN = timedelta(days=2)
+
+
+def _version_key(user_id: int) -> str:
+    return f'sleep-dashboard:version:{user_id}'
+
+
+def dashboard_version(user_id: int) -> str:
+    """
+    Текущая версия данных дашборда пользователя. Версия — случайный токен без срока жизни:
+    если ключ версии вытеснен из кеша, новая версия не совпадёт ни с одной из прежних
+    """
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_dashboard_version(user_id: int) -> None:
+    """Делает недействительными все закешированные дашборды пользователя"""
+    cache.set(_version_key(user_id), uuid.uuid4().hex, None)
+
+
+def dashboard_cache_key(user_id: int, version: str, page_size: int, after: Optional[str] = None,
+                        before: Optional[str] = None, view: str = 'statistics') -> str:
+    """Ключ закешированных данных страницы view (statistics — дашборд, history — история) по курсору"""
+    # Курсоры — произвольные строки из запроса, в ключ идёт их хеш
+    params = hashlib.md5(f'{page_size}|{after or ""}|{before or ""}'.encode()).hexdigest()
+    return f'sleep-dashboard:{view}:{user_id}:{version}:{params}'
+
+
+def load_dashboard_data(user, page_size: int, after: Optional[str] = None,
+                        before: Optional[str] = None) -> Tuple[List[SleepStatistics], List[SleepRecord], CursorPage]:
+    """
+    Загружает данные дашборда не более чем тремя запросами: (статистика последних дней от новой к старой,
+    записи последних SleepRecord.LAST_NIGHTS ночей, страница записей по курсору). У первой из последних
+    ночей загружен ряд пульса NightHeartRateSeries. Первая страница без курсора и последние ночи берутся
+    одним запросом; для ночей, импортированных построчно, пульс читается отдельно
+    """
+    statistics = list(SleepStatistics.objects.only('id', 'user', 'date', 'recommended', 'sleep_calories_burned',
+                                                   'sleep_efficiency', 'sleep_phases').filter(
+        user=user).order_by('-date')[:SleepRecord.LAST_NIGHTS])
+
+    records = SleepRecord.objects.filter(user=user).only(*SleepRecord.DASHBOARD_FIELDS)
+    paginator = CursorPaginator(records, ordering=('-sleep_date_time', '-id'))
+
+    if after or before:
+        with_hr = paginator.queryset.select_related('night_hr_series').only(*SleepRecord.DASHBOARD_FIELDS,
+                                                                             'night_hr_series')
+        last_records = list(with_hr[:SleepRecord.LAST_NIGHTS])
+        if before:
+            page = paginator.page(last=page_size, before=before)
+        else:
+            page = paginator.page(first=page_size, after=after)
+    else:
+        # Первая страница и последние ночи — начало одной выборки; лишняя строка показывает, есть ли следующая
+        rows = list(paginator.queryset[:max(page_size, SleepRecord.LAST_NIGHTS) + 1])
+        page = CursorPage(rows[:page_size], paginator, has_next=len(rows) > page_size)
+        last_records = rows[:SleepRecord.LAST_NIGHTS]
+        prefetch_related_objects(last_records[:1], 'night_hr_series')
+
+    return statistics, last_records, page
+
+
+def build_dashboard(user, user_data: UserData, page_size: int,
+                    after: Optional[str] = None, before: Optional[str] = None) -> dict:
+    """
+    Считает данные дашборда статистики сна: метрики, графики и страницу тренда по курсору.
+    Результат содержит только сериализуемые значения и может храниться в кеше
+    """
+    statistics, sleep_records, page = load_dashboard_data(user, page_size, after, before)
+    sleep_statistics = statistics[0] if statistics else None
+    last_record = sleep_records[0] if sleep_records else None
+
+    # Аргументы задачи рекомендации, если у последней статистики её ещё нет.
+    # Промпт сопоставляет статистику с записями последних ночей, так что дней нужно столько же
+    pending_recommendation = None
+    if sleep_statistics and not sleep_statistics.recommended:
+        pending_recommendation = {
+            'user_data_id': user_data.id,
+            'sleep_statistics_id': [s.id for s in statistics],
+            'sleep_record_id': [r.id for r in sleep_records],
+        }
+
+    # Курсоры для ответа
+    next_cursor = page.paginator.cursor(page[-1]) if page and page.has_next else None
+    prev_cursor = page.paginator.cursor(page[0]) if page and page.has_previous else None
+
+    # Подготовка данных для графика
+    graph_data = get_sleep_duration_trend(page)
+
+    # Метрики
+    metric = {
+        'chronotype': chronotype_assessment(sleep_records=sleep_records) if sleep_records else {},
+        'sleep_regularity': sleep_regularity(sleep_records=sleep_records) if sleep_records else {},
+        'avg_sleep_duration': avg_sleep_duration(page) if page else 0,
+        'calories_burned': getattr(sleep_statistics, 'sleep_calories_burned', 0),
+        'sleep_efficiency': round(getattr(sleep_statistics, 'sleep_efficiency', 0), 2),
+    }
+
+    first_date = graph_data['dates'][0] if graph_data.get('dates') else 0
+    last_date = graph_data['dates'][-1] if graph_data.get('dates') else 0
+
+    plot_data = {
+        'phases': get_sleep_phases_pie_data(sleep_statistics),
+        'graph_data': graph_data,
+        'heart_rate': get_heart_rate_bell_curve_data(last_record),
+        'first_date': first_date,
+        'last_date': last_date,
+    }
+
+    return {
+        'page': list(page),
+        'has_next': page.has_next,
+        'has_previous': page.has_previous,
+        'next_cursor': next_cursor,
+        'prev_cursor': prev_cursor,
+        'graph_data': graph_data,
+        'first_date': first_date,
+        'last_date': last_date,
+        'metric': metric,
+        'plot_data': plot_data,
+        'rec': sleep_statistics.recommended if sleep_statistics else None,
+        'pending_recommendation': pending_recommendation,
+    }
+
+
+def get_dashboard(user, page_size: int, after: Optional[str] = None, before: Optional[str] = None) -> Optional[dict]:
+    """
+    Данные дашборда из кеша по версии пользователя; при промахе считаются build_dashboard и кладутся в кеш.
+    Версия читается до запросов к БД: если импорт зафиксируется во время расчёта, результат
+    ляжет под прежнюю версию и не будет показан. None — у пользователя нет UserData
+    """
+    version = dashboard_version(user.id)
+    key = dashboard_cache_key(user.id, version, page_size, after, before)
+    payload = cache.get(key)
+    if payload is None:
+        user_data = UserData.objects.filter(user=user).first()
+        if user_data is None:
+            return None
+        payload = build_dashboard(user, user_data, page_size, after, before)
+        cache.set(key, payload, settings.SLEEP_DASHBOARD_CACHE_TIMEOUT)
+    return payload
+
+
+def build_sleep_history(user, page_size: int, after: Optional[str] = None, before: Optional[str] = None) -> dict:
+    """Тренд эффективности сна по странице статистики пользователя и курсоры соседних страниц"""
+    paginator = CursorPaginator(SleepStatistics.get_delta_days_sleep_statistics(user), ordering=('-date', '-id'))
+    if before:
+        page = paginator.page(last=page_size, before=before)
+    else:
+        page = paginator.page(first=page_size, after=after)
+
+    return {
+        'has_next': page.has_next,
+        'has_previous': page.has_previous,
+        'next_cursor': paginator.cursor(page[-1]) if page and page.has_next else None,
+        'prev_cursor': paginator.cursor(page[0]) if page and page.has_previous else None,
+        'graph_data_json': get_sleep_efficiency_trend(page),
+    }
+
+
+def get_sleep_history(user, page_size: int, after: Optional[str] = None, before: Optional[str] = None) -> dict:
+    """
+    Данные истории сна из кеша пользователя. Версия та же, что у дашборда, и сбрасывается
+    при любом изменении статистики пользователя
+    """
+    version = dashboard_version(user.id)
+    key = dashboard_cache_key(user.id, version, page_size, after, before, view='history')
+    payload = cache.get(key)
+    if payload is None:
+        payload = build_sleep_history(user, page_size, after, before)
+        cache.set(key, payload, settings.SLEEP_DASHBOARD_CACHE_TIMEOUT)
+    return payload
+
+
+def load_heart_rate_range(user, start: datetime, end: datetime, max_points: int) -> dict:
+    """
+    Пульс пользователя за [start, end) не более чем в max_points точках. Уровень пирамиды выбирается
+    choose_hr_level по числу отсчётов и корзин внутри диапазона (_range_counts), затем читаются строки
+    только этого уровня. Возвращает {'level': 'raw' | '1m' | '5m' | '1h', 'time': начала точек
+    в миллисекундах UNIX, 'min', 'avg', 'max': пульс точек}; у сырых отсчётов ряды совпадают
+    """
+    nights = HeartRateAggregate.objects.filter(user=user, start_time__lt=end, end_time__gt=start)
+    samples, bucket_counts = _range_counts(nights, start, end)
+
+    level, thin = choose_hr_level(samples, bucket_counts, max_points)
+    if level == RAW_LEVEL:
+        times, low, avg, high = _raw_heart_rate(user, start, end)
+        # Ночи без агрегатов (импортированные до пирамиды) тоже не отдаются сверх лимита
+        thin = len(times) > max_points
+    else:
+        seconds = HR_LEVELS[level]
+        parts = [aggregate.to_arrays() for aggregate in nights.filter(resolution=seconds).order_by('start_time')]
+        if parts:
+            times, _, low, avg, high = (np.concatenate(column) for column in zip(*parts))
+            times, low, avg, high = _clip_buckets(times, seconds, start, end, times, low, avg, high)
+        else:
+            times = low = avg = high = np.empty(0, dtype='int64')
+
+    if thin:
+        # Прореживание по среднему: вместо времени передаются индексы точек, чтобы взять все ряды
+        keep, _ = downsample_min_max(np.arange(len(times)), avg, max_points)
+        times, low, avg, high = times[keep], low[keep], avg[keep], high[keep]
+
+    return {'level': level, 'time': (times * 1000).tolist(), 'min': low.tolist(), 'avg': avg.tolist(),
+            'max': high.tolist()}
+
+
+def _clip_buckets(times: np.ndarray, seconds: int, start: datetime, end: datetime, *columns) -> List[np.ndarray]:
+    """Оставляет в columns корзины (начала times, длина seconds), пересекающиеся с [start, end)"""
+    inside = (times + seconds > start.timestamp()) & (times < end.timestamp())
+    return [column[inside] for column in columns]
+
+
+def _range_counts(nights, start: datetime, end: datetime) -> Tuple[int, Dict[str, int]]:
+    """
+    Число отсчётов и корзин каждого уровня в [start, end) по агрегатам nights. Ночи целиком внутри
+    диапазона считаются по итогам строк одним агрегирующим запросом, ночи на границах декодируются
+    и обрезаются по диапазону. Отсчёты берутся из корзин самого подробного уровня
+    """
+    finest = next(iter(HR_LEVELS.values()))
+    bucket_counts = dict.fromkeys(HR_LEVELS, 0)
+    samples = 0
+
+    within = dict(start_time__gte=start, end_time__lte=end)
+    stats = nights.filter(**within).values('resolution').annotate(buckets=Sum('bucket_count'),
+                                                                  samples=Sum('sample_count'))
+    for row in stats:
+        bucket_counts[level_for_resolution(row['resolution'])] += row['buckets']
+        if row['resolution'] == finest:
+            samples += row['samples']
+
+    for aggregate in nights.exclude(**within):
+        times, counts, *_ = aggregate.to_arrays()
+        counts, = _clip_buckets(times, aggregate.resolution, start, end, counts)
+        bucket_counts[level_for_resolution(aggregate.resolution)] += len(counts)
+        if aggregate.resolution == finest:
+            samples += int(counts.sum())
+
+    return samples, bucket_counts
+
+
+def _raw_heart_rate(user, start: datetime, end: datetime) -> Tuple[np.ndarray, ...]:
+    """Сырые отсчёты пульса за [start, end) по ночам пользователя: (время в секундах UNIX, пульс x3)"""
+    records = SleepRecord.objects.filter(
+        user=user, sleep_date_time__range=(start - NIGHT_HR_MARGIN, end + NIGHT_HR_MARGIN),
+    ).select_related('night_hr_series').only('id', 'night_hr_series').order_by('sleep_date_time')
+    series = [read_night_heart_rate(record) for record in records]
+    times = np.concatenate([times for times, _ in series] or [np.empty(0, dtype='int64')])
+    bpm = np.concatenate([bpm for _, bpm in series] or [np.empty(0, dtype='int64')]).astype(float)
+    order = np.argsort(times, kind='stable')
+    times, bpm = times[order], bpm[order]
+    inside = (times >= start.timestamp()) & (times < end.timestamp())
+    times, bpm = times[inside], bpm[inside]
+    return times, bpm, bpm, bpm
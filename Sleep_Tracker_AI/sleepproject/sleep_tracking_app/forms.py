@@ -2,6 +2,7 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from datetime import date, timedelta
 from .models import UserData, User
+from .sleep_import import EXPORT_EXTENSIONS
 from django.core.exceptions import ValidationError
 
 
@@ -78,4 +79,4 @@ class UserInfoUpdateForm(forms.ModelForm):
 
 class CSVImportForm(forms.Form):
     csv_file = forms.FileField(label='Выберите CSV-файл', widget=forms.ClearableFileInput(
-        attrs={'class': 'dropzone','id': 'csv-dropzone', 'accept': '.csv'}))
+        attrs={'class': 'dropzone','id': 'csv-dropzone', 'accept': ','.join(EXPORT_EXTENSIONS)}))
@@ -0,0 +1,105 @@
+# sleep_tracking_app/management/commands/benchmark_import.py
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from sleep_tracking_app.models import UserData
+from sleep_tracking_app.sleep_import import IMPORT_STAGES, ImportProgress, write_synthetic_export
+from sleep_tracking_app.tasks import _parse_export, _store_sleep_batch
+
+MB = 1024 * 1024
+
+
+class NullRecorder:
+    """Прогресс разбора в бенчмарке никуда не пишется"""
+
+    def set_progress(self, current, total, description: str = '') -> None:
+        pass
+
+
+class StageTimer:
+    """
+    Подменяет ImportProgress в _store_sleep_batch: на каждом advance(stage, nights) добавляет этапу время
+    с прошлой отметки и запоминает пик памяти этапа (tracemalloc, если он запущен)
+    """
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(IMPORT_STAGES, 0.0)
+        self.peak = dict.fromkeys(IMPORT_STAGES, 0)
+        self._mark = time.perf_counter()
+
+    def restart(self) -> None:
+        self._mark = time.perf_counter()
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+
+    def advance(self, stage: str, nights: int) -> None:
+        self.seconds[stage] += time.perf_counter() - self._mark
+        if tracemalloc.is_tracing():
+            self.peak[stage] = max(self.peak[stage], tracemalloc.get_traced_memory()[1])
+        self.restart()
+
+
+class Command(BaseCommand):
+    help = ("Benchmark sleep import on synthetic Mi Fitness exports: throughput, per-stage timings and peak memory. "
+            "Database writes are rolled back")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nights', type=int, nargs='+', default=[30, 365, 1500],
+                            help='Размеры экспорта в ночах')
+        parser.add_argument('--hr-step', type=int, default=60, help='Шаг записи пульса, секунд')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--streaming', action='store_true', help='Разбирать экспорт кусками')
+        parser.add_argument('--no-memory', action='store_true',
+                            help='Не измерять память: tracemalloc заметно замедляет разбор')
+
+    def handle(self, *args, **options):
+        stages = list(IMPORT_STAGES)
+        self.stdout.write(' | '.join(['nights', 'rows', 'MB'] + [f'{s}, s' for s in stages]
+                                     + ['total, s', 'nights/s', 'peak MB']))
+        with tempfile.TemporaryDirectory() as directory:
+            for nights in options['nights']:
+                path = os.path.join(directory, f'export-{nights}.csv')
+                rows = write_synthetic_export(path, nights, hr_step=options['hr_step'], seed=options['seed'])
+                timer = self._run(path, options['streaming'], not options['no_memory'])
+
+                total = sum(timer.seconds.values())
+                cells = [str(nights), str(rows), f'{os.path.getsize(path) / MB:.1f}']
+                cells += [f'{timer.seconds[stage]:.2f}' for stage in stages]
+                cells += [f'{total:.2f}', f'{nights / total:.0f}' if total else '-']
+                cells.append(f'{max(timer.peak.values()) / MB:.1f}' if not options['no_memory'] else '-')
+                self.stdout.write(' | '.join(cells))
+                if not options['no_memory']:
+                    peaks = ', '.join(f'{stage} {timer.peak[stage] / MB:.1f}' for stage in stages)
+                    self.stdout.write(f'    пик памяти по этапам, MB: {peaks}')
+        self.stdout.write(self.style.SUCCESS('Готово, записи в БД откачены'))
+
+    def _run(self, path: str, streaming: bool, trace_memory: bool) -> StageTimer:
+        timer = StageTimer()
+        if trace_memory:
+            tracemalloc.start()
+        try:
+            timer.restart()
+            parsed = _parse_export(path, streaming, ImportProgress(NullRecorder()))
+            # Пачки разбора ленивы: собираем их здесь, чтобы разбор не попал во время этапов записи
+            batches = list(parsed[1]) if parsed is not None else []
+            timer.advance('parse', parsed[0] if parsed is not None else 0)
+
+            with transaction.atomic():
+                user = User.objects.create_user(username=f'benchmark-{time.time_ns()}')
+                user_data = UserData.objects.create(user=user, date_of_birth=date(1990, 1, 1), weight=70,
+                                                    gender=1, height=175)
+                for meta, items, night_hr in batches:
+                    timer.restart()
+                    _store_sleep_batch(user, user_data, meta, items, night_hr, timer)
+                transaction.set_rollback(True)
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+        return timer
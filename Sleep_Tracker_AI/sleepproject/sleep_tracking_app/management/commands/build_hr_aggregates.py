@@ -0,0 +1,41 @@
+# sleep_tracking_app/management/commands/build_hr_aggregates.py
+from django.core.management.base import BaseCommand
+from django.db import transaction
+import numpy as np
+
+from sleep_tracking_app.models import HeartRateAggregate, SleepRecord
+from sleep_tracking_app.sleep_import import read_night_heart_rate
+
+
+class Command(BaseCommand):
+    help = ("Build the heart-rate aggregate pyramid (1m, 5m, 1h) for sleep records imported before it existed "
+            "or rebuild it")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='id пользователя; по умолчанию все')
+        parser.add_argument('--rebuild', action='store_true', help='Пересобрать и записи, у которых агрегаты уже есть')
+        parser.add_argument('--batch-size', type=int, default=200, help='Записей сна в одной транзакции')
+
+    def handle(self, *args, **options):
+        records = SleepRecord.objects.all()
+        if options['user'] is not None:
+            records = records.filter(user_id=options['user'])
+        if not options['rebuild']:
+            records = records.filter(hr_aggregates__isnull=True)
+        record_ids = list(records.order_by('id').values_list('id', flat=True))
+
+        built = 0
+        size = options['batch_size']
+        for first in range(0, len(record_ids), size):
+            with transaction.atomic():
+                batch = list(SleepRecord.objects.filter(id__in=record_ids[first:first + size])
+                             .select_related('night_hr_series').only('id', 'user_id', 'night_hr_series'))
+                HeartRateAggregate.objects.filter(record__in=batch).delete()
+                aggregates = []
+                for record in batch:
+                    times, bpm = read_night_heart_rate(record)
+                    aggregates.extend(HeartRateAggregate.for_nights(record.user_id, np.full(len(times), record.id),
+                                                                    times, bpm))
+                    built += bool(len(times))
+                HeartRateAggregate.objects.bulk_create(aggregates, batch_size=500)
+        self.stdout.write(self.style.SUCCESS(f'Агрегаты пульса построены для {built} записей сна'))
@@ -0,0 +1,36 @@
+# sleep_tracking_app/management/commands/maintain_sleep_partitions.py
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from sleep_tracking_app.sleep_import import maintain_partitions
+
+
+class Command(BaseCommand):
+    help = ("Pre-create monthly partitions of heart-rate and segment tables and detach expired ones "
+            "(PostgreSQL only). Run daily from cron")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=settings.SLEEP_PARTITION_MONTHS_AHEAD,
+                            help='На сколько месяцев вперёд создать секции')
+        parser.add_argument('--retention-months', type=int, default=settings.SLEEP_PARTITION_RETENTION_MONTHS,
+                            help='Отсоединить секции старше этого числа месяцев')
+        parser.add_argument('--drop', action='store_true', help='Удалять отсоединённые секции')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stdout.write(self.style.WARNING("Секционирование доступно только на PostgreSQL"))
+            return
+
+        with transaction.atomic():
+            report = maintain_partitions(connection, months_ahead=options['months_ahead'],
+                                         retention_months=options['retention_months'], drop=options['drop'])
+
+        if not report:
+            self.stdout.write(self.style.WARNING("Таблицы не секционированы, выполните migrate"))
+            return
+        for table, changes in report.items():
+            self.stdout.write(f"{table}: создано {len(changes['created'])}, отсоединено {len(changes['detached'])}")
+            for name in changes['detached']:
+                self.stdout.write(f"    {name}")
+        self.stdout.write(self.style.SUCCESS("Готово"))
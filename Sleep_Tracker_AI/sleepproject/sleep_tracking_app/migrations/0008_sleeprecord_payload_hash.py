@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sleep_tracking_app", "0007_alter_userdata_height"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="sleeprecord",
+            name="payload_hash",
+            field=models.CharField(
+                blank=True, editable=False, max_length=32, null=True
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="sleeprecord",
+            index=models.Index(
+                fields=["user", "payload_hash"], name="sleep_track_user_id_2bb709_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sleep_tracking_app", "0008_sleeprecord_payload_hash"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SleepImportJournal",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("file_hash", models.CharField(max_length=64)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[("running", "Выполняется"), ("completed", "Завершён")],
+                        default="running",
+                        max_length=16,
+                    ),
+                ),
+                ("total_nights", models.PositiveIntegerField(default=0)),
+                ("started_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="sleep_imports",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("user", "file_hash")},
+            },
+        ),
+        migrations.CreateModel(
+            name="SleepImportCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("batch_number", models.PositiveIntegerField()),
+                ("first_night", models.BigIntegerField()),
+                ("last_night", models.BigIntegerField()),
+                ("imported", models.PositiveIntegerField(default=0)),
+                ("skipped", models.PositiveIntegerField(default=0)),
+                ("committed_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "journal",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="checkpoints",
+                        to="sleep_tracking_app.sleepimportjournal",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("journal", "batch_number")},
+            },
+        ),
+    ]
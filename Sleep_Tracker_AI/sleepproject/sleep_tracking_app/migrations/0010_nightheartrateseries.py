@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sleep_tracking_app", "0009_sleepimportjournal"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NightHeartRateSeries",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("start_time", models.DateTimeField()),
+                ("sample_count", models.PositiveIntegerField()),
+                ("offsets", models.BinaryField()),
+                ("bpm", models.BinaryField()),
+                (
+                    "record",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="night_hr_series",
+                        to="sleep_tracking_app.sleeprecord",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sleep_tracking_app", "0010_nightheartrateseries"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SleepHypnogram",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("start_time", models.DateTimeField()),
+                ("run_count", models.PositiveIntegerField()),
+                ("offsets", models.BinaryField()),
+                ("durations", models.BinaryField()),
+                ("states", models.BinaryField()),
+                (
+                    "record",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="hypnogram",
+                        to="sleep_tracking_app.sleeprecord",
+                    ),
+                ),
+            ],
+        ),
+    ]
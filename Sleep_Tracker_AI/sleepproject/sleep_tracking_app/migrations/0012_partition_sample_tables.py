@@ -0,0 +1,152 @@
+from datetime import date
+
+from django.db import migrations
+
+# Таблицы отсчётов, которые на PostgreSQL секционируются по месяцам: таблица -> колонка времени.
+# Миграция не импортирует код приложения: SQL секционирования записан здесь целиком
+TABLES = {
+    "sleep_tracking_app_nightheartrateentry": "time",
+    "sleep_tracking_app_sleepsegment": "start_time",
+}
+# Сколько месяцев вперёд создаются секции
+MONTHS_AHEAD = 3
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def is_partitioned(cursor, table):
+    cursor.execute(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [table]
+    )
+    return cursor.fetchone() is not None
+
+
+def constraints_and_indexes(cursor, table):
+    """
+    Внешние ключи и CHECK (имя, определение) и CREATE INDEX остальных индексов таблицы кроме первичного ключа.
+    Таблица пересоздаётся с теми же именами, что дал Django, чтобы его состояние миграций совпадало с БД
+    """
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = to_regclass(%s) AND contype IN ('f', 'c')",
+        [table],
+    )
+    constraints = cursor.fetchall()
+    cursor.execute(
+        "SELECT pg_get_indexdef(indexrelid) FROM pg_index "
+        "WHERE indrelid = to_regclass(%s) AND NOT indisprimary",
+        [table],
+    )
+    # У секционированной таблицы индекс родителя описан как ON ONLY: пересоздаётся на всю таблицу
+    indexes = [row[0].replace(" ON ONLY ", " ON ") for row in cursor.fetchall()]
+    return constraints, indexes
+
+
+def restore_constraints_and_indexes(cursor, table, constraints, indexes):
+    for name, definition in constraints:
+        cursor.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" {definition}')
+    for definition in indexes:
+        cursor.execute(definition)
+
+
+def partition_sample_tables(apps, schema_editor):
+    """
+    На PostgreSQL секционирует таблицы отсчётов по месяцам колонки времени (PARTITION BY RANGE),
+    на других БД ничего не делает. Создаются секции месяцев с данными и MONTHS_AHEAD месяцев вперёд
+    и секция по умолчанию. Первичный ключ становится (id, время): уникальность секционированной
+    таблицы должна включать ключ секционирования, а identity-колонка заменяется sequence
+    (до PostgreSQL 17 identity у секционированной таблицы невозможна). Состояние миграций Django
+    этого не отражает: для ORM первичный ключ по-прежнему id, имена ограничений и индексов прежние
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table, column in TABLES.items():
+            if is_partitioned(cursor, table):
+                continue
+            old = f"{table}_unpartitioned"
+            constraints, indexes = constraints_and_indexes(cursor, table)
+            cursor.execute(
+                f'SELECT coalesce(max(id), 0), min("{column}"), max("{column}") FROM "{table}"'
+            )
+            last_id, first_time, last_time = cursor.fetchone()
+
+            cursor.execute(f'ALTER TABLE "{table}" RENAME TO "{old}"')
+            cursor.execute(f'ALTER INDEX "{table}_pkey" RENAME TO "{old}_pkey"')
+            cursor.execute(
+                f'ALTER TABLE "{old}" ALTER COLUMN id DROP IDENTITY IF EXISTS'
+            )
+            cursor.execute(f'CREATE SEQUENCE "{table}_id_seq" START WITH {last_id + 1}')
+            cursor.execute(
+                f'CREATE TABLE "{table}" (LIKE "{old}" INCLUDING DEFAULTS) '
+                f'PARTITION BY RANGE ("{column}")'
+            )
+            cursor.execute(
+                f"ALTER TABLE \"{table}\" ALTER COLUMN id SET DEFAULT nextval('{table}_id_seq')"
+            )
+            cursor.execute(f'ALTER SEQUENCE "{table}_id_seq" OWNED BY "{table}".id')
+            cursor.execute(f'ALTER TABLE "{table}" ADD PRIMARY KEY (id, "{column}")')
+            cursor.execute(
+                f'CREATE TABLE "{table}_default" PARTITION OF "{table}" DEFAULT'
+            )
+
+            today = date.today()
+            first = min(first_time.date(), today) if first_time else today
+            month = date(first.year, first.month, 1)
+            last = add_months(
+                max(last_time.date(), today) if last_time else today, MONTHS_AHEAD
+            )
+            while month <= last:
+                cursor.execute(
+                    f'CREATE TABLE "{table}_p{month:%Y%m}" PARTITION OF "{table}" '
+                    f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+                )
+                month = add_months(month, 1)
+
+            cursor.execute(f'INSERT INTO "{table}" SELECT * FROM "{old}"')
+            cursor.execute(f'DROP TABLE "{old}"')
+            restore_constraints_and_indexes(cursor, table, constraints, indexes)
+
+
+def unpartition_sample_tables(apps, schema_editor):
+    """Обратно к обычным таблицам с первичным ключом id (identity) и прежними ограничениями и индексами"""
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table in TABLES:
+            if not is_partitioned(cursor, table):
+                continue
+            old = f"{table}_partitioned"
+            constraints, indexes = constraints_and_indexes(cursor, table)
+
+            cursor.execute(f'ALTER TABLE "{table}" RENAME TO "{old}"')
+            cursor.execute(f'ALTER INDEX "{table}_pkey" RENAME TO "{old}_pkey"')
+            cursor.execute(f'CREATE TABLE "{table}" (LIKE "{old}" INCLUDING DEFAULTS)')
+            cursor.execute(f'ALTER TABLE "{table}" ALTER COLUMN id DROP DEFAULT')
+            cursor.execute(f'INSERT INTO "{table}" SELECT * FROM "{old}"')
+            # Вместе с таблицей удаляются её секции и sequence id; CASCADE снимает ссылки на sequence
+            # из умолчаний секций, созданных позже через LIKE (sleep_import.partitions.create_partition)
+            cursor.execute(f'DROP TABLE "{old}" CASCADE')
+            cursor.execute(f'ALTER TABLE "{table}" ADD PRIMARY KEY (id)')
+            cursor.execute(
+                f'ALTER TABLE "{table}" ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY'
+            )
+            cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), coalesce(max(id), 0) + 1, false) "
+                f'FROM "{table}"'
+            )
+            restore_constraints_and_indexes(cursor, table, constraints, indexes)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sleep_tracking_app", "0011_sleephypnogram"),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_sample_tables, unpartition_sample_tables),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:53
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count
+
+
+def remove_duplicate_statistics(apps, schema_editor):
+    """
+    Оставляет по одной статистике на (user, date) — последнюю по id, как её показывал дашборд.
+    Если у неё нет рекомендации, переносит рекомендацию из удаляемого дубликата
+    """
+    SleepStatistics = apps.get_model("sleep_tracking_app", "SleepStatistics")
+    duplicates = (
+        SleepStatistics.objects.values("user_id", "date")
+        .annotate(rows=Count("id"))
+        .filter(rows__gt=1)
+    )
+    for key in duplicates:
+        rows = list(
+            SleepStatistics.objects.filter(
+                user_id=key["user_id"], date=key["date"]
+            ).order_by("-id")
+        )
+        keep, extra = rows[0], rows[1:]
+        if not keep.recommended:
+            donor = next((row for row in extra if row.recommended), None)
+            if donor is not None:
+                keep.recommended = donor.recommended
+                keep.health_impact = donor.health_impact
+                keep.save(update_fields=["recommended", "health_impact"])
+        SleepStatistics.objects.filter(id__in=[row.id for row in extra]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sleep_tracking_app", "0012_partition_sample_tables"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_statistics, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name="sleepstatistics",
+            unique_together={("user", "date")},
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sleep_tracking_app", "0013_sleepstatistics_unique_user_date"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="HeartRateAggregate",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "resolution",
+                    models.PositiveIntegerField(
+                        choices=[(60, "1m"), (300, "5m"), (3600, "1h")]
+                    ),
+                ),
+                ("start_time", models.DateTimeField()),
+                ("end_time", models.DateTimeField()),
+                ("bucket_count", models.PositiveIntegerField()),
+                ("sample_count", models.PositiveIntegerField()),
+                ("offsets", models.BinaryField()),
+                ("counts", models.BinaryField()),
+                ("min_bpm", models.BinaryField()),
+                ("avg_bpm", models.BinaryField()),
+                ("max_bpm", models.BinaryField()),
+                (
+                    "record",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="hr_aggregates",
+                        to="sleep_tracking_app.sleeprecord",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["user", "resolution", "start_time"],
+                        name="sleep_track_user_id_8852dd_idx",
+                    )
+                ],
+                "unique_together": {("record", "resolution")},
+            },
+        ),
+    ]
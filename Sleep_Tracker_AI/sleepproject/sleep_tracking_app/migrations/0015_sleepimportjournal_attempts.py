@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sleep_tracking_app", "0014_heartrateaggregate"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="sleepimportjournal",
+            name="attempts",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name="sleepimportjournal",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("running", "Выполняется"),
+                    ("completed", "Завершён"),
+                    ("failed", "Не удался"),
+                ],
+                default="running",
+                max_length=16,
+            ),
+        ),
+    ]
@@ -1,3 +1,6 @@
+from datetime import datetime, timezone as dt_timezone
+from typing import List
+
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
@@ -6,6 +9,10 @@ from django.db.models import QuerySet
 
 import numpy as np
 
+from .sleep_import.hr_series import encode_hr_series, decode_hr_series
+from .sleep_import.hypnogram import encode_hypnogram, decode_hypnogram
+from .sleep_import.hr_pyramid import HR_LEVELS, aggregate_heart_rate, encode_hr_aggregates, decode_hr_aggregates
+
 
 # Create your models here.
 class UserData(models.Model):  # pragma: no cover
@@ -84,12 +91,52 @@ class SleepRecord(models.Model):
                                          validators=[MinValueValidator(0),
                                                      MaxValueValidator(1440)])  # Убрать везде (устарело)
 
+    payload_hash = models.CharField(max_length=32, null=True, blank=True,
+                                    editable=False)  # отпечаток JSON ночи из экспорта, по нему пропускаются неизменённые ночи
+
+    # Поля, которые обновляются при повторном импорте той же ночи
+    UPSERT_FIELDS = [
+        'sleep_rem_duration', 'has_rem', 'min_hr', 'device_bedtime', 'sleep_deep_duration', 'wake_up_time',
+        'bedtime', 'awake_count', 'duration', 'max_hr', 'sleep_awake_duration', 'avg_hr', 'sleep_light_duration',
+        'device_wake_up_time', 'payload_hash',
+    ]
+    # Число последних ночей для хронотипа и регулярности сна на дашборде
+    LAST_NIGHTS = 7
+    # Поля, которые читает дашборд: хронотип, регулярность, тренд продолжительности и курсор страницы
+    DASHBOARD_FIELDS = ['id', 'sleep_date_time', 'device_bedtime', 'bedtime', 'wake_up_time', 'duration']
+
     class Meta:
         unique_together = ('user', 'sleep_date_time')
         indexes = [
             models.Index(fields=['user', 'sleep_date_time']),
+            models.Index(fields=['user', 'payload_hash']),
         ]
 
+    @classmethod
+    def bulk_upsert(cls, records: list, batch_size: int = 500) -> list:
+        """
+        Вставляет или обновляет записи сна пачками INSERT ... ON CONFLICT (user, sleep_date_time) DO UPDATE.
+        Возвращает те же объекты с проставленными первичными ключами
+        """
+
+        cls.objects.bulk_create(records, batch_size=batch_size, update_conflicts=True,
+                                unique_fields=['user', 'sleep_date_time'], update_fields=cls.UPSERT_FIELDS)
+
+        missing = [r for r in records if r.pk is None]
+        if missing:
+            # Бэкенд не вернул ключи (нет RETURNING) — добираем их одним запросом на пользователя
+            field = cls._meta.get_field('sleep_date_time')
+            by_user = {}
+            for record in missing:
+                by_user.setdefault(record.user_id, {})[field.to_python(record.sleep_date_time)] = record
+            for user_id, by_time in by_user.items():
+                rows = cls.objects.filter(user_id=user_id, sleep_date_time__in=list(by_time)).values_list(
+                    'sleep_date_time', 'id')
+                for sleep_date_time, pk in rows:
+                    by_time[sleep_date_time].pk = pk
+
+        return records
+
     @classmethod
     def get_last_sleep_records(cls, user) -> QuerySet:
         """
@@ -97,8 +144,7 @@ class SleepRecord(models.Model):
         относительно самой последней записи (по sleep_date_time).
         """
 
-        return cls.objects.filter(user=user).only('sleep_date_time', 'id', 'device_bedtime', 'duration', 'bedtime',
-                                                  'wake_up_time', 'night_hr_entries').order_by('-sleep_date_time')[:7]
+        return cls.objects.filter(user=user).only(*cls.DASHBOARD_FIELDS).order_by('-sleep_date_time')[:cls.LAST_NIGHTS]
 
     @classmethod
     def get_delta_days_sleep_records(cls, user: User) -> QuerySet:
@@ -125,6 +171,30 @@ class NightHeartRateEntry(models.Model):
         validators=[MinValueValidator(0), MaxValueValidator(300)])
 
 
+class NightHeartRateSeries(models.Model):
+    """
+    Ночной пульс одной записи сна одной строкой: время первого отсчёта, упакованные шаги между отсчётами
+    и упакованный пульс (кодирование — sleep_import.hr_series). Заменяет построчный NightHeartRateEntry
+    при SLEEP_HR_STORAGE = 'series'
+    """
+    record = models.OneToOneField(SleepRecord, on_delete=models.CASCADE, related_name='night_hr_series')
+    start_time = models.DateTimeField()  # время первого отсчёта
+    sample_count = models.PositiveIntegerField()  # число отсчётов
+    offsets = models.BinaryField()  # шаги между соседними отсчётами в секундах
+    bpm = models.BinaryField()  # пульс отсчётов
+
+    @classmethod
+    def from_arrays(cls, record_id: int, times: np.ndarray, bpm: np.ndarray) -> 'NightHeartRateSeries':
+        """Несохранённый ряд из массивов времени (секунды UNIX) и пульса"""
+        start, offsets, packed_bpm = encode_hr_series(times, bpm)
+        return cls(record_id=record_id, start_time=datetime.fromtimestamp(start, tz=dt_timezone.utc),
+                   sample_count=len(times), offsets=offsets, bpm=packed_bpm)
+
+    def to_arrays(self) -> tuple:
+        """Массивы int64 (время в секундах UNIX, пульс)"""
+        return decode_hr_series(int(self.start_time.timestamp()), self.sample_count, self.offsets, self.bpm)
+
+
 class SleepSegment(models.Model):
     record = models.ForeignKey(SleepRecord, on_delete=models.CASCADE, related_name='segments')
     start_time = models.DateTimeField()  # время начала сегмента сна
@@ -137,6 +207,84 @@ class SleepSegment(models.Model):
     ))  # тип сегмента сна
 
 
+class SleepHypnogram(models.Model):
+    """
+    Сегменты сна одной записи одной строкой, длинами серий: начало первого отрезка и упакованные
+    смещения, длительности и стадии отрезков (кодирование — sleep_import.hypnogram).
+    Заменяет построчный SleepSegment при SLEEP_SEGMENT_STORAGE = 'hypnogram'
+    """
+    record = models.OneToOneField(SleepRecord, on_delete=models.CASCADE, related_name='hypnogram')
+    start_time = models.DateTimeField()  # начало первого отрезка
+    run_count = models.PositiveIntegerField()  # число отрезков
+    offsets = models.BinaryField()  # начала отрезков в секундах от start_time
+    durations = models.BinaryField()  # длительности отрезков в секундах
+    states = models.BinaryField()  # стадии отрезков, как SleepSegment.state
+
+    @classmethod
+    def from_arrays(cls, record_id: int, starts: np.ndarray, ends: np.ndarray,
+                    states: np.ndarray) -> 'SleepHypnogram':
+        """Несохранённая гипнограмма из массивов начал и концов (секунды UNIX) и стадий отрезков"""
+        start, offsets, durations, packed_states = encode_hypnogram(starts, ends, states)
+        return cls(record_id=record_id, start_time=datetime.fromtimestamp(start, tz=dt_timezone.utc),
+                   run_count=len(starts), offsets=offsets, durations=durations, states=packed_states)
+
+    def to_arrays(self) -> tuple:
+        """Массивы int64 (начала, концы в секундах UNIX, стадии)"""
+        return decode_hypnogram(int(self.start_time.timestamp()), self.run_count, self.offsets, self.durations,
+                                self.states)
+
+
+class HeartRateAggregate(models.Model):
+    """
+    Агрегаты ночного пульса одной записи сна на одном уровне (корзины resolution секунд, уровни —
+    sleep_import.hr_pyramid.HR_LEVELS) одной строкой: упакованные номера корзин, число отсчётов, минимум,
+    среднее и максимум. Строятся при импорте, длинные диапазоны читаются по ним вместо сырых отсчётов
+    """
+    record = models.ForeignKey(SleepRecord, on_delete=models.CASCADE, related_name='hr_aggregates')
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    resolution = models.PositiveIntegerField(choices=[(seconds, level) for level, seconds in HR_LEVELS.items()])
+    start_time = models.DateTimeField()  # начало первой корзины
+    end_time = models.DateTimeField()  # конец последней корзины
+    bucket_count = models.PositiveIntegerField()
+    sample_count = models.PositiveIntegerField()
+    offsets = models.BinaryField()  # номера корзин от первой
+    counts = models.BinaryField()  # число отсчётов в корзинах
+    min_bpm = models.BinaryField()
+    avg_bpm = models.BinaryField()  # в десятых долях удара в минуту
+    max_bpm = models.BinaryField()
+
+    class Meta:
+        unique_together = ('record', 'resolution')
+        indexes = [
+            models.Index(fields=['user', 'resolution', 'start_time']),
+        ]
+
+    @classmethod
+    def for_nights(cls, user_id: int, record_ids: np.ndarray, times: np.ndarray,
+                   bpm: np.ndarray) -> List['HeartRateAggregate']:
+        """Несохранённые агрегаты всех уровней по отсчётам пульса (время в секундах UNIX) нескольких записей"""
+        aggregates = []
+        for resolution in HR_LEVELS.values():
+            ids, *columns = aggregate_heart_rate(record_ids, times, bpm, resolution)
+            bounds = np.flatnonzero(np.diff(ids)) + 1
+            for record_id, buckets, counts, low, avg, high in zip(
+                    ids[np.r_[0, bounds]].tolist() if len(ids) else [], *(np.split(c, bounds) for c in columns)):
+                start, *packed = encode_hr_aggregates(buckets, counts, low, avg, high, resolution)
+                aggregates.append(cls(
+                    record_id=record_id, user_id=user_id, resolution=resolution,
+                    start_time=datetime.fromtimestamp(start, tz=dt_timezone.utc),
+                    end_time=datetime.fromtimestamp(int(buckets[-1]) + resolution, tz=dt_timezone.utc),
+                    bucket_count=len(buckets), sample_count=int(counts.sum()),
+                    **dict(zip(['offsets', 'counts', 'min_bpm', 'avg_bpm', 'max_bpm'], packed)),
+                ))
+        return aggregates
+
+    def to_arrays(self) -> tuple:
+        """Массивы корзин: (начала в секундах UNIX, число отсчётов, минимум, среднее, максимум)"""
+        return decode_hr_aggregates(int(self.start_time.timestamp()), self.bucket_count, self.resolution,
+                                    self.offsets, self.counts, self.min_bpm, self.avg_bpm, self.max_bpm)
+
+
 class SleepStatistics(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
 
@@ -158,11 +306,43 @@ class SleepStatistics(models.Model):
 
     calories_burned = models.FloatField(null=True, blank=True)  # сожженные калории во сне
 
+    # Поля, которые импорт считает по записям сна; при их изменении рекомендация дня устаревает
+    METRIC_FIELDS = [
+        'latency_minutes', 'sleep_efficiency', 'sleep_phases', 'sleep_fragmentation_index', 'sleep_calories_burned',
+    ]
+    # Поля, которые sleep_recommended пишет по метрикам дня
+    RECOMMENDATION_FIELDS = ['recommended', 'health_impact']
+
     class Meta:
+        unique_together = ('user', 'date')
         indexes = [
             models.Index(fields=['user', 'date']),
         ]
 
+    @classmethod
+    def upsert_changed(cls, statistics: list, batch_size: int = 1000) -> list:
+        """
+        Записывает статистику дней пачками INSERT ... ON CONFLICT (user, date) DO UPDATE, но только для дней,
+        которых ещё нет или у которых изменились метрики: у них сбрасывается устаревшая рекомендация.
+        Дни с прежними метриками не трогаются и сохраняют рекомендацию. Возвращает записанные объекты
+        """
+        by_user = {}
+        for stat in statistics:
+            by_user.setdefault(stat.user_id, {})[stat.date] = stat
+
+        changed = []
+        for user_id, by_date in by_user.items():
+            existing = cls.objects.filter(user_id=user_id, date__in=list(by_date)).values('date', *cls.METRIC_FIELDS)
+            current = {row.pop('date'): row for row in existing}
+            changed.extend(
+                stat for day, stat in by_date.items()
+                if current.get(day) != {field: getattr(stat, field) for field in cls.METRIC_FIELDS}
+            )
+
+        cls.objects.bulk_create(changed, batch_size=batch_size, update_conflicts=True, unique_fields=['user', 'date'],
+                                update_fields=cls.METRIC_FIELDS + cls.RECOMMENDATION_FIELDS)
+        return changed
+
     @classmethod
     def get_last_sleep_statistics(cls, user: User) -> "SleepStatistics | None":
         """
@@ -181,3 +361,44 @@ class SleepStatistics(models.Model):
         """
 
         return cls.objects.filter(user=user).order_by('-date', 'id')
+
+
+class SleepImportJournal(models.Model):
+    """
+    Журнал импорта файла экспорта: по его контрольным точкам повторный запуск задачи
+    продолжает импорт с первой незаписанной пачки ночей
+    """
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sleep_imports')
+    file_hash = models.CharField(max_length=64)  # отпечаток содержимого файла экспорта
+    status = models.CharField(max_length=16, choices=(
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_COMPLETED, 'Завершён'),
+        (STATUS_FAILED, 'Не удался'),
+    ), default=STATUS_RUNNING)
+    total_nights = models.PositiveIntegerField(default=0)  # ночей в файле
+    attempts = models.PositiveIntegerField(default=0)  # запусков задачи импорта для незавершённого журнала
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'file_hash')
+
+
+class SleepImportCheckpoint(models.Model):
+    """
+    Записанная пачка ночей: создаётся в той же транзакции, что и данные пачки
+    """
+    journal = models.ForeignKey(SleepImportJournal, on_delete=models.CASCADE, related_name='checkpoints')
+    batch_number = models.PositiveIntegerField()  # номер пачки в порядке разбора файла
+    first_night = models.BigIntegerField()  # время записи сна первой и последней ночи пачки (секунды UNIX)
+    last_night = models.BigIntegerField()
+    imported = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    committed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('journal', 'batch_number')
@@ -0,0 +1,18 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import SleepImportJournal
+from .sleep_import import discard_parsed_export
+
+
+@receiver(post_delete, sender=SleepImportJournal)
+def discard_journal_parse_cache(sender, instance: SleepImportJournal, **kwargs) -> None:
+    """
+    Удаляет кеш разбора экспорта вместе с журналом его импорта (в том числе при удалении пользователя),
+    если тот же файл не импортировал другой пользователь
+    """
+    if not SleepImportJournal.objects.filter(file_hash=instance.file_hash).exists():
+        transaction.on_commit(partial(discard_parsed_export, instance.file_hash))
@@ -0,0 +1,80 @@
+from .copy_loader import copy_rows
+from .json_decoding import loads, loads_many, decode_heart_rate
+from .progress import IMPORT_STAGES, ThrottledProgress, ImportProgress
+from .shards import (
+    SleepFrames, split_by_month, split_batches, write_month_shards, read_shard, write_frames, read_frames,
+)
+from .journal import file_fingerprint
+from .parse_cache import (
+    PARSE_CACHE_VERSION, cache_dir, store_parsed_export, load_parsed_export, discard_parsed_export,
+    evict_parse_cache,
+)
+from .hr_series import pack_unsigned, unpack_unsigned, encode_hr_series, decode_hr_series, read_night_heart_rate
+from .hypnogram import (
+    Hypnogram, encode_hypnogram, decode_hypnogram, hypnogram_epochs, count_sleep_cycles, read_hypnogram,
+)
+from .partitions import (
+    PARTITIONED_TABLES, is_partitioned, create_partition, ensure_partitions, list_partitions,
+    detach_partitions_before, maintain_partitions,
+)
+from .hr_pyramid import (
+    HR_LEVELS, RAW_LEVEL, aggregate_heart_rate, encode_hr_aggregates, decode_hr_aggregates, choose_hr_level,
+    level_for_resolution,
+)
+from .synthetic import write_synthetic_export
+from .compression import EXPORT_EXTENSIONS, ExportFormatError, detect_compression, is_compressed, open_export
+
+__all__ = [
+    'copy_rows',
+    'loads',
+    'loads_many',
+    'decode_heart_rate',
+    'IMPORT_STAGES',
+    'ThrottledProgress',
+    'ImportProgress',
+    'SleepFrames',
+    'split_by_month',
+    'split_batches',
+    'write_month_shards',
+    'read_shard',
+    'write_frames',
+    'read_frames',
+    'file_fingerprint',
+    'PARSE_CACHE_VERSION',
+    'cache_dir',
+    'store_parsed_export',
+    'load_parsed_export',
+    'discard_parsed_export',
+    'evict_parse_cache',
+    'pack_unsigned',
+    'unpack_unsigned',
+    'encode_hr_series',
+    'decode_hr_series',
+    'read_night_heart_rate',
+    'Hypnogram',
+    'encode_hypnogram',
+    'decode_hypnogram',
+    'hypnogram_epochs',
+    'count_sleep_cycles',
+    'read_hypnogram',
+    'PARTITIONED_TABLES',
+    'is_partitioned',
+    'create_partition',
+    'ensure_partitions',
+    'list_partitions',
+    'detach_partitions_before',
+    'maintain_partitions',
+    'HR_LEVELS',
+    'RAW_LEVEL',
+    'aggregate_heart_rate',
+    'encode_hr_aggregates',
+    'decode_hr_aggregates',
+    'choose_hr_level',
+    'level_for_resolution',
+    'write_synthetic_export',
+    'EXPORT_EXTENSIONS',
+    'ExportFormatError',
+    'detect_compression',
+    'is_compressed',
+    'open_export',
+]
@@ -0,0 +1,87 @@
+import gzip
+import io
+import zipfile
+import zlib
+from contextlib import contextmanager
+from typing import IO, Iterator, Tuple, Type
+
+# Сигнатуры сжатых форматов в начале файла
+GZIP_MAGIC = b'\x1f\x8b'
+ZIP_MAGIC = b'PK\x03\x04'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Расширения, которые принимает форма загрузки
+EXPORT_EXTENSIONS = ('.csv', '.csv.gz', '.gz', '.zip', '.zst')
+
+
+class ExportFormatError(ValueError):
+    """Файл экспорта не удаётся открыть: битый архив или в архиве нет CSV"""
+
+
+def detect_compression(path: str) -> str:
+    """
+    Определяет сжатие файла по сигнатуре: 'gzip', 'zip', 'zstd' или '' для обычного CSV
+    """
+    with open(path, 'rb') as f:
+        head = f.read(4)
+    if head.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if head.startswith(ZIP_MAGIC):
+        return 'zip'
+    if head.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    return ''
+
+
+def is_compressed(path: str) -> bool:
+    return detect_compression(path) != ''
+
+
+@contextmanager
+def open_export(path: str) -> Iterator[IO[str]]:
+    """
+    Открывает экспорт как текстовый поток. Сжатые файлы (.csv.gz, .zip, .zst) распаковываются
+    на лету при чтении, распакованная копия на диск не пишется. Повреждённый архив — ExportFormatError
+    """
+    compression = detect_compression(path)
+    with open(path, 'rb') as raw:
+        # Битые данные обнаруживаются только при чтении: ошибки распаковки приводятся к ExportFormatError
+        try:
+            if compression == 'gzip':
+                binary = gzip.GzipFile(fileobj=raw)
+            elif compression == 'zip':
+                binary = _open_zip_member(raw)
+            elif compression == 'zstd':
+                import zstandard
+                binary = zstandard.ZstdDecompressor().stream_reader(raw)
+            else:
+                binary = raw
+
+            with io.TextIOWrapper(binary, encoding='utf-8', newline='') as text:
+                yield text
+        except _decompression_errors(compression) as exc:
+            raise ExportFormatError('Не удалось распаковать файл') from exc
+
+
+def _decompression_errors(compression: str) -> Tuple[Type[BaseException], ...]:
+    """Исключения, которыми распаковщик сообщает о повреждённых данных"""
+    if compression == 'gzip':
+        return gzip.BadGzipFile, EOFError, zlib.error
+    if compression == 'zip':
+        return zipfile.BadZipFile, EOFError, zlib.error
+    if compression == 'zstd':
+        import zstandard
+        return (zstandard.ZstdError,)
+    return ()
+
+
+def _open_zip_member(raw: IO[bytes]) -> IO[bytes]:
+    """Поток первого CSV-файла архива"""
+    try:
+        archive = zipfile.ZipFile(raw)
+    except zipfile.BadZipFile as exc:
+        raise ExportFormatError('Повреждённый zip-архив') from exc
+    members = [info for info in archive.infolist() if not info.is_dir() and info.filename.lower().endswith('.csv')]
+    if not members:
+        raise ExportFormatError('В архиве нет CSV-файла')
+    return archive.open(members[0])
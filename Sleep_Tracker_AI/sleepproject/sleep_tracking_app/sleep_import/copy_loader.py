@@ -0,0 +1,66 @@
+import csv
+import io
+from typing import Iterable, Sequence, Type
+
+from django.db import connections, models, router
+
+
+def copy_rows(model: Type[models.Model], fields: Sequence[str], rows: Iterable[tuple], batch_size: int = 1000) -> int:
+    """
+    Массовая загрузка строк в таблицу модели без создания ORM-объектов.
+
+    fields — имена атрибутов модели в порядке значений строки (для ForeignKey — attname, например 'record_id').
+    На PostgreSQL строки передаются потоком через COPY ... FROM STDIN, на остальных бэкендах
+    (SQLite в CI) — через bulk_create пачками по batch_size.
+    Возвращает число загруженных строк
+    """
+
+    using = router.db_for_write(model)
+    connection = connections[using]
+
+    if connection.vendor != 'postgresql':
+        return _bulk_create_rows(model, fields, rows, batch_size, using)
+
+    opts = model._meta
+    columns = ', '.join(connection.ops.quote_name(opts.get_field(f).column) for f in fields)
+    sql = f'COPY {connection.ops.quote_name(opts.db_table)} ({columns}) FROM STDIN'
+
+    count = 0
+    with connection.cursor() as cursor:
+        raw = cursor.cursor
+        if hasattr(raw, 'copy'):
+            # psycopg 3: строки пишутся в поток COPY по одной, без промежуточного буфера
+            with raw.copy(sql) as copy:
+                for row in rows:
+                    copy.write_row(row)
+                    count += 1
+        else:
+            # psycopg2: COPY в формате CSV из буфера в памяти
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+            buffer.seek(0)
+            raw.copy_expert(f'{sql} WITH (FORMAT csv)', buffer)
+    return count
+
+
+def _bulk_create_rows(model: Type[models.Model], fields: Sequence[str], rows: Iterable[tuple], batch_size: int,
+                      using: str) -> int:
+    """
+    Запасной путь для бэкендов без COPY: bulk_create пачками, объекты создаются только на одну пачку
+    """
+
+    count = 0
+    batch = []
+    for row in rows:
+        batch.append(model(**dict(zip(fields, row))))
+        if len(batch) >= batch_size:
+            model.objects.using(using).bulk_create(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        model.objects.using(using).bulk_create(batch)
+        count += len(batch)
+    return count
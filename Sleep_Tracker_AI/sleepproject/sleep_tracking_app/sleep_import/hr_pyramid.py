@@ -0,0 +1,75 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from .hr_series import pack_unsigned, unpack_unsigned
+
+# Уровни агрегатов ночного пульса: имя уровня -> длина корзины в секундах, от мелкого к крупному
+HR_LEVELS = {'1m': 60, '5m': 300, '1h': 3600}
+# Имя уровня сырых отсчётов
+RAW_LEVEL = 'raw'
+# Среднее в корзине хранится целым числом десятых долей удара в минуту
+AVG_SCALE = 10
+
+
+def aggregate_heart_rate(record_ids: np.ndarray, times: np.ndarray, bpm: np.ndarray,
+                         resolution: int) -> Tuple[np.ndarray, ...]:
+    """
+    Агрегирует отсчёты пульса по корзинам resolution секунд, выровненным по эпохе UNIX, отдельно для каждой
+    записи сна. Возвращает массивы (id записи, начало корзины в секундах UNIX, число отсчётов, минимум,
+    среднее, максимум) по корзинам, упорядоченные по записи и времени
+    """
+    record_ids = np.asarray(record_ids, dtype='int64')
+    times = np.asarray(times, dtype='int64')
+    bpm = np.asarray(bpm, dtype='int64')
+    if not len(times):
+        empty = np.empty(0, dtype='int64')
+        return empty, empty, empty, empty, np.empty(0, dtype=float), empty
+
+    buckets = times - times % resolution
+    order = np.lexsort((buckets, record_ids))
+    record_ids, buckets, bpm = record_ids[order], buckets[order], bpm[order]
+    first = np.flatnonzero(np.r_[True, (record_ids[1:] != record_ids[:-1]) | (buckets[1:] != buckets[:-1])])
+    counts = np.diff(np.r_[first, len(bpm)])
+    return (record_ids[first], buckets[first], counts, np.minimum.reduceat(bpm, first),
+            np.add.reduceat(bpm, first) / counts, np.maximum.reduceat(bpm, first))
+
+
+def encode_hr_aggregates(buckets: np.ndarray, counts: np.ndarray, low: np.ndarray, avg: np.ndarray,
+                         high: np.ndarray, resolution: int) -> Tuple[int, bytes, bytes, bytes, bytes, bytes]:
+    """
+    Кодирует корзины одного уровня одной ночи: (начало первой корзины, номера корзин от неё, число отсчётов,
+    минимум, среднее в десятых долях, максимум). Корзины отсортированы по началу
+    """
+    buckets = np.asarray(buckets, dtype='int64')
+    first = int(buckets[0]) if len(buckets) else 0
+    return (first, pack_unsigned((buckets - first) // resolution), pack_unsigned(counts), pack_unsigned(low),
+            pack_unsigned(np.rint(np.asarray(avg) * AVG_SCALE)), pack_unsigned(high))
+
+
+def decode_hr_aggregates(start: int, count: int, resolution: int, offsets, counts, low, avg,
+                         high) -> Tuple[np.ndarray, ...]:
+    """
+    Обратное к encode_hr_aggregates: (начала корзин в секундах UNIX, число отсчётов, минимум, среднее, максимум)
+    """
+    return (unpack_unsigned(offsets, count) * resolution + start, unpack_unsigned(counts, count),
+            unpack_unsigned(low, count), unpack_unsigned(avg, count) / AVG_SCALE, unpack_unsigned(high, count))
+
+
+def choose_hr_level(sample_count: int, bucket_counts: Dict[str, int], max_points: int) -> Tuple[str, bool]:
+    """
+    Выбирает уровень для диапазона: сырые отсчёты, если их не больше max_points, иначе самый подробный
+    уровень агрегатов, число корзин которого в диапазоне не больше max_points. Возвращает (уровень,
+    нужно ли дополнительно прореживать): если в лимит не укладывается и самый крупный уровень,
+    берётся он и прореживается до max_points
+    """
+    if sample_count <= max_points:
+        return RAW_LEVEL, False
+    for level in HR_LEVELS:
+        if bucket_counts.get(level, 0) <= max_points:
+            return level, False
+    return list(HR_LEVELS)[-1], True
+
+
+def level_for_resolution(resolution: int) -> Optional[str]:
+    return next((level for level, seconds in HR_LEVELS.items() if seconds == resolution), None)
@@ -0,0 +1,65 @@
+from typing import Tuple
+
+import numpy as np
+
+# Допустимые ширины беззнаковых целых в упакованном ряду, байт
+PACK_WIDTHS = (1, 2, 4, 8)
+
+
+def pack_unsigned(values: np.ndarray) -> bytes:
+    """
+    Упаковывает неотрицательные целые в little-endian минимальной ширины, при которой влезает максимум.
+    Ширина не хранится: при распаковке она равна длине байтов, делённой на число значений
+    """
+    values = np.asarray(values, dtype='int64')
+    if len(values) and values.min() < 0:
+        raise ValueError('Отрицательное значение в упаковываемом ряду')
+    peak = int(values.max()) if len(values) else 0
+    width = next(w for w in PACK_WIDTHS if peak < 1 << (8 * w))
+    return values.astype(f'<u{width}').tobytes()
+
+
+def unpack_unsigned(data, count: int) -> np.ndarray:
+    if not count:
+        return np.empty(0, dtype='int64')
+    data = bytes(data)  # BinaryField отдаёт bytes или memoryview в зависимости от бэкенда
+    return np.frombuffer(data, dtype=f'<u{len(data) // count}').astype('int64')
+
+
+def encode_hr_series(times: np.ndarray, bpm: np.ndarray) -> Tuple[int, bytes, bytes]:
+    """
+    Кодирует пульс одной ночи: (время первого отсчёта, шаги между соседними отсчётами, пульс).
+    times — секунды UNIX; отсчёты сортируются по времени, так что шаги неотрицательны
+    """
+    times = np.asarray(times, dtype='int64')
+    order = np.argsort(times, kind='stable')
+    times, bpm = times[order], np.asarray(bpm, dtype='int64')[order]
+    start = int(times[0]) if len(times) else 0
+    return start, pack_unsigned(np.diff(times)), pack_unsigned(bpm)
+
+
+def decode_hr_series(start: int, count: int, offsets, bpm) -> Tuple[np.ndarray, np.ndarray]:
+    """Обратное к encode_hr_series: массивы int64 (время в секундах UNIX, пульс)"""
+    if not count:
+        return np.empty(0, dtype='int64'), np.empty(0, dtype='int64')
+    times = np.empty(count, dtype='int64')
+    times[0] = start
+    np.cumsum(unpack_unsigned(offsets, count - 1), out=times[1:])
+    times[1:] += start
+    return times, unpack_unsigned(bpm, count)
+
+
+def read_night_heart_rate(record) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Ночной пульс записи сна как массивы (время в секундах UNIX, пульс), отсортированные по времени.
+    Читает компактный ряд NightHeartRateSeries одной строкой, а для ночей, импортированных
+    построчно, — записи NightHeartRateEntry
+    """
+    series = getattr(record, 'night_hr_series', None)
+    if series is not None:
+        return series.to_arrays()
+
+    entries = sorted(record.night_hr_entries.all(), key=lambda e: e.time)
+    times = np.fromiter((int(e.time.timestamp()) for e in entries), dtype='int64', count=len(entries))
+    bpm = np.fromiter((e.bpm for e in entries), dtype='int64', count=len(entries))
+    return times, bpm
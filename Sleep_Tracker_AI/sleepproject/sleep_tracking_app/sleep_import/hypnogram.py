@@ -0,0 +1,81 @@
+from typing import Tuple
+
+import numpy as np
+
+from .hr_series import pack_unsigned, unpack_unsigned
+
+# Стадии сна Mi Fitness
+LIGHT, DEEP, REM, AWAKE = 2, 3, 4, 5
+# Длина эпохи гипнограммы в секундах, как в полисомнографии
+EPOCH_SECONDS = 30
+
+Hypnogram = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def encode_hypnogram(starts: np.ndarray, ends: np.ndarray, states: np.ndarray) -> Tuple[int, bytes, bytes, bytes]:
+    """
+    Кодирует сегменты одной ночи длинами серий: (начало первого отрезка, смещения начал отрезков от него,
+    длительности отрезков, стадии). Время — секунды UNIX; отрезки сортируются по началу,
+    отрезок с концом раньше начала сохраняется нулевой длины
+    """
+    starts = np.asarray(starts, dtype='int64')
+    order = np.argsort(starts, kind='stable')
+    starts = starts[order]
+    ends = np.asarray(ends, dtype='int64')[order]
+    states = np.asarray(states, dtype='int64')[order]
+    first = int(starts[0]) if len(starts) else 0
+    return first, pack_unsigned(starts - first), pack_unsigned(np.maximum(ends - starts, 0)), pack_unsigned(states)
+
+
+def decode_hypnogram(start: int, count: int, offsets, durations, states) -> Hypnogram:
+    """Обратное к encode_hypnogram: массивы int64 (начала, концы, стадии) отрезков по порядку"""
+    starts = unpack_unsigned(offsets, count) + start
+    return starts, starts + unpack_unsigned(durations, count), unpack_unsigned(states, count)
+
+
+def hypnogram_epochs(starts: np.ndarray, ends: np.ndarray, states: np.ndarray,
+                     epoch: int = EPOCH_SECONDS) -> np.ndarray:
+    """
+    Гипнограмма по эпохам: массив uint8 со стадией каждой эпохи epoch секунд от начала первого отрезка,
+    0 — эпоха вне отрезков. Отрезки отсортированы по началу; эпоха относится к отрезку, в котором начинается
+    """
+    if not len(starts):
+        return np.zeros(0, dtype='uint8')
+    first = starts.min()
+    epoch_starts = np.arange(first, ends.max(), epoch)
+    run = np.searchsorted(starts, epoch_starts, side='right') - 1
+    inside = epoch_starts < ends[run]
+    return np.where(inside, states[run], 0).astype('uint8')
+
+
+def count_sleep_cycles(starts: np.ndarray, ends: np.ndarray, states: np.ndarray) -> int:
+    """
+    Число завершённых циклов сна. Цикл закрывается бодрствованием или концом ночи и засчитывается,
+    если в нём не меньше 90 минут сна и есть глубокий и REM сон
+    """
+    if not len(states):
+        return 0
+    awake = states == AWAKE
+    # Отрезок бодрствования закрывает цикл, в котором находится
+    cycle = np.cumsum(awake) - awake
+    asleep = np.isin(states, (LIGHT, DEEP, REM))
+    minutes = np.bincount(cycle, weights=np.where(asleep, (ends - starts) / 60, 0))
+    has_deep = np.bincount(cycle, weights=states == DEEP) > 0
+    has_rem = np.bincount(cycle, weights=states == REM) > 0
+    return int(np.count_nonzero((minutes >= 90) & has_deep & has_rem))
+
+
+def read_hypnogram(record) -> Hypnogram:
+    """
+    Сегменты записи сна как массивы (начала, концы в секундах UNIX, стадии), отсортированные по началу.
+    Читает SleepHypnogram одной строкой, а для ночей, импортированных построчно, — записи SleepSegment
+    """
+    hypnogram = getattr(record, 'hypnogram', None)
+    if hypnogram is not None:
+        return hypnogram.to_arrays()
+
+    segments = list(record.segments.order_by('start_time').values('start_time', 'end_time', 'state'))
+    starts = np.fromiter((int(s['start_time'].timestamp()) for s in segments), dtype='int64', count=len(segments))
+    ends = np.fromiter((int(s['end_time'].timestamp()) for s in segments), dtype='int64', count=len(segments))
+    states = np.fromiter((s['state'] for s in segments), dtype='int64', count=len(segments))
+    return starts, ends, states
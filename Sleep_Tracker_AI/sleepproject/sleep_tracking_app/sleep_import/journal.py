@@ -0,0 +1,16 @@
+import hashlib
+
+# Размер блока при чтении файла для отпечатка
+FINGERPRINT_BLOCK_SIZE = 1024 * 1024
+
+
+def file_fingerprint(path: str) -> str:
+    """
+    Отпечаток содержимого файла экспорта: по нему повторный запуск импорта того же файла
+    находит свой журнал. Файл читается блоками, целиком в память не загружается
+    """
+    digest = hashlib.blake2b(digest_size=32)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(FINGERPRINT_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
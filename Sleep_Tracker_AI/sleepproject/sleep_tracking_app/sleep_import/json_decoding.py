@@ -0,0 +1,37 @@
+import json
+from typing import Iterable, Tuple
+
+import numpy as np
+
+try:
+    # Быстрый декодер JSON; без него используется стандартный json
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(value):
+    """Декодирует один JSON-документ (orjson, если установлен, иначе json)"""
+    if orjson is not None:
+        return orjson.loads(value)
+    return json.loads(value)
+
+
+def loads_many(values: Iterable[str]) -> list:
+    """
+    Декодирует много JSON-документов за один вызов: строки склеиваются в один JSON-массив,
+    так что цикл разбора идёт внутри декодера, а не в Python по каждой строке
+    """
+    return loads('[' + ','.join(values) + ']')
+
+
+def decode_heart_rate(values: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Разбирает payload-ы heart_rate ({"time": ..., "bpm": ...}) сразу в массивы int64 (time, bpm),
+    без промежуточных DataFrame. Словари строк создаёт декодер внутри loads_many: с orjson это быстрее,
+    чем искать числа в тексте без словарей. Пустые ячейки (NaN, None) пропускаются
+    """
+    rows = loads_many(value for value in values if isinstance(value, str))
+    times = np.fromiter((row['time'] for row in rows), dtype='int64', count=len(rows))
+    bpm = np.fromiter((row['bpm'] for row in rows), dtype='int64', count=len(rows))
+    return times, bpm
@@ -0,0 +1,110 @@
+import json
+import os
+import shutil
+import time
+from typing import Iterable, Iterator, Optional, Tuple
+
+from django.conf import settings
+
+from .shards import SleepFrames, read_frames, write_frames
+
+# Файл-признак того, что кеш записан полностью; время его изменения — время последнего использования кеша
+COMPLETE_MARKER = 'complete.json'
+# Версия формата кеша входит в имя каталога: её повышают при изменении разбора или хранения таблиц,
+# и кеши прежних версий не читаются, а удаляются evict_parse_cache
+PARSE_CACHE_VERSION = 3
+
+
+def cache_root() -> str:
+    return settings.SLEEP_IMPORT_CACHE_DIR or os.path.join(settings.MEDIA_ROOT, 'import_cache')
+
+
+def cache_dir(file_hash: str) -> str:
+    """Каталог кеша разобранного экспорта с отпечатком file_hash"""
+    return os.path.join(cache_root(), f'{file_hash}.v{PARSE_CACHE_VERSION}')
+
+
+def store_parsed_export(file_hash: str, total: int, batches: Iterable[SleepFrames]) -> Iterator[SleepFrames]:
+    """
+    Пропускает пачки разбора дальше и попутно сохраняет каждую в колоночный кеш:
+    по файлу .npy на колонку, пачка — отдельный каталог part-NNNN.
+    Кеш считается готовым только после последней пачки
+    """
+    directory = cache_dir(file_hash)
+    shutil.rmtree(directory, ignore_errors=True)
+    number = -1
+    for number, frames in enumerate(batches):
+        write_frames(os.path.join(directory, f'part-{number:04d}'), frames)
+        yield frames
+
+    with open(os.path.join(directory, COMPLETE_MARKER), 'w', encoding='utf-8') as f:
+        json.dump({'total': total, 'parts': number + 1}, f)
+    evict_parse_cache(keep=file_hash)
+
+
+def load_parsed_export(file_hash: str) -> Optional[Tuple[int, Iterator[SleepFrames]]]:
+    """
+    Разбор экспорта из кеша: (число ночей, итератор пачек) или None, если кеша нет.
+    Колонки читаются через memory map, без разбора CSV и JSON
+    """
+    directory = cache_dir(file_hash)
+    marker = os.path.join(directory, COMPLETE_MARKER)
+    try:
+        with open(marker, encoding='utf-8') as f:
+            info = json.load(f)
+        os.utime(marker)
+    except FileNotFoundError:
+        return None
+
+    def batches() -> Iterator[SleepFrames]:
+        for number in range(info['parts']):
+            yield read_frames(os.path.join(directory, f'part-{number:04d}'))
+
+    return info['total'], batches()
+
+
+def discard_parsed_export(file_hash: str) -> None:
+    """Удаляет кеш разобранного экспорта file_hash"""
+    shutil.rmtree(cache_dir(file_hash), ignore_errors=True)
+
+
+def evict_parse_cache(keep: Optional[str] = None, now: Optional[float] = None) -> int:
+    """
+    Вытесняет кеши разобранных экспортов: прежних версий формата, не использованные дольше
+    SLEEP_IMPORT_CACHE_TTL секунд, недописанные старше того же срока и затем самые давно
+    использованные, пока кеш больше SLEEP_IMPORT_CACHE_MAX_BYTES. Кеш keep не удаляется.
+    Возвращает число удалённых каталогов
+    """
+    root = cache_root()
+    if not os.path.isdir(root):
+        return 0
+    now = time.time() if now is None else now
+    suffix = f'.v{PARSE_CACHE_VERSION}'
+    kept = cache_dir(keep) if keep else None
+
+    removed = 0
+    alive = []
+    for entry in os.scandir(root):
+        if not entry.is_dir() or entry.path == kept:
+            continue
+        marker = os.path.join(entry.path, COMPLETE_MARKER)
+        used = os.path.getmtime(marker) if os.path.exists(marker) else None
+        stale = now - (used or entry.stat().st_mtime) > settings.SLEEP_IMPORT_CACHE_TTL
+        if not entry.name.endswith(suffix) or stale:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+        elif used is not None:
+            alive.append((used, entry.path, _dir_size(entry.path)))
+
+    size = sum(item[2] for item in alive) + (_dir_size(kept) if kept and os.path.isdir(kept) else 0)
+    for _, path, bytes_ in sorted(alive):
+        if size <= settings.SLEEP_IMPORT_CACHE_MAX_BYTES:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        size -= bytes_
+        removed += 1
+    return removed
+
+
+def _dir_size(directory: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, name)) for path, _, names in os.walk(directory) for name in names)
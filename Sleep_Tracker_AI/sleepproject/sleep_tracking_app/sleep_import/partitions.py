@@ -0,0 +1,120 @@
+from datetime import date
+from typing import Iterator, List, Optional, Tuple
+
+# Таблицы отсчётов, которые на PostgreSQL секционируются по месяцам: таблица -> колонка времени
+PARTITIONED_TABLES = {
+    'sleep_tracking_app_nightheartrateentry': 'time',
+    'sleep_tracking_app_sleepsegment': 'start_time',
+}
+# Сколько месяцев вперёд секции создаются заранее
+MONTHS_AHEAD = 3
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+
+def iter_months(first: date, last: date) -> Iterator[date]:
+    """Первые числа месяцев от first до last включительно"""
+    month = month_start(first)
+    while month <= last:
+        yield month
+        month = add_months(month, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f'{table}_p{month:%Y%m}'
+
+
+def is_partitioned(connection, table: str) -> bool:
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)', [table])
+        return cursor.fetchone() is not None
+
+
+def create_partition(connection, table: str, column: str, month: date) -> bool:
+    """
+    Создаёт секцию месяца month, если её нет. Строки этого месяца, попавшие в секцию по умолчанию,
+    переносятся в новую секцию. Возвращает True, если секция создана
+    """
+    qn = connection.ops.quote_name
+    name = partition_name(table, month)
+    if name in {existing for _, existing in list_partitions(connection, table)}:
+        return False
+    start, end = month.isoformat(), add_months(month, 1).isoformat()
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE {qn(name)} (LIKE {qn(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        cursor.execute(
+            f'WITH moved AS (DELETE FROM {qn(table + "_default")} WHERE {qn(column)} >= %s AND {qn(column)} < %s '
+            f'RETURNING *) INSERT INTO {qn(name)} SELECT * FROM moved', [start, end])
+        cursor.execute(f"ALTER TABLE {qn(table)} ATTACH PARTITION {qn(name)} FOR VALUES FROM ('{start}') TO ('{end}')")
+    return True
+
+
+def ensure_partitions(connection, table: str, column: str, first: date, last: date) -> List[str]:
+    """
+    Создаёт недостающие секции месяцев от first до last (например, под исторические данные импорта).
+    Параллельные вызовы для одной таблицы упорядочиваются advisory-блокировкой до конца транзакции.
+    Возвращает имена созданных секций
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', [table])
+    existing = {month for month, _ in list_partitions(connection, table)}
+    return [partition_name(table, month) for month in iter_months(first, last)
+            if month not in existing and create_partition(connection, table, column, month)]
+
+
+def list_partitions(connection, table: str) -> List[Tuple[date, str]]:
+    """Помесячные секции таблицы: (месяц, имя секции) по возрастанию месяца, без секции по умолчанию"""
+    prefix = f'{table}_p'
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+                       'WHERE i.inhparent = to_regclass(%s)', [table])
+        names = [row[0] for row in cursor.fetchall()]
+    months = []
+    for name in names:
+        suffix = name[len(prefix):]
+        if name.startswith(prefix) and len(suffix) == 6 and suffix.isdigit():
+            months.append((date(int(suffix[:4]), int(suffix[4:]), 1), name))
+    return sorted(months)
+
+
+def detach_partitions_before(connection, table: str, month: date, drop: bool = False) -> List[str]:
+    """
+    Отсоединяет секции месяцев раньше month (их строки пропадают из таблицы, но остаются
+    в отдельных таблицах для архива); с drop=True секции удаляются. Возвращает имена секций
+    """
+    qn = connection.ops.quote_name
+    expired = [name for partition_month, name in list_partitions(connection, table) if partition_month < month]
+    with connection.cursor() as cursor:
+        for name in expired:
+            cursor.execute(f'ALTER TABLE {qn(table)} DETACH PARTITION {qn(name)}')
+            if drop:
+                cursor.execute(f'DROP TABLE {qn(name)}')
+    return expired
+
+
+def maintain_partitions(connection, months_ahead: int = MONTHS_AHEAD, retention_months: Optional[int] = None,
+                        drop: bool = False, today: Optional[date] = None) -> dict:
+    """
+    Обслуживание секций всех PARTITIONED_TABLES: создаёт секции до months_ahead месяцев вперёд и,
+    если задан retention_months, отсоединяет секции старше этого числа месяцев.
+    Возвращает {таблица: {'created': [...], 'detached': [...]}}
+    """
+    current = month_start(today or date.today())
+    report = {}
+    for table, column in PARTITIONED_TABLES.items():
+        if not is_partitioned(connection, table):
+            continue
+        created = [partition_name(table, month) for month in iter_months(current, add_months(current, months_ahead))
+                   if create_partition(connection, table, column, month)]
+        detached = []
+        if retention_months is not None:
+            detached = detach_partitions_before(connection, table, add_months(current, -retention_months), drop)
+        report[table] = {'created': created, 'detached': detached}
+    return report
@@ -0,0 +1,125 @@
+import time
+from typing import Callable, Dict
+
+# Этапы импорта: подпись для пользователя и доля этапа в общем прогрессе (в сумме 100)
+IMPORT_STAGES = {
+    'parse': ('Разбор файла', 40),
+    'upsert': ('Записи сна', 15),
+    'segments': ('Сегменты сна', 10),
+    'heart_rate': ('Ночной пульс', 20),
+    'statistics': ('Статистика сна', 15),
+}
+
+
+class ThrottledProgress:
+    """
+    Обёртка над ProgressRecorder, которая объединяет частые обновления.
+    Обновление уходит в result backend, только если с прошлой записи прошло не меньше min_interval секунд
+    и процент изменился не меньше чем на min_delta; завершение (current >= total) отправляется всегда,
+    повтор только что записанного обновления — никогда. Отложенное обновление можно дописать вызовом flush()
+    """
+
+    def __init__(self, recorder, min_interval: float = 0.5, min_delta: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.recorder = recorder
+        self.min_interval = min_interval
+        self.min_delta = min_delta
+        self.clock = clock
+        self.writes = 0
+        self._sent_at = None
+        self._sent_percent = None
+        self._pending = None
+        self._sent = None
+
+    def set_progress(self, current, total, description: str = '') -> None:
+        if (current, total, description) == self._sent:
+            self._pending = None
+            return
+        self._pending = (current, total, description)
+        percent = current * 100 / total if total else 0
+        if self._sent_at is not None and current < total:
+            if self.clock() - self._sent_at < self.min_interval:
+                return
+            if abs(percent - self._sent_percent) < self.min_delta:
+                return
+        self._send(percent)
+
+    def flush(self) -> None:
+        """Отправляет последнее отложенное обновление, если оно есть"""
+        if self._pending is not None:
+            current, total, _ = self._pending
+            self._send(current * 100 / total if total else 0)
+
+    def _send(self, percent: float) -> None:
+        self.recorder.set_progress(*self._pending)
+        self._sent = self._pending
+        self.writes += 1
+        self._sent_at = self.clock()
+        self._sent_percent = percent
+        self._pending = None
+
+
+class ImportProgress:
+    """
+    Прогресс импорта по этапам IMPORT_STAGES: общий процент — взвешенная сумма долей этапов,
+    в описании — текущий этап и число обработанных ночей. Запись в backend идёт через ThrottledProgress
+    """
+
+    def __init__(self, recorder, min_interval: float = 0.5, min_delta: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.reporter = ThrottledProgress(recorder, min_interval, min_delta, clock)
+        self.total = 0
+        self._done = dict.fromkeys(IMPORT_STAGES, 0.0)  # доля выполнения каждого этапа, 0..1
+
+    def start(self, total_nights: int) -> None:
+        self.total = total_nights
+
+    def set_stage(self, stage: str, done, total) -> None:
+        """Выставляет долю этапа как done из total (шаги разбора или ночи)"""
+        self._done[stage] = min(done / total, 1.0) if total else 1.0
+        self._report(stage)
+
+    def set_stages(self, shares: Dict[str, float]) -> None:
+        """Выставляет доли нескольких этапов (0..1) одним обновлением; в описании — последний из них"""
+        for stage, share in shares.items():
+            self._done[stage] = min(share, 1.0)
+        self._report(list(shares)[-1])
+
+    def advance(self, stage: str, nights: int) -> None:
+        """Отмечает, что этап выполнен ещё для nights ночей"""
+        self.set_stage(stage, self._done[stage] * self.total + nights, self.total)
+
+    def skip(self, nights: int) -> None:
+        """Неизменившиеся ночи сразу считаются записанными на всех этапах после разбора"""
+        for stage in IMPORT_STAGES:
+            if stage != 'parse':
+                self._done[stage] = min(self._done[stage] + nights / self.total, 1.0) if self.total else 1.0
+        self._report('statistics')
+
+    def stage(self, stage: str) -> '_StageRecorder':
+        """Адаптер с интерфейсом ProgressRecorder для одного этапа (например, для шагов разбора)"""
+        return _StageRecorder(self, stage)
+
+    def finish(self) -> None:
+        for stage in IMPORT_STAGES:
+            self._done[stage] = 1.0
+        self._report('statistics')
+        self.reporter.flush()
+
+    def _report(self, stage: str) -> None:
+        percent = sum(self._done[name] * weight for name, (_, weight) in IMPORT_STAGES.items())
+        label = IMPORT_STAGES[stage][0]
+        if self.total:
+            description = f'{label}: {round(self._done[stage] * self.total)}/{self.total}'
+        else:
+            description = label
+        self.reporter.set_progress(round(percent, 1), 100, description)
+
+
+class _StageRecorder:
+    def __init__(self, progress: ImportProgress, stage: str):
+        self.progress = progress
+        self.stage = stage
+
+    def set_progress(self, current, total, description: str = '') -> None:
+        self.progress.set_stage(self.stage, current, total)
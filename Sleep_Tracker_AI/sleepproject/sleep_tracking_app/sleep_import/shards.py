@@ -0,0 +1,107 @@
+import json
+import os
+from typing import Iterable, Iterator, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+SleepFrames = Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]
+
+# Имена таблиц пачки в порядке кортежа SleepFrames
+FRAME_NAMES = ('meta', 'items', 'night_hr')
+
+
+def split_by_month(meta: pd.DataFrame, items: pd.DataFrame, night_hr: pd.DataFrame) -> Iterator[Tuple[str, SleepFrames]]:
+    """
+    Делит разобранные ночи (формат sleep_record_from_csv) по месяцу времени записи сна (UTC).
+    Отдаёт пары ('YYYY-MM', (meta, items, night_hr))
+    """
+    months = meta.index.to_numpy(dtype='int64').astype('datetime64[s]').astype('datetime64[M]')
+    for month in np.unique(months):
+        in_month = months == month
+        nights = meta.index[in_month]
+        yield str(month), (
+            meta[in_month],
+            items[items.index.isin(nights)],
+            night_hr[night_hr['night'].isin(nights)],
+        )
+
+
+def split_batches(meta: pd.DataFrame, items: pd.DataFrame, night_hr: pd.DataFrame,
+                  batch_nights: int) -> Iterator[SleepFrames]:
+    """
+    Делит разобранные ночи на пачки по batch_nights ночей в порядке времени записи сна
+    """
+    meta = meta.sort_index(kind='stable')
+    for start in range(0, len(meta), batch_nights):
+        batch = meta.iloc[start:start + batch_nights]
+        yield batch, items[items.index.isin(batch.index)], night_hr[night_hr['night'].isin(batch.index)]
+
+
+def write_month_shards(directory: str, batches: Iterable[SleepFrames], on_batch=None) -> List[str]:
+    """
+    Раскладывает пачки ночей по шардам «месяц» (каталоги write_frames) в directory и возвращает пути к ним.
+    Пачки потокового разбора могут резать месяц: тогда у месяца будет несколько шардов.
+    on_batch(nights) вызывается после записи каждой пачки
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for number, (meta, items, night_hr) in enumerate(batches):
+        for month, frames in split_by_month(meta, items, night_hr):
+            path = os.path.join(directory, f'{month}-{number}')
+            write_frames(path, frames)
+            paths.append(path)
+        if on_batch is not None:
+            on_batch(len(meta))
+    return paths
+
+
+def read_shard(path: str) -> SleepFrames:
+    return read_frames(path)
+
+
+def write_frames(directory: str, frames: SleepFrames) -> None:
+    """Сохраняет таблицы пачки колонками: по каталогу на таблицу, по файлу .npy на колонку, без pickle"""
+    for name, frame in zip(FRAME_NAMES, frames):
+        _write_frame(os.path.join(directory, name), frame)
+
+
+def read_frames(directory: str) -> SleepFrames:
+    """Таблицы пачки, сохранённые write_frames; колонки читаются через memory map"""
+    return tuple(_read_frame(os.path.join(directory, name)) for name in FRAME_NAMES)
+
+
+def _write_frame(directory: str, frame: pd.DataFrame) -> None:
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, 'index.npy'), frame.index.to_numpy(), allow_pickle=False)
+    for number, (_, column) in enumerate(frame.items()):
+        values = column.to_numpy()
+        if values.dtype == object:
+            # Строковые колонки (payload_hash) хранятся как массив фиксированной ширины, пропуски — отдельной маской
+            missing = pd.isna(values)
+            if missing.any():
+                np.save(os.path.join(directory, f'{number}.null.npy'), missing, allow_pickle=False)
+                values = np.where(missing, '', values)
+            values = values.astype(str)
+        np.save(os.path.join(directory, f'{number}.npy'), values, allow_pickle=False)
+    with open(os.path.join(directory, 'columns.json'), 'w', encoding='utf-8') as f:
+        json.dump({'index': frame.index.name, 'columns': list(frame.columns)}, f)
+
+
+def _read_frame(directory: str) -> pd.DataFrame:
+    with open(os.path.join(directory, 'columns.json'), encoding='utf-8') as f:
+        layout = json.load(f)
+
+    def column(name: str) -> np.ndarray:
+        values = np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+        if values.dtype.kind != 'U':
+            return values
+        values = values.astype(object)
+        nulls = os.path.join(directory, f'{name}.null.npy')
+        if os.path.exists(nulls):
+            values[np.load(nulls)] = None
+        return values
+
+    index = pd.Index(column('index'), name=layout['index'])
+    return pd.DataFrame({name: column(str(number)) for number, name in enumerate(layout['columns'])},
+                        index=index, copy=False)
@@ -0,0 +1,69 @@
+import csv
+import json
+from typing import Sequence
+
+import numpy as np
+
+# Первая ночь синтетического экспорта: 2023-11-14 22:00 UTC
+FIRST_NIGHT = 1699999200
+
+# Стадии сна Mi Fitness и их доля по умолчанию: лёгкий, глубокий, REM, бодрствование
+STAGE_MIX = {2: 0.5, 3: 0.2, 4: 0.22, 5: 0.08}
+
+
+def write_synthetic_export(path: str, nights: int, hr_step: int = 60, seed: int = 0,
+                           stage_mix: dict = None, other_keys: Sequence[str] = ('steps', 'calories')) -> int:
+    """
+    Пишет детерминированный (для одного seed) экспорт Mi Fitness в формате hlth_center_fitness_data.csv:
+    по строке sleep (version 2, со стадиями) на ночь, пульс круглые сутки с шагом hr_step секунд
+    и строки других ключей раз в час, перемешанные с пульсом по времени, как в реальной выгрузке.
+    Возвращает число строк данных
+    """
+    rng = np.random.default_rng(seed)
+    stage_mix = stage_mix or STAGE_MIX
+    stages, weights = list(stage_mix), np.array(list(stage_mix.values()), dtype=float)
+    weights /= weights.sum()
+
+    rows = []
+    for night in range(nights):
+        bedtime = FIRST_NIGHT + night * 86400 + int(rng.integers(-3600, 3600))
+        start = bedtime + int(rng.integers(300, 1800))  # латентность 5-30 минут
+        wake = start + int(rng.integers(6 * 3600, 9 * 3600))
+
+        items = []
+        durations = dict.fromkeys(stages, 0)
+        awake_count = 0
+        t = start
+        while t < wake:
+            state = int(rng.choice(stages, p=weights))
+            end = min(wake, t + int(rng.integers(5, 45)) * 60)
+            items.append({'start_time': t, 'end_time': end, 'state': state})
+            durations[state] += (end - t) // 60
+            awake_count += state == 5
+            t = end
+
+        asleep = sum(minutes for state, minutes in durations.items() if state != 5)
+        payload = {
+            'avg_hr': int(rng.integers(55, 65)), 'awake_count': awake_count, 'bedtime': bedtime + 60,
+            'device_bedtime': bedtime, 'device_wake_up_time': wake, 'duration': asleep, 'has_rem': 1,
+            'has_stage': True, 'items': items, 'max_hr': int(rng.integers(75, 95)), 'min_hr': int(rng.integers(42, 52)),
+            'sleep_awake_duration': durations.get(5, 0), 'sleep_deep_duration': durations.get(3, 0),
+            'sleep_light_duration': durations.get(2, 0), 'sleep_rem_duration': durations.get(4, 0),
+            'timezone': 12, 'version': 2, 'wake_up_time': wake - 60,
+        }
+        rows.append((bedtime, 'sleep', json.dumps(payload)))
+
+    # Пульс и прочие ключи за весь период, от суток до первой ночи до конца последней
+    times = np.arange(FIRST_NIGHT - 86400, FIRST_NIGHT + nights * 86400 + 86400, hr_step)
+    bpm = np.clip(np.rint(62 + 10 * np.sin(times / 86400 * 2 * np.pi) + rng.normal(0, 4, len(times))), 35, 190)
+    rows.extend((int(ts), 'heart_rate', f'{{"time":{int(ts)},"bpm":{int(value)}}}') for ts, value in zip(times, bpm))
+    for key in other_keys:
+        for ts in range(int(times[0]), int(times[-1]), 3600):
+            rows.append((ts, key, f'{{"time":{ts},"{key}":{int(rng.integers(0, 500))}}}'))
+
+    rows.sort(key=lambda row: row[0])
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Uid', 'Sid', 'Key', 'Time', 'Value', 'UpdateTime'])
+        writer.writerows(('1', 'synthetic', key, ts, value, ts) for ts, key, value in rows)
+    return len(rows)
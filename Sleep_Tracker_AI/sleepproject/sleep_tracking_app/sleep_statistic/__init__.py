@@ -1,5 +1,5 @@
-from .calculate_sleep_statistic import chronotype_assessment, sleep_regularity, calculate_sleep_statistics_metrics, avg_sleep_duration, calculate_calories_burned, evaluate_bedtime, evaluate_wake_time, calculate_cycle_count, time_to_minutes
-from .plot_diagram import get_sleep_phases_pie_data, get_heart_rate_bell_curve_data, get_sleep_efficiency_trend, get_sleep_duration_trend
+from .calculate_sleep_statistic import chronotype_assessment, sleep_regularity, calculate_sleep_statistics_metrics, calculate_sleep_statistics_batch, avg_sleep_duration, calculate_calories_burned, calculate_calories_burned_batch, evaluate_bedtime, evaluate_wake_time, evaluate_bedtime_batch, evaluate_wake_time_batch, calculate_cycle_count, time_to_minutes
+from .plot_diagram import get_sleep_phases_pie_data, downsample_min_max, get_heart_rate_bell_curve_data, get_sleep_efficiency_trend, get_sleep_duration_trend
 from .num_to_str import interpret_chronotype
 from .gigachat import get_rec_to_prompt
 
@@ -7,15 +7,20 @@ __all__ = [
     'chronotype_assessment',
     'sleep_regularity',
     'calculate_sleep_statistics_metrics',
+    'calculate_sleep_statistics_batch',
     'avg_sleep_duration',
     'calculate_calories_burned',
+    'calculate_calories_burned_batch',
     'evaluate_bedtime',
     'evaluate_wake_time',
+    'evaluate_bedtime_batch',
+    'evaluate_wake_time_batch',
     'calculate_cycle_count',
     'time_to_minutes',
 
     'get_sleep_phases_pie_data',
 
+    'downsample_min_max',
     'get_heart_rate_bell_curve_data',
     'get_sleep_efficiency_trend',
     'get_sleep_duration_trend',
@@ -1,17 +1,27 @@
 from datetime import datetime, timedelta, time
 import numpy as np
 from ..models import SleepRecord, User
+from ..sleep_import import read_hypnogram, count_sleep_cycles
 from .num_to_str import interpret_chronotype
 
 
 def calculate_calories_burned(gender: int, weight: float, height: int, age: np.float64,
                               sleep_duration: int) -> float:
+    return float(calculate_calories_burned_batch(gender, weight, height, age, np.array([int(sleep_duration)]))[0])
+
+
+def calculate_calories_burned_batch(gender, weight, height, age, sleep_duration: np.ndarray) -> np.ndarray:
+    """
+    Калории за сон для массива ночей. Параметры пользователя — скаляры или массивы той же длины
+    (например, при пересчёте истории всех пользователей).
+    """
     # Расчёт BMR (Basal Metabolic Rate) по формуле Миффлина-Джеора
-    bmr = 10 * weight + 6.25 * height - 5 * age / 12 + 5 if gender else 10 * weight + 6.25 * height - 5 * age / 12 - 161
+    bmr = 10 * np.asarray(weight, dtype=float) + 6.25 * np.asarray(height, dtype=float) \
+        - 5 * np.asarray(age, dtype=float) / 12 + np.where(np.asarray(gender).astype(bool), 5, -161)
 
     calories_burned = (bmr * (
-            int(sleep_duration) / 60)) / 24  # round((bmr / 24 ) * 0.85 * float(sleep_duration / 60), 1)
-    return round(calories_burned, 1)
+            np.asarray(sleep_duration, dtype=float) / 60)) / 24  # round((bmr / 24 ) * 0.85 * float(sleep_duration / 60), 1)
+    return np.round(calories_burned, 1)
 
 
 def evaluate_bedtime(sleep_data: SleepRecord) -> datetime:
@@ -26,6 +36,16 @@ def evaluate_wake_time(sleep_data: SleepRecord) -> datetime:
     return sleep_data.wake_up_time
 
 
+def evaluate_bedtime_batch(device_bedtime: np.ndarray, bedtime: np.ndarray) -> np.ndarray:
+    """Более раннее из двух времён отхода ко сну; пропуски (NaN) игнорируются"""
+    return np.fmin(device_bedtime, bedtime)
+
+
+def evaluate_wake_time_batch(device_wake_up_time: np.ndarray, wake_up_time: np.ndarray) -> np.ndarray:
+    """Более позднее из двух времён пробуждения; пропуски (NaN) игнорируются"""
+    return np.fmax(device_wake_up_time, wake_up_time)
+
+
 def chronotype_assessment(sleep_records: list ) -> dict:
     """
     Если sleep_records передан — используется он, иначе делаем fallback на запрос.
@@ -86,27 +106,7 @@ def calculate_cycle_count(sleep_data: SleepRecord) -> int:
     Если цикл не завершён, то он не учитывается.
     """
 
-    # Находим последнюю запись сна для пользователя
-    segments = sleep_data.segments.order_by('start_time')
-    cycle_count = 0
-    current_cycle_duration = 0
-    has_deep = False
-    has_rem = False
-    for i, seg in enumerate(segments):
-        duration_min = (seg['end_time'] - seg['start_time']).total_seconds() / 60
-        if seg['state'] in [2, 3, 4]:  # Light, Deep, REM
-            current_cycle_duration += duration_min
-            if seg['state'] == 3:
-                has_deep = True
-            if seg['state'] == 4:
-                has_rem = True
-        if seg['state'] == 5 or i == len(segments) - 1:  # Awake or end
-            if current_cycle_duration >= 90 and has_deep and has_rem:
-                cycle_count += 1
-            current_cycle_duration = 0
-            has_deep = False
-            has_rem = False
-    return cycle_count
+    return count_sleep_cycles(*read_hypnogram(sleep_data))
 
 
 def time_to_minutes(dt, ref_hour=20):
@@ -156,43 +156,90 @@ def calculate_sleep_statistics_metrics(sleep_data: SleepRecord, age: np.float64,
     if not sleep_data:
         return {}
 
-    total_bedtime = evaluate_bedtime(sleep_data)
-    total_wake_time = evaluate_wake_time(sleep_data)
-
-    # Латентность сна в минутах
-    latency_delta = sleep_data.segments.order_by('start_time').values_list('start_time',
-                                                                           flat=True).first() - total_bedtime
-    latency_minutes = latency_delta.total_seconds() / 60 if latency_delta else 0
-
-    # Эффективность сна
-    total_time_in_bed_min = (total_wake_time - total_bedtime).total_seconds() / 60
-    sleep_efficiency = sleep_data.duration * 100 / total_time_in_bed_min if total_time_in_bed_min else 0
-
-    # Процент каждой фазы сна
-    sleep_phases = {
-        'deep': sleep_data.sleep_deep_duration / (
-                sleep_data.duration + sleep_data.sleep_awake_duration) * 100 if sleep_data.duration else 0,
-        'light': sleep_data.sleep_light_duration / (
-                sleep_data.duration + sleep_data.sleep_awake_duration) * 100 if sleep_data.duration else 0,
-        'rem': sleep_data.sleep_rem_duration / (
-                sleep_data.duration + sleep_data.sleep_awake_duration) * 100 if sleep_data.duration else 0,
-        'awake': sleep_data.sleep_awake_duration / (
-                sleep_data.duration + sleep_data.sleep_awake_duration) * 100 if sleep_data.duration else 0,
+    # Время считаем в секундах от device_bedtime, чтобы одинаково работать с aware и naive datetime
+    reference = sleep_data.device_bedtime
+    starts, _, _ = read_hypnogram(sleep_data)
+
+    def seconds(value) -> np.ndarray:
+        return np.array([(value - reference).total_seconds() if value is not None else np.nan])
+
+    def number(value) -> np.ndarray:
+        return np.array([value if value is not None else np.nan], dtype=float)
+
+    stats = calculate_sleep_statistics_batch(
+        device_bedtime=seconds(sleep_data.device_bedtime),
+        bedtime=seconds(sleep_data.bedtime),
+        device_wake_up_time=seconds(sleep_data.device_wake_up_time),
+        wake_up_time=seconds(sleep_data.wake_up_time),
+        first_segment_start=np.array([starts[0] - reference.timestamp() if len(starts) else np.nan]),
+        duration=number(sleep_data.duration),
+        sleep_deep_duration=number(sleep_data.sleep_deep_duration),
+        sleep_light_duration=number(sleep_data.sleep_light_duration),
+        sleep_rem_duration=number(sleep_data.sleep_rem_duration),
+        sleep_awake_duration=number(sleep_data.sleep_awake_duration),
+        awake_count=number(sleep_data.awake_count),
+        age=age, gender=gender, weight=weight, height=height,
+    )
+
+    return {
+        'latency_minutes': float(stats['latency_minutes'][0]),
+        'sleep_efficiency': float(stats['sleep_efficiency'][0]),
+        'sleep_phases': {phase: float(values[0]) for phase, values in stats['sleep_phases'].items()},
+        'sleep_fragmentation_index': float(stats['sleep_fragmentation_index'][0]),
+        'sleep_calories_burned': float(stats['sleep_calories_burned'][0]),
     }
 
-    # Индекс фрагментации сна
-    interpret_fragmentation = (sleep_data.awake_count / (sleep_data.duration / 60)) if sleep_data.duration else 0
+
+def calculate_sleep_statistics_batch(device_bedtime: np.ndarray, bedtime: np.ndarray,
+                                     device_wake_up_time: np.ndarray, wake_up_time: np.ndarray,
+                                     first_segment_start: np.ndarray, duration: np.ndarray,
+                                     sleep_deep_duration: np.ndarray, sleep_light_duration: np.ndarray,
+                                     sleep_rem_duration: np.ndarray, sleep_awake_duration: np.ndarray,
+                                     awake_count: np.ndarray, age, gender, weight, height) -> dict:
+    """
+    Метрики сна для N ночей сразу на массивах NumPy.
+    Время — в секундах на общей шкале (например, UNIX-время), длительности — в минутах,
+    пропуски — NaN. Параметры пользователя — скаляры или массивы длины N.
+    Возвращает словарь массивов с теми же ключами, что и calculate_sleep_statistics_metrics;
+    sleep_phases — словарь массивов по фазам
+    """
+    total_bedtime = evaluate_bedtime_batch(np.asarray(device_bedtime, dtype=float), np.asarray(bedtime, dtype=float))
+    total_wake_time = evaluate_wake_time_batch(np.asarray(device_wake_up_time, dtype=float),
+                                               np.asarray(wake_up_time, dtype=float))
+
+    duration = np.nan_to_num(np.asarray(duration, dtype=float))
+    awake_duration = np.nan_to_num(np.asarray(sleep_awake_duration, dtype=float))
+    has_duration = duration != 0
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Латентность сна в минутах (0, если у ночи нет сегментов)
+        latency_minutes = np.nan_to_num((np.asarray(first_segment_start, dtype=float) - total_bedtime) / 60)
+
+        # Эффективность сна
+        total_time_in_bed_min = np.nan_to_num((total_wake_time - total_bedtime) / 60)
+        sleep_efficiency = np.where(total_time_in_bed_min != 0, duration * 100 / total_time_in_bed_min, 0.0)
+
+        # Процент каждой фазы сна
+        denominator = duration + awake_duration
+        sleep_phases = {
+            phase: np.where(has_duration, np.nan_to_num(np.asarray(values, dtype=float)) / denominator * 100, 0.0)
+            for phase, values in (('deep', sleep_deep_duration), ('light', sleep_light_duration),
+                                  ('rem', sleep_rem_duration), ('awake', awake_duration))
+        }
+
+        # Индекс фрагментации сна
+        fragmentation = np.where(has_duration,
+                                 np.nan_to_num(np.asarray(awake_count, dtype=float)) / (duration / 60), 0.0)
 
     # Сожжённые калории во время сна (на основе BMR)
-    sleep_calories_burned = calculate_calories_burned(gender=gender, weight=weight, height=height, age=age,
-                                                      sleep_duration=sleep_data.duration)
+    calories = calculate_calories_burned_batch(gender, weight, height, age, np.trunc(duration))
 
     return {
         'latency_minutes': latency_minutes,
         'sleep_efficiency': sleep_efficiency,
         'sleep_phases': sleep_phases,
-        'sleep_fragmentation_index': interpret_fragmentation,
-        'sleep_calories_burned': sleep_calories_burned,
+        'sleep_fragmentation_index': fragmentation,
+        'sleep_calories_burned': calories,
     }
 
 
@@ -1,9 +1,16 @@
 from datetime import time
+from functools import lru_cache
 import json
 from pathlib import Path
 from django.conf import settings
 
 
+@lru_cache(maxsize=1)
+def _chronotype_interpretations() -> dict:
+    """Описания хронотипов из info.json: файл читается один раз на процесс"""
+    file_path = Path(settings.BASE_DIR) / 'sleep_tracking_app' / 'static' / 'chronotype_info' / 'info.json'
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
 
 
 def interpret_chronotype(msf_time: time, name:str, language: str) -> dict:
@@ -22,10 +29,7 @@ def interpret_chronotype(msf_time: time, name:str, language: str) -> dict:
         case _:
             interpret = ""
 
-    file_path = Path(settings.BASE_DIR) / 'sleep_tracking_app' / 'static' / 'chronotype_info' / 'info.json'
-
-    with open(file_path, 'r', encoding='utf-8') as f:
-        chronotype_interpretations = json.load(f)
+    chronotype_interpretations = _chronotype_interpretations()
     if chronotype_interpretations[name][interpret]:
         description = chronotype_interpretations[name][interpret][language]
     else:
@@ -1,6 +1,11 @@
+from typing import Optional, Tuple
+
+import numpy as np
+from django.conf import settings
 from django.db.models import QuerySet
 
 from sleep_tracking_app.models import SleepRecord, SleepStatistics
+from sleep_tracking_app.sleep_import import read_night_heart_rate
 from math import log
 
 
@@ -34,23 +39,43 @@ def get_sleep_phases_pie_data(stat: [SleepStatistics]) -> list:
     ]
 
 
-def get_heart_rate_bell_curve_data(latest_sleep: SleepRecord) -> dict:
+def downsample_min_max(times: np.ndarray, values: np.ndarray, max_points: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Прореживает ряд до не более max_points точек: ряд делится на max_points // 2 корзин
+    с равным числом отсчётов, из каждой остаются минимум и максимум в порядке времени.
+    Пики и провалы сохраняются при любой плотности отсчётов; короткий ряд возвращается как есть
+    """
+    count = len(values)
+    if count <= max(max_points, 2):
+        return times, values
+    buckets = max(max_points // 2, 1)
+    edges = np.linspace(0, count, buckets + 1).astype('int64')
+    bucket = np.repeat(np.arange(buckets), np.diff(edges))
+    # Внутри корзины отсчёты упорядочены по значению: первый — минимум, последний — максимум
+    order = np.lexsort((values, bucket))
+    keep = np.union1d(order[edges[:-1]], order[edges[1:] - 1])
+    return times[keep], values[keep]
+
+
+def get_heart_rate_bell_curve_data(latest_sleep: SleepRecord, max_points: Optional[int] = None) -> dict:
     """
-    Возвращает данные для точечной диаграммы пульса за последнюю ночь.
-    Возвращает пустой словарь, если данных о пульсе нет.
+    Возвращает данные для диаграммы пульса за последнюю ночь: время отсчётов в миллисекундах UNIX
+    и пульс, прореженные до max_points точек (по умолчанию SLEEP_HR_CHART_POINTS) с сохранением
+    пиков и провалов, а также среднее и стандартное отклонение по всем отсчётам для кривой распределения.
+    Возвращает пустые ряды, если данных о пульсе нет.
     """
     if not latest_sleep:
-        return {'date': [], 'bpm': []}
+        return {'time': [], 'bpm': []}
 
-    hr_entries = list(latest_sleep.night_hr_entries.all())
+    times, bpm = read_night_heart_rate(latest_sleep)
 
-    if not hr_entries:
-        return {'date': [], 'bpm': []}
+    if not len(times):
+        return {'time': [], 'bpm': []}
 
-    date = [e.time.strftime('%H:%M') for e in hr_entries]
-    bpm = [e.bpm for e in hr_entries]
+    mean, std = round(float(bpm.mean()), 2), round(float(bpm.std()), 2)
+    times, bpm = downsample_min_max(times, bpm, max_points or settings.SLEEP_HR_CHART_POINTS)
 
-    return {'date': date, 'bpm': bpm}
+    return {'time': (times * 1000).tolist(), 'bpm': bpm.tolist(), 'mean': mean, 'std': std}
 
 
 def get_sleep_duration_trend(items: list) -> dict:
@@ -2,7 +2,7 @@ Dropzone.options.csvDropzone = {
     paramName: 'csv_file',
     maxFiles: 13,
     parallelUploads: 3,
-    acceptedFiles: '.csv',
+    acceptedFiles: '.csv,.gz,.zip,.zst',
     autoProcessQueue: true,
 
     init: function () {
@@ -15,9 +15,9 @@ Dropzone.options.csvDropzone = {
         this.on('addedfile', function (file) {
             errorElement.style.display = 'none';
 
-            // Проверка расширения файла
+            // Проверка расширения файла: CSV или сжатый экспорт (.csv.gz, .zip, .zst)
             const extension = file.name.split('.').pop().toLowerCase();
-            if (extension !== 'csv') {
+            if (!['csv', 'gz', 'zip', 'zst'].includes(extension)) {
                 errorElement.style.display = 'block';
                 dzInstance.removeFile(file);  // Используем сохраненную ссылку
                 return false;  // Блокируем обработку файла
@@ -64,6 +64,11 @@ Dropzone.options.csvDropzone = {
         this.on('error', function (file, errorMessage) {
             progressBarWrapper.style.display = 'none';
 
+            // Сервер отклоняет неподходящий файл ответом JSON {status, message}
+            if (typeof errorMessage === 'object' && errorMessage !== null) {
+                errorMessage = errorMessage.message || 'Некорректный файл';
+            }
+
             // Показываем кастомную ошибку для неподдерживаемых типов
             if (errorMessage.includes('You can\'t upload files of this type')) {
                 errorElement.style.opacity = '0';
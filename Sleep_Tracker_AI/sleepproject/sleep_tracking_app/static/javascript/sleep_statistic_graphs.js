@@ -267,19 +267,28 @@ function bindNavigationEvents() {
 
 
 function BPMGraph(containerId, heartRateData) {
-    const bpmValues = heartRateData.bpm.map(Number);
-
-    // Используем индекс к
-    const points = bpmValues.map((v, i) => ({
-        x: v,
-        y: i + 1,
-        name: heartRateData.date ? heartRateData.date[i] : ''
+    // Время приходит в миллисекундах UNIX, ряд уже прорежен на сервере
+    const points = heartRateData.bpm.map((v, i) => ({
+        x: Number(v),
+        y: heartRateData.time[i]
     }));
 
+    // Кривая нормального распределения по среднему и отклонению всех отсчётов ночи
+    const mean = heartRateData.mean;
+    const std = heartRateData.std;
+    const curve = [];
+    if (std > 0) {
+        for (let i = 0; i <= 60; i++) {
+            const x = mean - 4 * std + i * (8 * std / 60);
+            const density = Math.exp(-0.5 * ((x - mean) / std) ** 2) / (std * Math.sqrt(2 * Math.PI));
+            curve.push([x, density]);
+        }
+    }
+
     Highcharts.chart(containerId, {
         credits: {enabled: false},
 
-        chart: {zoomType: 'x'},
+        chart: {zoomType: 'xy'},
         title: {text: 'Распределение пульса'},
 
         xAxis: [{
@@ -290,7 +299,8 @@ function BPMGraph(containerId, heartRateData) {
 
         yAxis: [
             {
-                title: {text: '№ измерения'},
+                type: 'datetime',
+                title: {text: 'Время'},
                 gridLineWidth: 0,
             },
             {
@@ -300,10 +310,10 @@ function BPMGraph(containerId, heartRateData) {
         ],
 
         plotOptions: {
-            bellcurve: {
+            spline: {
                 color: '#8053d5',
-                fillColor: 'rgba(128, 83, 213, 0.1)',
                 lineWidth: 2,
+                marker: {enabled: false},
                 tooltip: {
                     headerFormat: '',
                     pointFormat: 'Плотность: <b>{point.y:.4f}</b>',
@@ -313,19 +323,11 @@ function BPMGraph(containerId, heartRateData) {
             scatter: {
                 marker: {radius: 3, symbol: 'circle'},
                 color: '#ff5e62',
-                tooltip: {pointFormat: 'Пульс: <b>{point.x}</b> уд/мин<br/>Время: {point.name}'}
+                tooltip: {pointFormat: 'Пульс: <b>{point.x}</b> уд/мин<br/>Время: {point.y:%H:%M}'}
             }
         },
 
         series: [
-            {
-                name: 'base-bpm',
-                type: 'scatter',
-                data: bpmValues,
-                visible: false,
-                showInLegend: false,
-                enableMouseTracking: false
-            },
             {
                 name: 'Замеры пульса',
                 type: 'scatter',
@@ -334,11 +336,11 @@ function BPMGraph(containerId, heartRateData) {
             },
             {
                 name: 'Колоколообразная кривая',
-                type: 'bellcurve',
-                baseSeries: 0,
+                type: 'spline',
                 xAxis: 0,
                 yAxis: 1,
-                zIndex: -1
+                zIndex: -1,
+                data: curve
             }
         ]
     });
@@ -1,21 +1,35 @@
-from typing import List
+from typing import Dict, Iterator, List, Optional, Tuple
 
-from celery import shared_task
+from celery import shared_task, chord
+import numpy as np
 import pandas as pd
 import os
+import shutil
+from functools import partial
 
 from celery_progress.backend import ProgressRecorder
 from django.contrib.auth.models import User
 
 from sleepproject.celery import app  # Фоновая задача
 
+from django.conf import settings
 from django.core.mail import send_mass_mail
-from django.db import transaction
-
-from .csv_data_extraction import sleep_record_from_csv
-from .models import SleepRecord, SleepSegment, NightHeartRateEntry, SleepStatistics, UserData
-
-from .sleep_statistic import calculate_sleep_statistics_metrics
+from django.db import OperationalError, connections, router, transaction
+from django.db.models import F, Min, Sum
+
+from .csv_data_extraction import sleep_record_from_csv, sleep_record_batches_from_csv
+from .dashboard import bump_dashboard_version
+from .models import (
+    SleepRecord, SleepSegment, SleepHypnogram, NightHeartRateEntry, NightHeartRateSeries, HeartRateAggregate,
+    SleepStatistics, UserData, SleepImportJournal, SleepImportCheckpoint,
+)
+
+from .sleep_import import (
+    copy_rows, ImportProgress, split_batches, write_month_shards, read_shard, file_fingerprint, open_export,
+    is_compressed, load_parsed_export, store_parsed_export, evict_parse_cache, SleepFrames, is_partitioned,
+    ensure_partitions,
+)
+from .sleep_statistic import calculate_sleep_statistics_batch
 from .prompts import get_sleep_recommendation
 
 from sleep_tracking_app.rag.rag_service import RagService
@@ -23,124 +37,556 @@ from sleep_tracking_app.prompts.baseline import call_gemini
 from sleep_tracking_app.prompts.prompts_templates import create_sleep_analysis_prompt, get_system_prompt
 from sleep_tracking_app.models import UserData, SleepRecord, SleepStatistics
 
-@shared_task(bind=True, name='import_sleep_records_task')
-def import_sleep_records(self, user_id: int, csv_path: str):
-    progress_recorder = ProgressRecorder(self)
+# acks_late: задача, прерванная падением воркера, будет доставлена снова и продолжит импорт по журналу.
+# Число попыток ограничено журналом (SLEEP_IMPORT_MAX_ATTEMPTS), чтобы файл, на котором воркер падает
+# каждый раз (например, по нехватке памяти), не доставлялся бесконечно
+@shared_task(bind=True, name='import_sleep_records_task', acks_late=True, reject_on_worker_lost=True,
+             autoretry_for=(OperationalError,), retry_backoff=True, max_retries=3)
+def import_sleep_records(self, user_id: int, csv_path: str, streaming: Optional[bool] = None,
+                         incremental: bool = True, sharded: Optional[bool] = None):
+    """
+    Импорт экспорта Mi Fitness (CSV, в том числе сжатый .csv.gz, .zip или .zst).
+    streaming=True разбирает CSV кусками и пишет в БД пачками завершённых ночей, так что
+    потребление памяти не зависит от размера файла; по умолчанию режим выбирается по размеру файла.
+    incremental=True пропускает ночи, отпечаток JSON которых совпадает с сохранённым:
+    перезаписываются только новые и изменённые ночи и их статистика.
+    Статистика дней обновляется на месте, рекомендация сбрасывается только у дней с изменившимися метриками.
+    sharded=True раскладывает разобранные ночи по месяцам и заменяет задачу chord-ом:
+    месяцы пишутся параллельно подзадачами import_sleep_month с контрольными точками в том же журнале,
+    статистику считает finish_sharded_import; по умолчанию режим включается при числе ночей
+    от SLEEP_IMPORT_SHARD_MIN_NIGHTS.
+    Каждая пачка ночей фиксируется отдельной транзакцией вместе с контрольной точкой в SleepImportJournal;
+    повторный запуск для того же файла пропускает уже записанные пачки. Запуск сверх SLEEP_IMPORT_MAX_ATTEMPTS
+    для незавершённого журнала отмечает импорт неудавшимся и удаляет файл.
+    """
+    # Обновления прогресса объединяются, чтобы не писать в result backend на каждую ночь
+    progress = ImportProgress(ProgressRecorder(self), min_interval=settings.SLEEP_IMPORT_PROGRESS_INTERVAL,
+                              min_delta=settings.SLEEP_IMPORT_PROGRESS_MIN_DELTA)
 
     user = User.objects.get(pk=user_id)
     user_data = UserData.objects.get(user=user)
-    # Считаем CSV прямо по пути
-    df = pd.read_csv(csv_path, encoding='utf-8')
-    sleep_data = sleep_record_from_csv(df, progress_recorder)
 
-    if sleep_data is None:
+    # Попытка учитывается в журнале до разбора: воркер может упасть уже на нём
+    file_hash = file_fingerprint(csv_path)
+    journal, checkpoints = _open_import_journal(user, file_hash)
+    if journal.status == SleepImportJournal.STATUS_FAILED:
         os.remove(csv_path)
-        return {"status": "error", "message": "Invalid CSV file"}
+        return {"status": "error", "message": "Import failed after too many attempts"}
 
-    meta, items, night_hr = sleep_data
-    total = len(meta)
-    processed = 0
+    # Повторная обработка того же файла берёт разбор из колоночного кеша вместо CSV и JSON
+    sleep_data = load_parsed_export(file_hash) if settings.SLEEP_IMPORT_PARSE_CACHE else None
+    if sleep_data is None:
+        sleep_data = _parse_export(csv_path, streaming, progress)
+        if sleep_data is None:
+            journal.status = SleepImportJournal.STATUS_FAILED
+            journal.save(update_fields=['status', 'updated_at'])
+            os.remove(csv_path)
+            return {"status": "error", "message": "Invalid CSV file"}
+        if settings.SLEEP_IMPORT_PARSE_CACHE:
+            sleep_data = sleep_data[0], store_parsed_export(file_hash, *sleep_data)
+
+    total, batches = sleep_data
+    progress.start(total)
+    journal.total_nights = total
+    journal.save(update_fields=['total_nights', 'updated_at'])
+
+    if sharded is None:
+        sharded = total >= settings.SLEEP_IMPORT_SHARD_MIN_NIGHTS
+
+    if sharded:
+        shard_dir = os.path.join(settings.MEDIA_ROOT, 'tmp', f'import-{self.request.id}')
+        parsed = []
+
+        def on_batch(nights: int) -> None:
+            parsed.append(nights)
+            progress.set_stage('parse', sum(parsed), total)
+
+        shards = write_month_shards(shard_dir, batches, on_batch)
+        progress.reporter.flush()
+
+        # Задача заменяется chord-ом с тем же id, так что прогресс и итог видны по исходной задаче.
+        # Исходный файл удаляется только завершением chord-а или обработчиком его ошибки
+        header = [import_sleep_month.s(user_id, journal.id, number, path, incremental, self.request.id)
+                  for number, path in enumerate(shards)]
+        callback = finish_sharded_import.s(user_id, journal.id, shard_dir, csv_path, incremental).on_error(
+            discard_import_shards.si(shard_dir, csv_path))
+        return self.replace(chord(header, callback))
+
+    imported = 0
+    skipped = 0
+
+    # Каждая пачка ночей записывается сразу после разбора, в своей транзакции вместе с контрольной точкой
+    for number, (meta, items, night_hr) in enumerate(batches):
+        progress.set_stage('parse', imported + skipped + len(meta), total)
+        first_night, last_night = int(meta.index.min()), int(meta.index.max())
+
+        checkpoint = checkpoints.get(number)
+        if checkpoint is not None and (checkpoint.first_night, checkpoint.last_night) == (first_night, last_night):
+            # Пачка уже записана прошлым запуском задачи
+            imported += checkpoint.imported
+            skipped += checkpoint.skipped
+            progress.skip(len(meta))
+            continue
+
+        with transaction.atomic():
+            unchanged = 0
+            if incremental:
+                meta, items, night_hr, unchanged = _changed_nights(user, meta, items, night_hr)
+                progress.skip(unchanged)
+            if len(meta):
+                _store_sleep_batch(user, user_data, meta, items, night_hr, progress)
+            SleepImportCheckpoint.objects.update_or_create(
+                journal=journal, batch_number=number,
+                defaults={'first_night': first_night, 'last_night': last_night,
+                          'imported': len(meta), 'skipped': unchanged},
+            )
+        imported += len(meta)
+        skipped += unchanged
 
-    # Получаем данные пользователя
-    age = user_data.get_age_months()
-    gender = user_data.gender
-    weight = user_data.weight
-    height = user_data.height
+    journal.status = SleepImportJournal.STATUS_COMPLETED
+    journal.save(update_fields=['status', 'updated_at'])
+    progress.finish()
+
+    os.remove(csv_path)
+    return {"status": "completed", "imported": imported, "skipped": skipped}
+
+
+@shared_task(name='recompute_sleep_statistics_task')
+def recompute_sleep_statistics(user_id: int) -> dict:
+    """
+    Пересчитывает статистику сна пользователя по кешу разобранных экспортов, без разбора CSV и JSON
+    (например, после изменения формул). Экспорты обходятся в порядке импорта, так что ночи
+    более позднего файла перекрывают ночи раннего
+    """
+    user = User.objects.get(pk=user_id)
+    user_data = UserData.objects.get(user=user)
+    recomputed = 0
+    missing = 0
+
+    journals = SleepImportJournal.objects.filter(user=user, status=SleepImportJournal.STATUS_COMPLETED)
+    for journal in journals.order_by('started_at', 'id'):
+        cached = load_parsed_export(journal.file_hash)
+        if cached is None:
+            missing += 1
+            continue
+        _, batches = cached
+        for meta, items, _ in batches:
+            with transaction.atomic():
+                _store_sleep_statistics(user, user_data, meta, items)
+            recomputed += len(meta)
+
+    return {"status": "completed", "recomputed": recomputed, "missing_cache": missing}
 
+
+@shared_task(name='evict_import_parse_cache_task')
+def evict_import_parse_cache() -> int:
+    """Вытесняет устаревшие кеши разобранных экспортов (запускается по расписанию celery beat)"""
+    return evict_parse_cache()
+
+
+def _parse_export(csv_path: str, streaming: Optional[bool],
+                  progress: ImportProgress) -> Optional[Tuple[int, Iterator[SleepFrames]]]:
+    """
+    Разбирает файл экспорта: (число ночей, итератор пачек) или None, если данные невалидны
+    """
+    if streaming is None:
+        # Сжатый экспорт всегда распаковывается потоком прямо в разбор кусками
+        streaming = is_compressed(csv_path) or os.path.getsize(csv_path) >= settings.SLEEP_IMPORT_STREAMING_MIN_BYTES
+
+    if streaming:
+        return sleep_record_batches_from_csv(csv_path, chunksize=settings.SLEEP_IMPORT_CHUNK_SIZE,
+                                             batch_nights=settings.SLEEP_IMPORT_BATCH_NIGHTS)
+
+    # Считаем CSV прямо по пути
+    with open_export(csv_path) as f:
+        df = pd.read_csv(f)
+    sleep_data = sleep_record_from_csv(df, progress.stage('parse'))
+    del df
+    if sleep_data is None:
+        return None
+    return len(sleep_data[0]), split_batches(*sleep_data, settings.SLEEP_IMPORT_BATCH_NIGHTS)
+
+
+def _open_import_journal(user: User, file_hash: str) -> Tuple[SleepImportJournal, Dict[int, SleepImportCheckpoint]]:
+    """
+    Находит журнал импорта этого файла и учитывает в нём попытку. Если прошлый импорт файла прервался,
+    возвращает его контрольные точки по номеру пачки, а после SLEEP_IMPORT_MAX_ATTEMPTS попыток отмечает
+    журнал неудавшимся (STATUS_FAILED); иначе начинает журнал заново
+    """
+    with transaction.atomic():
+        journal, created = SleepImportJournal.objects.select_for_update().get_or_create(
+            user=user, file_hash=file_hash)
+        if not created and journal.status == SleepImportJournal.STATUS_RUNNING:
+            journal.attempts += 1
+            if journal.attempts > settings.SLEEP_IMPORT_MAX_ATTEMPTS:
+                journal.status = SleepImportJournal.STATUS_FAILED
+            journal.save(update_fields=['attempts', 'status', 'updated_at'])
+            return journal, {checkpoint.batch_number: checkpoint for checkpoint in journal.checkpoints.all()}
+
+        journal.checkpoints.all().delete()
+        journal.status = SleepImportJournal.STATUS_RUNNING
+        journal.attempts = 1
+        journal.save()
+    return journal, {}
+
+
+@shared_task(bind=True, name='import_sleep_month_task', acks_late=True,
+             autoretry_for=(OperationalError,), retry_backoff=True, max_retries=3)
+def import_sleep_month(self, user_id: int, journal_id: int, number: int, shard_path: str, incremental: bool = True,
+                       progress_task_id: Optional[str] = None) -> dict:
+    """
+    Записывает ночи одного шарда-месяца (записи сна, сегменты, ночной пульс) в своей транзакции
+    вместе с контрольной точкой number в журнале: повторный запуск шарда не пишет его заново.
+    Прогресс записи по всем шардам сообщается в задачу progress_task_id.
+    Возвращает путь шарда, ночи для статистики и число записанных и пропущенных ночей
+    """
+    user = User.objects.get(pk=user_id)
+    journal = SleepImportJournal.objects.get(pk=journal_id)
+    meta, items, night_hr = read_shard(shard_path)
+    first_night, last_night = int(meta.index.min()), int(meta.index.max())
+
+    checkpoint = journal.checkpoints.filter(batch_number=number).first()
+    if checkpoint is not None and (checkpoint.first_night, checkpoint.last_night) == (first_night, last_night):
+        # Шард уже записан прошлым запуском: какие ночи в нём изменились, неизвестно,
+        # поэтому статистика пересчитывается для всех его ночей
+        return {"shard": shard_path, "nights": meta.index.tolist(), "imported": checkpoint.imported,
+                "skipped": checkpoint.skipped}
+
+    skipped = 0
     with transaction.atomic():
-        # Создаём или обновляем базовые записи сна и собираем их в словарь
-        record_map = {}
-        for sleep_time, meta_row in meta.iterrows():
-            record, _ = SleepRecord.objects.update_or_create(
-                user=user,
-                sleep_date_time=sleep_time,
-                defaults={
-                    'sleep_rem_duration': meta_row.get('sleep_rem_duration'),
-                    'has_rem': meta_row.get('has_rem'),
-                    'min_hr': meta_row.get('min_hr'),
-                    'device_bedtime': meta_row.get('device_bedtime'),
-                    'sleep_deep_duration': meta_row.get('sleep_deep_duration'),
-                    'wake_up_time': meta_row.get('wake_up_time'),
-                    'bedtime': meta_row.get('bedtime'),
-                    'awake_count': meta_row.get('awake_count'),
-                    'duration': meta_row.get('duration'),
-                    'max_hr': meta_row.get('max_hr'),
-                    'sleep_awake_duration': meta_row.get('sleep_awake_duration'),
-                    'avg_hr': meta_row.get('avg_hr'),
-                    'sleep_light_duration': meta_row.get('sleep_light_duration'),
-                    'device_wake_up_time': meta_row.get('device_wake_up_time'),
-                }
+        if incremental:
+            meta, items, night_hr, skipped = _changed_nights(user, meta, items, night_hr)
+        if len(meta):
+            _store_sleep_nights(user, meta, items, night_hr)
+        SleepImportCheckpoint.objects.update_or_create(
+            journal=journal, batch_number=number,
+            defaults={'first_night': first_night, 'last_night': last_night,
+                      'imported': len(meta), 'skipped': skipped},
+        )
+
+    if progress_task_id is not None:
+        _report_shard_progress(self, progress_task_id, journal)
+
+    return {"shard": shard_path, "nights": meta.index.tolist(), "imported": len(meta), "skipped": skipped}
+
+
+def _report_shard_progress(task, task_id: str, journal: SleepImportJournal) -> None:
+    """
+    Прогресс импорта по шардам: разбор завершён, этапы записи ночей выполнены для ночей
+    всех записанных шардов журнала (по контрольным точкам)
+    """
+    written = journal.checkpoints.aggregate(nights=Sum(F('imported') + F('skipped')))['nights'] or 0
+    progress = ImportProgress(ProgressRecorder(_TaskState(task, task_id)))
+    progress.start(journal.total_nights)
+    share = written / journal.total_nights if journal.total_nights else 1.0
+    progress.set_stages({'parse': 1.0, 'upsert': share, 'segments': share, 'heart_rate': share})
+
+
+class _TaskState:
+    """Состояние задачи task_id вместо текущей: подзадачи chord-а пишут прогресс исходной задачи импорта"""
+
+    def __init__(self, task, task_id: str):
+        self.task = task
+        self.task_id = task_id
+
+    def update_state(self, state=None, meta=None, **kwargs) -> None:
+        self.task.update_state(task_id=self.task_id, state=state, meta=meta, **kwargs)
+
+
+@shared_task(bind=True, name='finish_sharded_import_task')
+def finish_sharded_import(self, results: List[dict], user_id: int, journal_id: int, shard_dir: str, csv_path: str,
+                          incremental: bool = True) -> dict:
+    """
+    Завершение импорта по месяцам: статистика всех записанных ночей одним векторным проходом,
+    отметка журнала и удаление шардов и исходного файла
+    """
+    user = User.objects.get(pk=user_id)
+    user_data = UserData.objects.get(user=user)
+
+    written_meta, written_items = [], []
+    for result in results:
+        meta, items, _ = read_shard(result["shard"])
+        meta = meta[meta.index.isin(result["nights"])]
+        written_meta.append(meta)
+        written_items.append(items[items.index.isin(meta.index)])
+    meta = pd.concat(written_meta)
+    items = pd.concat(written_items)
+
+    if len(meta):
+        with transaction.atomic():
+            _store_sleep_statistics(user, user_data, meta, items)
+
+    journal = SleepImportJournal.objects.get(pk=journal_id)
+    journal.status = SleepImportJournal.STATUS_COMPLETED
+    journal.save(update_fields=['status', 'updated_at'])
+    _discard_import_files(shard_dir, csv_path)
+    ProgressRecorder(self).set_progress(100, 100)
+    return {"status": "completed", "imported": sum(result["imported"] for result in results),
+            "skipped": sum(result["skipped"] for result in results)}
+
+
+@shared_task(name='discard_import_shards_task')
+def discard_import_shards(shard_dir: str, csv_path: Optional[str] = None) -> None:
+    """Удаляет шарды и исходный файл импорта, если одна из подзадач chord-а упала"""
+    _discard_import_files(shard_dir, csv_path)
+
+
+def _discard_import_files(shard_dir: str, csv_path: Optional[str]) -> None:
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    if csv_path is not None and os.path.exists(csv_path):
+        os.remove(csv_path)
+
+
+# Поля времени в метаданных ночи (секунды UNIX), которые пишутся в БД как datetime
+SLEEP_TIME_FIELDS = ['device_bedtime', 'bedtime', 'device_wake_up_time', 'wake_up_time']
+# Сегменты и пульс ночи не дальше этого числа секунд от времени записи сна
+CHILD_TIME_MARGIN = 2 * 86400
+# Поля записи сна, кроме времени, по которым считается статистика дня
+SLEEP_STATISTICS_FIELDS = [
+    'duration', 'sleep_deep_duration', 'sleep_light_duration', 'sleep_rem_duration', 'sleep_awake_duration',
+    'awake_count',
+]
+
+
+def _changed_nights(user: User, meta: pd.DataFrame, items: pd.DataFrame,
+                    night_hr: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, int]:
+    """
+    Оставляет в пачке только новые и изменённые ночи (по отпечатку JSON ночи). Повторы ночи отброшены
+    ещё при разборе: иначе отпечаток ранней копии не совпал бы с сохранённым и откатил бы ночь к ней.
+    Возвращает (meta, items, night_hr, число пропущенных ночей)
+    """
+    stored = set(SleepRecord.objects.filter(user=user, payload_hash__in=meta['payload_hash'].tolist())
+                 .values_list('payload_hash', flat=True))
+    changed = ~meta['payload_hash'].isin(stored)
+    if changed.all():
+        return meta, items, night_hr, 0
+
+    meta = meta[changed]
+    items = items[items.index.isin(meta.index)]
+    night_hr = night_hr[night_hr['night'].isin(meta.index)]
+    return meta, items, night_hr, int((~changed).sum())
+
+
+def _store_sleep_batch(user: User, user_data: UserData, meta: pd.DataFrame, items: pd.DataFrame,
+                       night_hr: pd.DataFrame, progress: Optional[ImportProgress] = None) -> None:
+    """
+    Записывает пачку ночей: записи сна, сегменты, ночной пульс и статистику этих ночей.
+    После каждого этапа отмечает его в progress
+    """
+    _store_sleep_nights(user, meta, items, night_hr, progress)
+    _store_sleep_statistics(user, user_data, meta, items)
+    if progress is not None:
+        progress.advance('statistics', len(meta))
+
+
+def _store_sleep_nights(user: User, meta: pd.DataFrame, items: pd.DataFrame, night_hr: pd.DataFrame,
+                        progress: Optional[ImportProgress] = None) -> None:
+    """
+    Записывает записи сна, сегменты и ночной пульс пачки ночей
+    """
+    def stage_done(stage: str) -> None:
+        if progress is not None:
+            progress.advance(stage, len(meta))
+
+    # Время из разбора приходит в секундах UNIX и переводится в datetime только здесь, на границе с БД
+    nights = meta.copy()
+    for field in SLEEP_TIME_FIELDS:
+        nights[field] = _to_datetimes(nights[field])
+
+    # Создаём или обновляем базовые записи сна пачками INSERT ... ON CONFLICT и собираем их в словарь
+    records = [
+        SleepRecord(user=user, sleep_date_time=sleep_time,
+                    **{field: _none_if_nan(meta_row.get(field)) for field in SleepRecord.UPSERT_FIELDS})
+        for sleep_time, meta_row in zip(_to_datetimes(meta.index), nights.to_dict('records'))
+    ]
+    SleepRecord.bulk_upsert(records)
+    record_map = dict(zip(meta.index, records))
+    _invalidate_dashboard(user)
+    stage_done('upsert')
+
+    # Удаляем старые дочерние объекты разом. Отсчёты ночи лежат рядом с её временем записи, так что диапазон
+    # времени отсекает лишние месячные секции таблиц отсчётов на PostgreSQL
+    window = _to_datetimes([meta.index.min() - CHILD_TIME_MARGIN, meta.index.max() + CHILD_TIME_MARGIN])
+    SleepSegment.objects.filter(record__in=record_map.values(), start_time__range=window).delete()
+    NightHeartRateEntry.objects.filter(record__in=record_map.values(), time__range=window).delete()
+    NightHeartRateSeries.objects.filter(record__in=record_map.values()).delete()
+    SleepHypnogram.objects.filter(record__in=record_map.values()).delete()
+    HeartRateAggregate.objects.filter(record__in=record_map.values()).delete()
+
+    record_ids = {label: record.pk for label, record in record_map.items()}
+
+    # --- сегменты сна: гипнограмма на ночь или строки в COPY прямо из колонок, без ORM-объектов ---
+    segment_ids = items.index.map(record_ids)
+    known = segment_ids.notna()
+    if settings.SLEEP_SEGMENT_STORAGE == 'hypnogram':
+        SleepHypnogram.objects.bulk_create([
+            SleepHypnogram.from_arrays(record_id, starts, ends, states)
+            for record_id, starts, ends, states in _group_by_record(
+                segment_ids[known].to_numpy(dtype='int64'), items['start_time'][known].to_numpy(dtype='int64'),
+                items['end_time'][known].to_numpy(dtype='int64'), items['state'][known].to_numpy(dtype='int64'),
             )
-            record_map[sleep_time] = record
-
-            processed += 1
-
-            progress_recorder.set_progress(processed, total, f'Обработано: {processed}/{total}')
-
-        # Удаляем старые дочерние объекты разом
-        SleepSegment.objects.filter(record__in=record_map.values()).delete()
-        NightHeartRateEntry.objects.filter(record__in=record_map.values()).delete()
-        SleepStatistics.objects.filter(user=user).delete()
-
-        # Подготавливаем объекты для bulk_create
-        segments_to_create = []
-        night_hr_to_create = []
-
-
-        # --- подготавливаем сегменты сна ---
-        for idx, seg in items.iterrows():
-            record = record_map.get(idx)
-            if record is None:
-                continue
-            segments_to_create.append(
-                SleepSegment(
-                    record=record,
-                    start_time=seg['start_time'],
-                    end_time=seg['end_time'],
-                    state=seg['state']
-                )
+        ], batch_size=500)
+    else:
+        _ensure_month_partitions(SleepSegment, 'start_time', items['start_time'][known].to_numpy(dtype='int64'))
+        copy_rows(SleepSegment, ['record_id', 'start_time', 'end_time', 'state'], zip(
+            segment_ids[known].astype('int64').tolist(), _to_datetimes(items['start_time'][known]),
+            _to_datetimes(items['end_time'][known]), items['state'][known].astype('int64').tolist(),
+        ))
+    stage_done('segments')
+
+    # --- ночной пульс ---
+    # Ночь каждого отсчёта уже проставлена при разборе, запись сна ищется по метке ночи
+    hr_ids = night_hr['night'].map(record_ids)
+    known = hr_ids.notna().to_numpy()
+    if settings.SLEEP_HR_STORAGE == 'series':
+        NightHeartRateSeries.objects.bulk_create([
+            NightHeartRateSeries.from_arrays(record_id, times, bpm)
+            for record_id, times, bpm in _group_by_record(
+                hr_ids[known].to_numpy(dtype='int64'), night_hr.index[known].to_numpy(dtype='int64'),
+                night_hr['bpm'][known].to_numpy(dtype='int64'),
             )
+        ], batch_size=500)
+    else:
+        _ensure_month_partitions(NightHeartRateEntry, 'time', night_hr.index[known].to_numpy(dtype='int64'))
+        copy_rows(NightHeartRateEntry, ['record_id', 'time', 'bpm'], zip(
+            hr_ids[known].astype('int64').tolist(), _to_datetimes(night_hr.index[known]),
+            night_hr['bpm'][known].astype('int64').tolist(),
+        ))
+    # Пирамида агрегатов пульса (1 минута, 5 минут, 1 час) для просмотра длинных диапазонов: строка на уровень ночи
+    HeartRateAggregate.objects.bulk_create(HeartRateAggregate.for_nights(
+        user.pk, hr_ids[known].to_numpy(dtype='int64'), night_hr.index[known].to_numpy(dtype='int64'),
+        night_hr['bpm'][known].to_numpy(dtype='int64'),
+    ), batch_size=500)
+    stage_done('heart_rate')
+
+
+def _ensure_month_partitions(model, column: str, epochs: np.ndarray) -> None:
+    """
+    Если таблица модели секционирована (PostgreSQL), создаёт секции месяцев, в которые попадут строки:
+    исторические ночи иначе легли бы в секцию по умолчанию
+    """
+    connection = connections[router.db_for_write(model)]
+    table = model._meta.db_table
+    if connection.vendor != 'postgresql' or not len(epochs) or not is_partitioned(connection, table):
+        return
+    first, last = pd.to_datetime([epochs.min(), epochs.max()], unit='s', utc=True)
+    ensure_partitions(connection, table, column, first.date(), last.date())
 
-        # --- подготавливаем пульс ---
-        for record in record_map.values():
-            # ночной пульс
-            night_mask = (night_hr.index >= record.device_bedtime) & (
-                    night_hr.index <= record.device_wake_up_time)
-            night_df = night_hr[night_mask]
-            night_hr_to_create.extend([
-                NightHeartRateEntry(record=record, time=idx, bpm=row['bpm'])
-                for idx, row in night_df.iterrows()
-            ])
-
-        # bulk insert
-        SleepSegment.objects.bulk_create(segments_to_create, batch_size=1000)
-        NightHeartRateEntry.objects.bulk_create(night_hr_to_create, batch_size=1000)
-
-        # --- подготавливаем статистику сна ---
-        sleep_statistic_to_create = []
-        for record in record_map.values():
-            record.refresh_from_db()
-            stats  = calculate_sleep_statistics_metrics(record, age, gender, weight, height)
-
-            sleep_statistic_to_create.append(
-                SleepStatistics(
-                    user=user,
-                    date=record.sleep_date_time.date(),
-                    latency_minutes=stats ['latency_minutes'],
-                    sleep_efficiency=stats ['sleep_efficiency'],
-                    sleep_phases=stats ['sleep_phases'],
-                    sleep_fragmentation_index=stats ['sleep_fragmentation_index'],
-                    sleep_calories_burned=stats ['sleep_calories_burned']
-                )
-            )
 
-        # bulk insert
-        SleepStatistics.objects.bulk_create(sleep_statistic_to_create, batch_size=1000)
+def _group_by_record(record_ids: np.ndarray, times: np.ndarray, *columns: np.ndarray) -> Iterator[tuple]:
+    """
+    Делит колонки пачки по записям сна: отдаёт (id записи, times, *columns) для каждой записи,
+    внутри записи строки отсортированы по times
+    """
+    if not len(record_ids):
+        return
+    order = np.lexsort((times, record_ids))
+    record_ids = record_ids[order]
+    bounds = np.flatnonzero(np.diff(record_ids)) + 1
+    parts = [np.split(column[order], bounds) for column in (times, *columns)]
+    for record_id, *values in zip(record_ids[np.r_[0, bounds]].tolist(), *parts):
+        yield (record_id, *values)
 
-    # transaction.atomic откатит изменения автоматически
 
-    os.remove(csv_path)
-    return {"status": "completed", "imported": processed}
+def _store_sleep_statistics(user: User, user_data: UserData, meta: pd.DataFrame, items: pd.DataFrame) -> None:
+    """
+    Пересчитывает статистику сна за дни переданных ночей
+    """
+    # Получаем данные пользователя
+    age = user_data.get_age_months()
+    gender = user_data.gender
+    weight = user_data.weight
+    height = user_data.height
+
+    # --- статистика сна: считается по секундам UNIX одним векторным проходом ---
+    meta, first_segment_start = _day_last_nights(user, meta, items)
+    stats = calculate_sleep_statistics_batch(
+        **{field: meta[field].to_numpy(dtype=float) for field in SLEEP_TIME_FIELDS + SLEEP_STATISTICS_FIELDS},
+        first_segment_start=first_segment_start.to_numpy(dtype=float),
+        age=age, gender=gender, weight=weight, height=height,
+    )
+    phases = pd.DataFrame(stats['sleep_phases']).to_dict('records')
+    dates = pd.to_datetime(meta.index, unit='s', utc=True).date
+
+    sleep_statistic_to_create = [
+        SleepStatistics(
+            user=user,
+            date=date,
+            latency_minutes=latency,
+            sleep_efficiency=efficiency,
+            sleep_phases=sleep_phases,
+            sleep_fragmentation_index=fragmentation,
+            sleep_calories_burned=calories
+        )
+        for date, latency, efficiency, sleep_phases, fragmentation, calories in zip(
+            dates, stats['latency_minutes'].tolist(), stats['sleep_efficiency'].tolist(), phases,
+            stats['sleep_fragmentation_index'].tolist(), stats['sleep_calories_burned'].tolist())
+    ]
+
+    # Статистика пересчитывается только за дни записанных ночей, по последней ночи дня.
+    # Дни с прежними метриками сохраняют рекомендацию
+    SleepStatistics.upsert_changed(sleep_statistic_to_create)
+    _invalidate_dashboard(user)
+
+
+def _day_last_nights(user: User, meta: pd.DataFrame, items: pd.DataFrame) -> Tuple[pd.DataFrame, pd.Series]:
+    """
+    Последняя ночь каждого дня пачки среди всех ночей пользователя за эти дни: статистика дня строится по ней,
+    даже если в пачке только более ранняя ночь дня (например, изменился дневной сон, а ночной сон пропущен
+    как неизменённый или пришёл другим файлом). Такие ночи дочитываются из БД.
+    Возвращает (метаданные последних ночей, начало первого сегмента каждой из них), индекс — секунды UNIX
+    """
+    first_segment_start = items['start_time'].groupby(level=0).min().reindex(meta.index)
+    days = pd.Series(meta.index // 86400, index=meta.index)
+    latest = meta.index.to_series().groupby(days.to_numpy()).max()
+
+    # Сначала только время записей за дни пачки, полные строки — лишь для ночей позже последней ночи пачки
+    window = _to_datetimes([latest.index.min() * 86400, (latest.index.max() + 1) * 86400])
+    candidates = SleepRecord.objects.filter(user=user, sleep_date_time__gte=window[0], sleep_date_time__lt=window[1])
+    later = [
+        record_id for record_id, sleep_time in candidates.values_list('id', 'sleep_date_time')
+        if int(sleep_time.timestamp()) > latest.get(int(sleep_time.timestamp()) // 86400, np.iinfo('int64').max)
+    ]
+    if not later:
+        return meta, first_segment_start
+
+    stored = pd.DataFrame.from_records(
+        SleepRecord.objects.filter(id__in=later).values('id', 'sleep_date_time', *SLEEP_TIME_FIELDS,
+                                                        *SLEEP_STATISTICS_FIELDS),
+        index='id',
+    )
+    for field in ['sleep_date_time'] + SLEEP_TIME_FIELDS:
+        stored[field] = [np.nan if value is None else int(value.timestamp()) for value in stored[field]]
+    # Начало первого сегмента: из гипнограммы или построчных сегментов, в зависимости от формы хранения
+    starts = dict(SleepSegment.objects.filter(record_id__in=later).values('record_id')
+                  .annotate(first=Min('start_time')).values_list('record_id', 'first'))
+    starts.update(SleepHypnogram.objects.filter(record_id__in=later).values_list('record_id', 'start_time'))
+    stored_segment_start = pd.Series([starts[pk].timestamp() if pk in starts else np.nan for pk in stored.index],
+                                     index=stored['sleep_date_time'].to_numpy(dtype='int64'))
+    stored = stored.set_index('sleep_date_time')
+    stored.index = stored.index.astype('int64')
+
+    # Из ночей каждого дня остаётся последняя
+    nights = pd.concat([meta[SLEEP_TIME_FIELDS + SLEEP_STATISTICS_FIELDS], stored]).sort_index(kind='stable')
+    last = ~pd.Series(nights.index // 86400).duplicated(keep='last').to_numpy()
+    nights = nights[last]
+    return nights, pd.concat([first_segment_start, stored_segment_start]).reindex(nights.index)
+
+
+def _invalidate_dashboard(user: User) -> None:
+    """Сбрасывает кеш дашборда пользователя после фиксации текущей транзакции"""
+    transaction.on_commit(partial(bump_dashboard_version, user.pk))
+
+
+def _to_datetimes(epochs) -> list:
+    """Секунды UNIX -> список aware datetime (UTC) для записи в БД"""
+    return pd.to_datetime(np.asarray(epochs), unit='s', utc=True).to_pydatetime().tolist()
+
+
+def _none_if_nan(value):
+    """NaN из pandas (отсутствующий ключ в JSON) записываем в БД как NULL"""
+    return None if pd.isna(value) else value
+
 
 @shared_task
 def sleep_recommended(user_data_id: int, sleep_record_id: List[int], sleep_statistics_id:List[int]):
@@ -200,7 +646,8 @@ def sleep_recommended(user_data_id: int, sleep_record_id: List[int], sleep_stati
     }
     latest_stat.health_impact = json.dumps(rag_metadata)
     """
-    latest_stat.save(update_fields=['recommended', 'health_impact'])    
+    latest_stat.save(update_fields=['recommended', 'health_impact'])
+    bump_dashboard_version(user_data.user_id)
     return latest_stat.recommended
 
 @app.task
@@ -7,6 +7,7 @@ from .tests_plot import *
 from .tests_tasks import *
 from .tests_views_additional import *
 from .test_error_handling import *
+from .tests_import import *
 
 __all__ = [
     'test_forms_validation',
@@ -16,5 +17,6 @@ __all__ = [
     'tests_plot',
     'tests_tasks',
     'tests_views_additional',
-    'test_error_handling'
+    'test_error_handling',
+    'tests_import',
 ]
@@ -7,7 +7,14 @@ from django.utils import timezone
 from datetime import timedelta
 from unittest.mock import patch, MagicMock
 from django.core.cache import cache
-from sleep_tracking_app.models import SleepRecord, SleepStatistics, UserData
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+import numpy as np
+from cursor_pagination import CursorPaginator
+from sleep_tracking_app.dashboard import build_dashboard, bump_dashboard_version, dashboard_version, \
+    load_dashboard_data
+from sleep_tracking_app.models import NightHeartRateSeries, SleepRecord, SleepStatistics, UserData
+from sleep_tracking_app.tasks import _invalidate_dashboard
 
 
 User = get_user_model()
@@ -186,3 +193,140 @@ class ExtendedViewTests(TestCase):
 
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'sleep_statistic/sleep_statistics_show.html')
+
+    @patch('sleep_tracking_app.tasks.sleep_recommended.delay')
+    def test_sleep_statistics_repeat_view_served_from_cache(self, mock_task):
+        """Повторный просмотр дашборда не делает запросов к таблицам сна, но задача рекомендации запускается"""
+        mock_task.return_value = MagicMock(id='test-task-id')
+        self.client.login(username='testuser', password='testpass123')
+        first = self.client.get(reverse('sleep_statistics_show'))
+
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(reverse('sleep_statistics_show'))
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.context['metric'], first.context['metric'])
+        self.assertEqual(second.context['plot_data'], first.context['plot_data'])
+        sleep_queries = [q['sql'] for q in queries.captured_queries if 'sleep_tracking_app_' in q['sql']]
+        self.assertEqual(sleep_queries, [])
+        self.assertEqual(mock_task.call_count, 2)
+        self.assertEqual(mock_task.call_args.kwargs['sleep_statistics_id'], [self.sleep_stat.id])
+
+    @patch('sleep_tracking_app.tasks.sleep_recommended.delay')
+    def test_sleep_statistics_new_recommendation_invalidates_cache(self, mock_task):
+        """Сохранённая рекомендация сбрасывает версию дашборда и сразу видна"""
+        mock_task.return_value = MagicMock(id='test-task-id')
+        self.client.login(username='testuser', password='testpass123')
+        self.assertIsNone(self.client.get(reverse('sleep_statistics_show')).context['rec'])
+
+        self.sleep_stat.recommended = 'Ложитесь раньше'
+        self.sleep_stat.save(update_fields=['recommended'])
+        # Без сброса версии отдаётся закешированный дашборд
+        self.assertIsNone(self.client.get(reverse('sleep_statistics_show')).context['rec'])
+
+        bump_dashboard_version(self.user.id)
+        response = self.client.get(reverse('sleep_statistics_show'))
+        self.assertEqual(response.context['rec'], 'Ложитесь раньше')
+        # Задача запускалась только пока рекомендации не было
+        self.assertEqual(mock_task.call_count, 2)
+
+    def test_import_invalidates_dashboard_after_commit(self):
+        """Импорт сбрасывает версию дашборда только после фиксации транзакции"""
+        version = dashboard_version(self.user.id)
+        with self.captureOnCommitCallbacks() as callbacks:
+            _invalidate_dashboard(self.user)
+            self.assertEqual(dashboard_version(self.user.id), version)
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        self.assertNotEqual(dashboard_version(self.user.id), version)
+
+    def test_dashboard_version_survives_eviction_without_reuse(self):
+        """Вытесненная версия заменяется новой, а не начинается заново с прежнего значения"""
+        version = dashboard_version(self.user.id)
+        cache.delete(f'sleep-dashboard:version:{self.user.id}')
+        self.assertNotEqual(dashboard_version(self.user.id), version)
+
+    def test_sleep_history_cache_is_per_user(self):
+        """История одного пользователя не отдаётся другому с тем же URL"""
+        other = User.objects.create_user(username='other', password='testpass123')
+        SleepStatistics.objects.create(user=other, date=timezone.now().date(), sleep_efficiency=42.0)
+
+        self.client.login(username='testuser', password='testpass123')
+        own = self.client.get(reverse('sleep_history'), HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+        self.client.login(username='other', password='testpass123')
+        foreign = self.client.get(reverse('sleep_history'), HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+
+        self.assertEqual(own['graph_data_json']['sleep_efficiency'], [85.3])
+        self.assertEqual(foreign['graph_data_json']['sleep_efficiency'], [42.0])
+
+    def test_sleep_history_repeat_view_served_from_cache_until_statistics_change(self):
+        """Повторная история берётся из кеша, а изменение статистики пользователя его сбрасывает"""
+        self.client.login(username='testuser', password='testpass123')
+        url = reverse('sleep_history')
+        self.client.get(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.client.get(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+        self.assertEqual([q['sql'] for q in queries.captured_queries if 'sleep_tracking_app_' in q['sql']], [])
+        self.assertEqual(cached['graph_data_json']['sleep_efficiency'], [85.3])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            SleepStatistics.upsert_changed([SleepStatistics(user=self.user, date=self.sleep_stat.date,
+                                                            sleep_efficiency=90.0)])
+            _invalidate_dashboard(self.user)
+        fresh = self.client.get(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+        self.assertEqual(fresh['graph_data_json']['sleep_efficiency'], [90.0])
+
+
+class DashboardLoaderTests(TestCase):
+    """Данные дашборда загружаются не более чем тремя запросами при любой странице"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='loader', password='testpass123')
+        self.user_data = UserData.objects.create(user=self.user, date_of_birth='1990-01-01', weight=70, gender=1,
+                                                 height=175)
+        now = timezone.now().replace(microsecond=0)
+        self.records = []
+        for night in range(12):
+            wake = now - timedelta(days=night)
+            self.records.append(SleepRecord.objects.create(
+                user=self.user, sleep_date_time=wake, device_bedtime=wake - timedelta(hours=8),
+                bedtime=wake - timedelta(hours=8), wake_up_time=wake, device_wake_up_time=wake, duration=450 + night))
+            SleepStatistics.objects.create(user=self.user, date=wake.date(), sleep_efficiency=90.0,
+                                           sleep_phases={'deep': 20, 'light': 60, 'rem': 15, 'awake': 5})
+        times = np.arange(int(now.timestamp()) - 8 * 3600, int(now.timestamp()), 60)
+        NightHeartRateSeries.from_arrays(self.records[0].id, times, np.full(len(times), 60)).save()
+
+    def test_first_page_shares_rows_with_last_nights(self):
+        for page_size in (3, 7, 30):
+            with self.subTest(page_size=page_size), self.assertNumQueries(3):
+                dashboard = build_dashboard(self.user, self.user_data, page_size)
+            self.assertEqual(len(dashboard['page']), min(page_size, 12))
+            self.assertEqual(dashboard['has_next'], page_size < 12)
+            self.assertEqual(len(dashboard['plot_data']['heart_rate']['bpm']), 8 * 60)
+            self.assertEqual(len(dashboard['pending_recommendation']['sleep_record_id']), SleepRecord.LAST_NIGHTS)
+
+    def test_cursor_pages_use_three_queries(self):
+        first = build_dashboard(self.user, self.user_data, 5)
+        paginator = CursorPaginator(SleepRecord.get_delta_days_sleep_records(self.user),
+                                    ordering=('-sleep_date_time', '-id'))
+
+        with self.assertNumQueries(3):
+            second = build_dashboard(self.user, self.user_data, 5, after=first['next_cursor'])
+        expected = paginator.page(first=5, after=first['next_cursor'])
+        self.assertEqual([r.id for r in second['page']], [r.id for r in expected])
+        self.assertEqual(second['metric']['chronotype'], first['metric']['chronotype'])
+        self.assertEqual(second['metric']['sleep_regularity'], first['metric']['sleep_regularity'])
+        self.assertEqual(second['plot_data']['heart_rate'], first['plot_data']['heart_rate'])
+
+        with self.assertNumQueries(3):
+            back = build_dashboard(self.user, self.user_data, 5, before=second['prev_cursor'])
+        expected = paginator.page(last=5, before=second['prev_cursor'])
+        self.assertEqual([r.id for r in back['page']], [r.id for r in expected])
+
+    def test_loader_returns_latest_statistics_and_nights(self):
+        statistics, last_records, page = load_dashboard_data(self.user, 7)
+        self.assertEqual(len(statistics), SleepRecord.LAST_NIGHTS)
+        self.assertEqual(statistics[0].date, self.records[0].sleep_date_time.date())
+        self.assertEqual([r.id for r in last_records], [r.id for r in self.records[:7]])
+        self.assertFalse(page.has_previous)
@@ -14,6 +14,7 @@ from sleep_tracking_app.sleep_statistic import (
     time_to_minutes,
     sleep_regularity,
     calculate_sleep_statistics_metrics,
+    calculate_sleep_statistics_batch,
     avg_sleep_duration,
 )
 
@@ -33,6 +34,9 @@ class DummySegments:
     def order_by(self, *args, **kwargs):
         return self
 
+    def values(self, *args, **kwargs):
+        return self
+
     def values_list(self, *args, **kwargs):
         class VList:
             def __init__(self, vals):
@@ -148,6 +152,32 @@ class CalculateSleepStatisticTests(unittest.TestCase):
         expected_cal = calculate_calories_burned(gender=1, weight=70.0, height=175, age=np.float64(360), sleep_duration=480)
         self.assertAlmostEqual(metrics['sleep_calories_burned'], expected_cal)
 
+    def test_calculate_sleep_statistics_batch_handles_missing_values(self):
+        hour = 3600.0
+        stats = calculate_sleep_statistics_batch(
+            device_bedtime=np.array([0.0, 0.0]),
+            bedtime=np.array([np.nan, 0.5 * hour]),
+            device_wake_up_time=np.array([8 * hour, 8 * hour]),
+            wake_up_time=np.array([7 * hour, np.nan]),
+            first_segment_start=np.array([600.0, np.nan]),
+            duration=np.array([480.0, 0.0]),
+            sleep_deep_duration=np.array([120.0, np.nan]),
+            sleep_light_duration=np.array([300.0, 0.0]),
+            sleep_rem_duration=np.array([60.0, 0.0]),
+            sleep_awake_duration=np.array([np.nan, 0.0]),
+            awake_count=np.array([2.0, np.nan]),
+            age=np.float64(360), gender=np.array([1, 0]), weight=70.0, height=175,
+        )
+
+        np.testing.assert_allclose(stats['latency_minutes'], [10, 0])
+        np.testing.assert_allclose(stats['sleep_efficiency'], [100, 0])
+        np.testing.assert_allclose(stats['sleep_phases']['deep'], [25, 0])
+        np.testing.assert_allclose(stats['sleep_fragmentation_index'], [0.25, 0])
+        self.assertEqual(stats['sleep_calories_burned'][0],
+                         calculate_calories_burned(gender=1, weight=70.0, height=175, age=np.float64(360),
+                                                   sleep_duration=480))
+        self.assertEqual(stats['sleep_calories_burned'][1], 0)
+
     def test_chronotype_assessment_with_mocked_interpret(self):
         # Monkeypatch interpret_chronotype inside module to return a dict with known key
         mod = importlib.import_module('sleep_tracking_app.sleep_statistic.calculate_sleep_statistic')
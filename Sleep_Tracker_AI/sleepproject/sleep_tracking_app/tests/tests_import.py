@@ -0,0 +1,1148 @@
+import csv
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from datetime import date
+from io import StringIO
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import zstandard
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from sleep_tracking_app.csv_data_extraction import assign_night, sleep_record_batches_from_csv, validate_sleep_export
+from sleep_tracking_app import tasks
+from sleep_tracking_app.models import (
+    UserData, SleepRecord, SleepSegment, SleepHypnogram, NightHeartRateEntry, NightHeartRateSeries, SleepStatistics,
+    SleepImportJournal, SleepImportCheckpoint, HeartRateAggregate,
+)
+from sleep_tracking_app.sleep_import import (
+    copy_rows, decode_heart_rate, json_decoding, ThrottledProgress, ImportProgress, write_synthetic_export,
+    encode_hr_series, decode_hr_series, read_night_heart_rate, encode_hypnogram, decode_hypnogram, hypnogram_epochs,
+    count_sleep_cycles, read_hypnogram, PARTITIONED_TABLES, is_partitioned, list_partitions, maintain_partitions,
+    aggregate_heart_rate, encode_hr_aggregates, decode_hr_aggregates, choose_hr_level, cache_dir,
+    store_parsed_export, load_parsed_export, evict_parse_cache,
+)
+from sleep_tracking_app.sleep_statistic import calculate_cycle_count
+from sleep_tracking_app.tasks import import_sleep_records, recompute_sleep_statistics, discard_import_shards
+
+User = get_user_model()
+
+NIGHT_START = 1700000000  # 2023-11-14 22:13:20 UTC
+
+
+def write_export_csv(path, nights=3, hr_step=600):
+    """
+    Пишет небольшой экспорт Mi Fitness: строки sleep (version 2, со стадиями), heart_rate и steps
+    """
+    rows = []
+    for n in range(nights):
+        bedtime = NIGHT_START + n * 86400
+        items = [
+            {'start_time': bedtime + 600, 'end_time': bedtime + 3600, 'state': 2},
+            {'start_time': bedtime + 3600, 'end_time': bedtime + 9000, 'state': 3},
+            {'start_time': bedtime + 9000, 'end_time': bedtime + 12600, 'state': 4},
+            {'start_time': bedtime + 12600, 'end_time': bedtime + 13200, 'state': 5},
+            {'start_time': bedtime + 13200, 'end_time': bedtime + 28800, 'state': 2},
+        ]
+        payload = {
+            'avg_hr': 60, 'awake_count': 1, 'bedtime': bedtime + 60, 'device_bedtime': bedtime,
+            'device_wake_up_time': bedtime + 28800, 'duration': 470, 'has_rem': 1, 'has_stage': True,
+            'items': items, 'max_hr': 80, 'min_hr': 50, 'sleep_awake_duration': 10,
+            'sleep_deep_duration': 90, 'sleep_light_duration': 320, 'sleep_rem_duration': 60,
+            'timezone': 12, 'version': 2, 'wake_up_time': bedtime + 28740,
+        }
+        rows.append(['u', 's', 'sleep', bedtime, json.dumps(payload), bedtime])
+    for ts in range(NIGHT_START - 3600, NIGHT_START + nights * 86400, hr_step):
+        rows.append(['u', 's', 'heart_rate', ts, json.dumps({'time': ts, 'bpm': 50 + ts % 30}), ts])
+        rows.append(['u', 's', 'steps', ts, json.dumps({'time': ts, 'steps': 10}), ts])
+
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Uid', 'Sid', 'Key', 'Time', 'Value', 'UpdateTime'])
+        writer.writerows(rows)
+
+
+def append_repeated_night(path, duration=450):
+    """
+    Дописывает в экспорт вторую копию первой ночи с другой продолжительностью
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        repeated = next(row for row in csv.reader(f) if row[2] == 'sleep')
+    payload = json.loads(repeated[4])
+    payload['duration'] = duration
+    with open(path, 'a', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerow([*repeated[:4], json.dumps(payload), repeated[5]])
+
+
+def compress_gzip(path):
+    with open(path, 'rb') as src, gzip.open(path + '.gz', 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    return path + '.gz'
+
+
+def compress_zip(path):
+    with zipfile.ZipFile(path + '.zip', 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.write(path, 'hlth_center_fitness_data.csv')
+    return path + '.zip'
+
+
+def compress_zstd(path):
+    with open(path, 'rb') as src, open(path + '.zst', 'wb') as dst:
+        zstandard.ZstdCompressor().copy_stream(src, dst)
+    return path + '.zst'
+
+
+class AssignNightTests(unittest.TestCase):
+    def test_assign_night_tags_samples_with_owning_night(self):
+        starts = np.array([100, 300], dtype='int64')
+        ends = np.array([200, 400], dtype='int64')
+        times = np.array([50, 100, 150, 199, 200, 250, 300, 399, 400, 500], dtype='int64')
+
+        owner = assign_night(times, starts, ends)
+
+        # [start, end): граница конца ночи не включается
+        self.assertEqual(owner.tolist(), [-1, 0, 0, 0, -1, -1, 1, 1, -1, -1])
+
+    def test_assign_night_unsorted_samples(self):
+        starts = np.array([100, 300], dtype='int64')
+        ends = np.array([200, 400], dtype='int64')
+        times = np.array([350, 120, 10], dtype='int64')
+
+        self.assertEqual(assign_night(times, starts, ends).tolist(), [1, 0, -1])
+
+    def test_assign_night_no_nights(self):
+        empty = np.array([], dtype='int64')
+        owner = assign_night(np.array([1, 2], dtype='int64'), empty, empty)
+        self.assertEqual(owner.tolist(), [-1, -1])
+
+
+class DecodeHeartRateTests(unittest.TestCase):
+    values = ['{"time": 1700000000, "bpm": 61}', '{"bpm": 58, "time": 1700000060}']
+
+    def test_decode_heart_rate_returns_int_arrays(self):
+        times, bpm = decode_heart_rate(self.values)
+        self.assertEqual(times.dtype, np.int64)
+        self.assertEqual(times.tolist(), [1700000000, 1700000060])
+        self.assertEqual(bpm.tolist(), [61, 58])
+
+    def test_stdlib_fallback_gives_same_result(self):
+        fast = decode_heart_rate(self.values)
+        with mock.patch.object(json_decoding, 'orjson', None):
+            plain = decode_heart_rate(self.values)
+        for a, b in zip(fast, plain):
+            np.testing.assert_array_equal(a, b)
+
+    def test_missing_cells_are_skipped(self):
+        times, bpm = decode_heart_rate(pd.Series([self.values[0], np.nan, None, self.values[1]]))
+        self.assertEqual(times.tolist(), [1700000000, 1700000060])
+        self.assertEqual(bpm.tolist(), [61, 58])
+
+    def test_empty_input(self):
+        times, bpm = decode_heart_rate([])
+        self.assertEqual(len(times), 0)
+        self.assertEqual(bpm.dtype, np.int64)
+
+
+class RecordingProgress:
+    def __init__(self):
+        self.calls = []
+
+    def set_progress(self, current, total, description=''):
+        self.calls.append((current, total, description))
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class HeartRateSeriesTests(unittest.TestCase):
+    def test_round_trip_sorts_samples(self):
+        times = np.array([NIGHT_START + 120, NIGHT_START, NIGHT_START + 60, NIGHT_START + 60])
+        bpm = np.array([58, 61, 60, 59])
+
+        start, offsets, packed = encode_hr_series(times, bpm)
+        decoded_times, decoded_bpm = decode_hr_series(start, 4, offsets, memoryview(packed))
+
+        self.assertEqual(decoded_times.tolist(), [NIGHT_START, NIGHT_START + 60, NIGHT_START + 60, NIGHT_START + 120])
+        self.assertEqual(decoded_bpm.tolist(), [61, 60, 59, 58])
+
+    def test_packing_width_follows_largest_value(self):
+        # Шаг в минуту и пульс до 255 — по байту на отсчёт; длинный разрыв и пульс выше 255 — по два
+        _, offsets, packed = encode_hr_series(np.arange(0, 6000, 60), np.full(100, 70))
+        self.assertEqual((len(offsets), len(packed)), (99, 100))
+        _, offsets, packed = encode_hr_series(np.array([0, 60, 3660]), np.array([70, 280, 70]))
+        self.assertEqual((len(offsets), len(packed)), (4, 6))
+
+    def test_empty_and_single_sample(self):
+        start, offsets, packed = encode_hr_series([], [])
+        self.assertEqual((offsets, packed), (b'', b''))
+        self.assertEqual([a.tolist() for a in decode_hr_series(start, 0, offsets, packed)], [[], []])
+        start, offsets, packed = encode_hr_series([NIGHT_START], [64])
+        self.assertEqual([a.tolist() for a in decode_hr_series(start, 1, offsets, packed)], [[NIGHT_START], [64]])
+
+
+class HypnogramTests(unittest.TestCase):
+    # Лёгкий 30 мин, глубокий 40, REM 30, пробуждение 5, лёгкий 20 — в секундах от начала ночи
+    STARTS = np.array([0, 1800, 4200, 6000, 6300]) + NIGHT_START
+    ENDS = np.array([1800, 4200, 6000, 6300, 7500]) + NIGHT_START
+    STATES = np.array([2, 3, 4, 5, 2])
+
+    def test_round_trip(self):
+        order = [3, 0, 4, 1, 2]
+        start, offsets, durations, states = encode_hypnogram(self.STARTS[order], self.ENDS[order], self.STATES[order])
+        decoded = decode_hypnogram(start, 5, offsets, durations, states)
+
+        self.assertEqual([a.tolist() for a in decoded], [self.STARTS.tolist(), self.ENDS.tolist(), self.STATES.tolist()])
+        # Смещения до 18 часов — по два байта, стадии — по байту
+        self.assertEqual((len(offsets), len(durations), len(states)), (10, 10, 5))
+
+    def test_epochs(self):
+        epochs = hypnogram_epochs(self.STARTS, self.ENDS, self.STATES)
+
+        self.assertEqual(epochs.dtype, np.uint8)
+        self.assertEqual(len(epochs), 7500 // 30)
+        self.assertEqual(np.bincount(epochs, minlength=6)[2:].tolist(), [100, 80, 60, 10])
+
+    def test_cycles(self):
+        self.assertEqual(count_sleep_cycles(self.STARTS, self.ENDS, self.STATES), 1)
+        # Без REM цикл не засчитывается
+        self.assertEqual(count_sleep_cycles(self.STARTS, self.ENDS, np.array([2, 3, 3, 5, 2])), 0)
+        self.assertEqual(count_sleep_cycles(*decode_hypnogram(0, 0, b'', b'', b'')), 0)
+
+
+class HeartRatePyramidTests(unittest.TestCase):
+    def test_aggregate_by_record_and_bucket(self):
+        records = np.array([2, 1, 1, 1, 2])
+        times = np.array([3600, 59, 0, 61, 3659])
+        bpm = np.array([70, 62, 60, 90, 80])
+
+        ids, starts, counts, low, avg, high = aggregate_heart_rate(records, times, bpm, 60)
+
+        self.assertEqual(ids.tolist(), [1, 1, 2])
+        self.assertEqual(starts.tolist(), [0, 60, 3600])
+        self.assertEqual(counts.tolist(), [2, 1, 2])
+        self.assertEqual((low.tolist(), avg.tolist(), high.tolist()), ([60, 90, 70], [61.0, 90.0, 75.0], [62, 90, 80]))
+        self.assertEqual(len(aggregate_heart_rate([], [], [], 60)[0]), 0)
+
+    def test_encode_round_trip(self):
+        buckets = np.array([0, 300, 1500]) + NIGHT_START - NIGHT_START % 300
+        encoded = encode_hr_aggregates(buckets, [3, 1, 5], [50, 60, 55], [55.26, 60.0, 58.04], [60, 60, 70], 300)
+        starts, counts, low, avg, high = decode_hr_aggregates(encoded[0], 3, 300, *encoded[1:])
+
+        self.assertEqual(starts.tolist(), buckets.tolist())
+        self.assertEqual((counts.tolist(), low.tolist(), high.tolist()), ([3, 1, 5], [50, 60, 55], [60, 60, 70]))
+        self.assertEqual(avg.tolist(), [55.3, 60.0, 58.0])
+        # Номера корзин и пульс — по байту
+        self.assertEqual(len(encoded[1]) + len(encoded[3]), 6)
+
+    def test_choose_level(self):
+        counts = {'1m': 480, '5m': 96, '1h': 8}
+        self.assertEqual(choose_hr_level(480, counts, 500), ('raw', False))
+        self.assertEqual(choose_hr_level(28800, counts, 500), ('1m', False))
+        self.assertEqual(choose_hr_level(28800, counts, 100), ('5m', False))
+        self.assertEqual(choose_hr_level(28800, counts, 10), ('1h', False))
+        self.assertEqual(choose_hr_level(28800, counts, 5), ('1h', True))
+
+
+class ThrottledProgressTests(unittest.TestCase):
+    def setUp(self):
+        self.recorder = RecordingProgress()
+        self.clock = FakeClock()
+        self.progress = ThrottledProgress(self.recorder, min_interval=1.0, min_delta=5.0, clock=self.clock)
+
+    def test_coalesces_by_interval_and_delta(self):
+        for current in range(100):
+            self.progress.set_progress(current, 1000)
+            self.clock.now += 0.01
+        # Первое обновление уходит сразу, дальше интервал ещё не прошёл
+        self.assertEqual(self.recorder.calls, [(0, 1000, '')])
+
+        self.clock.now += 5
+        self.progress.set_progress(30, 1000)  # прошло время, но изменение меньше 5%
+        self.progress.set_progress(600, 1000)
+        self.assertEqual(self.recorder.calls[-1], (600, 1000, ''))
+        self.assertEqual(self.progress.writes, 2)
+
+    def test_completion_and_flush_are_always_written(self):
+        self.progress.set_progress(0, 10)
+        self.progress.set_progress(3, 10)
+        self.progress.flush()
+        self.progress.set_progress(10, 10)
+        self.progress.set_progress(10, 10)
+        self.assertEqual([call[0] for call in self.recorder.calls], [0, 3, 10])
+
+
+class ImportProgressTests(unittest.TestCase):
+    def test_stages_are_weighted_into_overall_percent(self):
+        recorder = RecordingProgress()
+        progress = ImportProgress(recorder, min_interval=0, min_delta=0)
+        progress.stage('parse').set_progress(8, 8)
+        progress.start(10)
+        self.assertEqual(recorder.calls[-1][0], 40)
+
+        progress.advance('upsert', 5)
+        self.assertEqual(recorder.calls[-1], (47.5, 100, 'Записи сна: 5/10'))
+
+        progress.skip(5)
+        progress.finish()
+        self.assertEqual(recorder.calls[-1][:2], (100, 100))
+
+    def test_set_stages_reports_once(self):
+        recorder = RecordingProgress()
+        progress = ImportProgress(recorder)
+        progress.start(10)
+
+        progress.set_stages({'parse': 1.0, 'upsert': 0.5, 'heart_rate': 0.5})
+
+        self.assertEqual(recorder.calls, [(57.5, 100, 'Ночной пульс: 5/10')])
+
+
+class StreamingParseTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+        write_export_csv(self.path, nights=5)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_batches_cover_every_night_and_sample(self):
+        total, batches = sleep_record_batches_from_csv(self.path, chunksize=50, batch_nights=2)
+        batches = list(batches)
+
+        self.assertEqual(total, 5)
+        self.assertGreater(len(batches), 1)
+        self.assertEqual(sum(len(meta) for meta, _, _ in batches), 5)
+        self.assertEqual(sum(len(items) for _, items, _ in batches), 25)
+        for meta, _, night_hr in batches:
+            # Пульс пачки относится только к её ночам
+            self.assertTrue(night_hr['night'].isin(meta.index).all())
+        # 8 часов сна с шагом 10 минут
+        self.assertEqual(sum(len(night_hr) for _, _, night_hr in batches), 5 * 48)
+
+    def test_repeated_night_keeps_last_row(self):
+        append_repeated_night(self.path, duration=450)
+
+        total, batches = sleep_record_batches_from_csv(self.path, chunksize=50, batch_nights=2)
+        batches = list(batches)
+
+        self.assertEqual(total, 5)
+        meta = pd.concat([meta for meta, _, _ in batches])
+        self.assertTrue(meta.index.is_unique)
+        self.assertEqual(meta.loc[NIGHT_START, 'duration'], 450)
+        self.assertEqual(sum(len(items) for _, items, _ in batches), 25)
+        self.assertEqual(sum(len(night_hr) for _, _, night_hr in batches), 5 * 48)
+
+    def test_times_stay_epoch_seconds(self):
+        _, batches = sleep_record_batches_from_csv(self.path)
+        meta, items, night_hr = next(batches)
+
+        self.assertEqual(meta.index.dtype, np.int64)
+        self.assertEqual(meta.index[0], NIGHT_START)
+        self.assertEqual(meta['device_bedtime'].dtype, np.int64)
+        self.assertEqual(items['start_time'].iloc[0], NIGHT_START + 600)
+        self.assertEqual(night_hr.index.dtype, np.int64)
+        self.assertEqual(night_hr['night'].dtype, np.int64)
+
+    def test_invalid_file(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write('Uid,Sid,Key,Time,Value\nu,s,steps,1,"{}"\n')
+        self.assertIsNone(sleep_record_batches_from_csv(self.path))
+
+
+class SyntheticExportTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, name, *args, **kwargs):
+        path = os.path.join(self.directory, name)
+        rows = write_synthetic_export(path, *args, **kwargs)
+        return path, rows
+
+    def test_same_seed_gives_same_file(self):
+        first, _ = self._write('a.csv', 4, seed=7)
+        second, _ = self._write('b.csv', 4, seed=7)
+        other, _ = self._write('c.csv', 4, seed=8)
+        with open(first, 'rb') as a, open(second, 'rb') as b, open(other, 'rb') as c:
+            content = a.read()
+            self.assertEqual(content, b.read())
+            self.assertNotEqual(content, c.read())
+
+    def test_export_is_valid_and_parses(self):
+        path, rows = self._write('export.csv', 6, hr_step=300)
+
+        self.assertIsNone(validate_sleep_export(path))
+        total, batches = sleep_record_batches_from_csv(path)
+        batches = list(batches)
+        self.assertEqual(total, 6)
+        self.assertTrue(all(len(night_hr) for _, _, night_hr in batches))
+        # Пульс за 8 суток с шагом 5 минут, 6 ночей и по два других ключа раз в час
+        self.assertEqual(rows, 8 * 288 + 6 + 2 * 8 * 24)
+
+    def test_stage_mix(self):
+        path, _ = self._write('deep.csv', 3, stage_mix={3: 1.0}, other_keys=())
+        _, batches = sleep_record_batches_from_csv(path)
+        _, items, _ = next(batches)
+        self.assertEqual(set(items['state']), {3})
+
+
+class ValidateSleepExportTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def _write(self, text):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def test_valid_export(self):
+        write_export_csv(self.path, nights=2)
+        self.assertIsNone(validate_sleep_export(self.path))
+
+    def test_missing_columns(self):
+        self._write('a,b\n1,2\n')
+        self.assertIn('колонок', validate_sleep_export(self.path))
+
+    def test_steps_only_export(self):
+        self._write('Uid,Sid,Key,Time,Value\nu,s,steps,1,"{""steps"": 1}"\n')
+        self.assertEqual(validate_sleep_export(self.path), 'В файле нет записей сна')
+
+    def test_sleep_without_stages(self):
+        self._write('Uid,Sid,Key,Time,Value\nu,s,sleep,1,"{""version"": 1, ""items"": []}"\n')
+        self.assertIn('version 2', validate_sleep_export(self.path))
+
+    def test_zip_without_csv(self):
+        with zipfile.ZipFile(self.path, 'w') as archive:
+            archive.writestr('readme.txt', 'no data')
+        self.assertEqual(validate_sleep_export(self.path), 'В архиве нет CSV-файла')
+
+    def test_corrupt_zstd(self):
+        write_export_csv(self.path, nights=2)
+        compressed = compress_zstd(self.path)
+        self.addCleanup(os.remove, compressed)
+        with open(compressed, 'r+b') as f:
+            f.seek(8)
+            f.write(b'\xff' * 64)
+        self.assertEqual(validate_sleep_export(compressed), 'Не удалось распаковать файл')
+
+    def test_corrupt_zip_member(self):
+        write_export_csv(self.path, nights=2)
+        compressed = compress_zip(self.path)
+        self.addCleanup(os.remove, compressed)
+        with open(compressed, 'r+b') as f:
+            f.seek(100)
+            f.write(b'\xff' * 64)
+        self.assertEqual(validate_sleep_export(compressed), 'Не удалось распаковать файл')
+
+    def test_not_utf8(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'Uid,Sid,Key,Time,Value\n\xff\xfe,s,sleep,1,x\n')
+        self.assertIn('UTF-8', validate_sleep_export(self.path))
+
+
+class ParseCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        override = self.settings(SLEEP_IMPORT_CACHE_DIR=self.root, SLEEP_IMPORT_CACHE_TTL=3600,
+                                 SLEEP_IMPORT_CACHE_MAX_BYTES=10 ** 9)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def _frames(self):
+        meta = pd.DataFrame({'duration': [470, 480], 'payload_hash': ['a1', None]},
+                            index=pd.Index([NIGHT_START, NIGHT_START + 86400], name='night'))
+        items = pd.DataFrame({'state': [2, 3]}, index=pd.Index([NIGHT_START, NIGHT_START], name='night'))
+        night_hr = pd.DataFrame({'night': [NIGHT_START], 'bpm': [60]})
+        return meta, items, night_hr
+
+    def _store(self, file_hash):
+        list(store_parsed_export(file_hash, 2, [self._frames()]))
+
+    def test_round_trip_keeps_nulls(self):
+        self._store('abc')
+        total, batches = load_parsed_export('abc')
+        meta, items, night_hr = next(batches)
+
+        self.assertEqual(total, 2)
+        self.assertEqual(meta['payload_hash'].tolist(), ['a1', None])
+        self.assertEqual(items.reset_index().values.tolist(), self._frames()[1].reset_index().values.tolist())
+        self.assertEqual(night_hr.to_dict('list'), self._frames()[2].to_dict('list'))
+
+    def test_cache_of_other_format_version_is_not_read(self):
+        self._store('abc')
+        os.rename(cache_dir('abc'), os.path.join(self.root, 'abc.v1'))
+
+        self.assertIsNone(load_parsed_export('abc'))
+        self.assertEqual(evict_parse_cache(), 1)
+        self.assertEqual(os.listdir(self.root), [])
+
+    def test_evicts_unused_and_oldest_caches(self):
+        for file_hash in ['old', 'used', 'new']:
+            self._store(file_hash)
+        for number, file_hash in enumerate(['old', 'used', 'new']):
+            marker = os.path.join(cache_dir(file_hash), 'complete.json')
+            os.utime(marker, (NIGHT_START + number, NIGHT_START + number))
+        load_parsed_export('used')
+
+        # Кеш, не использованный дольше TTL, удаляется; прочитанный только что остаётся
+        self.assertEqual(evict_parse_cache(now=NIGHT_START + 3600 + 1.5), 1)
+        self.assertFalse(os.path.exists(cache_dir('old')))
+
+        # Сверх лимита размера удаляются самые давно использованные, кеш keep — никогда
+        with self.settings(SLEEP_IMPORT_CACHE_MAX_BYTES=0):
+            self.assertEqual(evict_parse_cache(keep='new'), 1)
+        self.assertEqual(os.listdir(self.root), [os.path.basename(cache_dir('new'))])
+
+
+class UploadViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='uploader', password='pass12345')
+        self.client.login(username='uploader', password='pass12345')
+        self.tmp_dir = os.path.join(settings.MEDIA_ROOT, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    @mock.patch('sleep_tracking_app.views.import_sleep_records')
+    def test_invalid_upload_is_rejected_before_queueing(self, task):
+        before = set(os.listdir(self.tmp_dir))
+        upload = SimpleUploadedFile('steps.csv', b'Uid,Sid,Key,Time,Value\nu,s,steps,1,"{}"\n')
+
+        response = self.client.post(reverse('sleep_records_from_csv'), {'csv_file': upload})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['status'], 'error')
+        task.delay.assert_not_called()
+        self.assertEqual(set(os.listdir(self.tmp_dir)), before)
+
+    @mock.patch('sleep_tracking_app.views.import_sleep_records')
+    def test_corrupt_archive_is_rejected_and_removed(self, task):
+        before = set(os.listdir(self.tmp_dir))
+        upload = SimpleUploadedFile('export.csv.zst', b'\x28\xb5\x2f\xfd' + b'\xff' * 64)
+
+        response = self.client.post(reverse('sleep_records_from_csv'), {'csv_file': upload})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['message'], 'Не удалось распаковать файл')
+        task.delay.assert_not_called()
+        self.assertEqual(set(os.listdir(self.tmp_dir)), before)
+
+    @mock.patch('sleep_tracking_app.views.import_sleep_records')
+    def test_valid_upload_is_queued(self, task):
+        task.delay.return_value.id = 'task-1'
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+        write_export_csv(path, nights=1)
+        with open(path, 'rb') as f:
+            upload = SimpleUploadedFile('export.csv', f.read())
+        os.remove(path)
+
+        response = self.client.post(reverse('sleep_records_from_csv'), {'csv_file': upload})
+
+        self.assertEqual(response.json(), {'task_id': 'task-1'})
+        os.remove(task.delay.call_args.args[1])
+
+
+class ImportSleepRecordsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='importer', password='pass12345')
+        UserData.objects.create(user=self.user, date_of_birth=date(1990, 1, 1), weight=70, gender=1, height=175)
+        # Свой кеш разбора на каждый тест: одинаковые файлы разных тестов не должны его делить
+        cache = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache, ignore_errors=True)
+        override = self.settings(SLEEP_IMPORT_PARSE_CACHE=True, SLEEP_IMPORT_CACHE_DIR=cache)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def _import(self, nights=4, **kwargs):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+        write_export_csv(path, nights=nights)
+        # apply, а не delay: eager-delay запрещает ожидание chord-а шардов, который выполняется внутри задачи
+        result = import_sleep_records.apply((self.user.id, path), kwargs).get()
+        self.assertFalse(os.path.exists(path))
+        return result
+
+    def _snapshot(self):
+        return (
+            list(SleepRecord.objects.order_by('sleep_date_time').values_list('sleep_date_time', 'duration')),
+            self._segments(),
+            self._night_heart_rate(),
+            list(SleepStatistics.objects.order_by('date').values_list('date', 'sleep_efficiency')),
+        )
+
+    def _segments(self):
+        segments = []
+        for record in SleepRecord.objects.order_by('sleep_date_time'):
+            starts, ends, states = read_hypnogram(record)
+            segments.extend(zip(starts.tolist(), ends.tolist(), states.tolist()))
+        return segments
+
+    def _night_heart_rate(self):
+        samples = []
+        for record in SleepRecord.objects.order_by('sleep_date_time'):
+            times, bpm = read_night_heart_rate(record)
+            samples.extend(zip(times.tolist(), bpm.tolist()))
+        return samples
+
+    def test_import_creates_records(self):
+        result = self._import()
+
+        self.assertEqual(result, {'status': 'completed', 'imported': 4, 'skipped': 0})
+        self.assertEqual(SleepRecord.objects.filter(user=self.user).count(), 4)
+        self.assertEqual(len(self._segments()), 20)
+        # По умолчанию сегменты и пульс пишутся строками; гипнограмма и ряд пульса включаются настройками
+        self.assertEqual(SleepSegment.objects.count(), 20)
+        self.assertEqual(NightHeartRateEntry.objects.count(), 4 * 48)
+        self.assertFalse(SleepHypnogram.objects.exists())
+        self.assertFalse(NightHeartRateSeries.objects.exists())
+        self.assertEqual(len(self._night_heart_rate()), 4 * 48)
+        self.assertEqual(SleepStatistics.objects.filter(user=self.user).count(), 4)
+
+    def test_repeated_night_keeps_last_row(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+        write_export_csv(path, nights=2)
+        append_repeated_night(path, duration=450)
+
+        result = import_sleep_records.delay(self.user.id, path).get()
+
+        self.assertEqual(result, {'status': 'completed', 'imported': 2, 'skipped': 0})
+        self.assertEqual(list(SleepRecord.objects.order_by('sleep_date_time').values_list('duration', flat=True)),
+                         [450, 470])
+        # Сегменты и пульс ранней копии ночи не попадают в запись сна
+        self.assertEqual([len(read_hypnogram(record)[0]) for record in SleepRecord.objects.order_by('sleep_date_time')],
+                         [5, 5])
+        self.assertEqual(len(self._night_heart_rate()), 2 * 48)
+        self.assertEqual(SleepStatistics.objects.filter(user=self.user).count(), 2)
+
+    def test_reimport_updates_records_in_place(self):
+        self._import(nights=2)
+        ids = list(SleepRecord.objects.order_by('sleep_date_time').values_list('id', flat=True))
+
+        self._import(nights=3)
+
+        self.assertEqual(SleepRecord.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(list(SleepRecord.objects.order_by('sleep_date_time').values_list('id', flat=True))[:2], ids)
+        self.assertEqual(len(self._segments()), 15)
+
+    def test_incremental_reimport_skips_unchanged_nights(self):
+        self._import(nights=3)
+        SleepStatistics.objects.filter(user=self.user).update(recommended='keep me')
+
+        result = self._import(nights=4)
+
+        self.assertEqual(result, {'status': 'completed', 'imported': 1, 'skipped': 3})
+        self.assertEqual(len(self._segments()), 20)
+        self.assertEqual(SleepStatistics.objects.filter(user=self.user).count(), 4)
+        # Статистика неизменённых ночей не пересоздаётся
+        self.assertEqual(SleepStatistics.objects.filter(user=self.user, recommended='keep me').count(), 3)
+
+    def test_reimport_with_repeated_night_changes_nothing(self):
+        def import_repeated():
+            fd, path = tempfile.mkstemp(suffix='.csv')
+            os.close(fd)
+            write_export_csv(path, nights=2)
+            append_repeated_night(path, duration=450)
+            return import_sleep_records.apply((self.user.id, path)).get()
+
+        import_repeated()
+        SleepStatistics.objects.filter(user=self.user).update(recommended='keep me')
+        before = self._snapshot()
+
+        result = import_repeated()
+
+        # Ранняя копия ночи не считается изменённой и не откатывает ночь к себе
+        self.assertEqual(result, {'status': 'completed', 'imported': 0, 'skipped': 2})
+        self.assertEqual(self._snapshot(), before)
+        self.assertEqual(before[0][0][1], 450)
+        self.assertEqual(SleepStatistics.objects.filter(user=self.user, recommended='keep me').count(), 2)
+
+    def test_changed_nap_keeps_statistics_of_unchanged_night(self):
+        def import_with_nap(duration):
+            fd, path = tempfile.mkstemp(suffix='.csv')
+            os.close(fd)
+            write_export_csv(path, nights=2)
+            # Дневной сон в тот же день (UTC), раньше первой ночи
+            nap_start = NIGHT_START - 8 * 3600
+            payload = {
+                'awake_count': 0, 'bedtime': nap_start, 'device_bedtime': nap_start,
+                'device_wake_up_time': nap_start + 3600, 'duration': duration, 'has_rem': 0, 'has_stage': True,
+                'items': [{'start_time': nap_start + 300, 'end_time': nap_start + 3600, 'state': 2}],
+                'sleep_awake_duration': 0, 'sleep_deep_duration': 0, 'sleep_light_duration': duration,
+                'sleep_rem_duration': 0, 'version': 2, 'wake_up_time': nap_start + 3600,
+            }
+            with open(path, 'a', newline='', encoding='utf-8') as f:
+                csv.writer(f).writerow(['u', 's', 'sleep', nap_start + 3600, json.dumps(payload), nap_start + 3600])
+            return import_sleep_records.apply((self.user.id, path)).get()
+
+        import_with_nap(duration=55)
+        SleepStatistics.objects.filter(user=self.user).update(recommended='keep me')
+        before = list(SleepStatistics.objects.order_by('date').values('date', *SleepStatistics.METRIC_FIELDS))
+
+        result = import_with_nap(duration=50)
+
+        # Изменился только дневной сон, статистика дня по-прежнему по последней ночи дня
+        self.assertEqual(result, {'status': 'completed', 'imported': 1, 'skipped': 2})
+        self.assertEqual(SleepRecord.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(list(SleepStatistics.objects.order_by('date').values('date', *SleepStatistics.METRIC_FIELDS)),
+                         before)
+        self.assertEqual(SleepStatistics.objects.filter(user=self.user, recommended='keep me').count(), 2)
+
+    def test_full_reimport_rewrites_every_night(self):
+        self._import(nights=3)
+
+        result = self._import(nights=3, incremental=False)
+
+        self.assertEqual(result, {'status': 'completed', 'imported': 3, 'skipped': 0})
+        self.assertEqual(len(self._segments()), 15)
+        self.assertEqual(SleepStatistics.objects.filter(user=self.user).count(), 3)
+
+    def test_full_reimport_keeps_recommendations_of_unchanged_days(self):
+        self._import(nights=3)
+        SleepStatistics.objects.filter(user=self.user).update(recommended='keep me', health_impact='ok')
+        stale = SleepStatistics.objects.filter(user=self.user).order_by('date').first()
+        SleepStatistics.objects.filter(pk=stale.pk).update(sleep_efficiency=0)
+        ids = set(SleepStatistics.objects.values_list('id', flat=True))
+
+        self._import(nights=3, incremental=False)
+
+        self.assertEqual(set(SleepStatistics.objects.values_list('id', flat=True)), ids)
+        self.assertEqual(SleepStatistics.objects.filter(recommended='keep me').count(), 2)
+        stale.refresh_from_db()
+        self.assertIsNone(stale.recommended)
+        self.assertIsNone(stale.health_impact)
+        self.assertGreater(stale.sleep_efficiency, 0)
+
+    def test_upsert_statistics_keeps_one_row_per_day(self):
+        day = date(2025, 1, 1)
+        first = SleepStatistics(user=self.user, date=day, sleep_efficiency=80)
+        second = SleepStatistics(user=self.user, date=day, sleep_efficiency=90)
+
+        written = SleepStatistics.upsert_changed([first, second])
+
+        self.assertEqual(written, [second])
+        self.assertEqual(list(SleepStatistics.objects.values_list('date', 'sleep_efficiency')), [(day, 90)])
+        with self.assertNumQueries(1):
+            self.assertEqual(SleepStatistics.upsert_changed([SleepStatistics(user=self.user, date=day,
+                                                                             sleep_efficiency=90)]), [])
+
+    def test_bulk_upsert_sets_primary_keys_in_one_statement(self):
+        existing = SleepRecord.objects.create(user=self.user, sleep_date_time='2025-01-01 22:00:00+0000', duration=400)
+        records = [
+            SleepRecord(user=self.user, sleep_date_time='2025-01-01 22:00:00+0000', duration=420),
+            SleepRecord(user=self.user, sleep_date_time='2025-01-02 22:00:00+0000', duration=430),
+        ]
+
+        with self.assertNumQueries(1):
+            SleepRecord.bulk_upsert(records)
+
+        self.assertEqual(records[0].pk, existing.pk)
+        self.assertIsNotNone(records[1].pk)
+        existing.refresh_from_db()
+        self.assertEqual(existing.duration, 420)
+
+    def test_copy_rows_loads_without_model_instances(self):
+        record = SleepRecord.objects.create(user=self.user, sleep_date_time='2025-01-01 22:00:00+0000')
+        rows = ((record.pk, f'2025-01-01 23:{minute:02d}:00+0000', 60 + minute) for minute in range(5))
+
+        loaded = copy_rows(NightHeartRateEntry, ['record_id', 'time', 'bpm'], rows, batch_size=2)
+
+        self.assertEqual(loaded, 5)
+        self.assertEqual(list(record.night_hr_entries.order_by('time').values_list('bpm', flat=True)),
+                         [60, 61, 62, 63, 64])
+
+    def test_series_storage_reads_like_row_storage(self):
+        self._import()
+        expected = self._night_heart_rate()
+
+        with self.settings(SLEEP_HR_STORAGE='series'):
+            self._import(incremental=False)
+
+        self.assertFalse(NightHeartRateEntry.objects.exists())
+        self.assertEqual(NightHeartRateSeries.objects.count(), 4)
+        self.assertEqual(self._night_heart_rate(), expected)
+
+    def test_hypnogram_reads_like_row_segments(self):
+        self._import()
+        expected = self._segments()
+        record = SleepRecord.objects.order_by('sleep_date_time').first()
+        expected_cycles = calculate_cycle_count(record)
+
+        with self.settings(SLEEP_SEGMENT_STORAGE='hypnogram'):
+            self._import(incremental=False)
+
+        self.assertFalse(SleepSegment.objects.exists())
+        self.assertEqual(SleepHypnogram.objects.count(), 4)
+        self.assertEqual(self._segments(), expected)
+        record = SleepRecord.objects.order_by('sleep_date_time').first()
+        self.assertEqual(calculate_cycle_count(record), expected_cycles)
+
+    def test_night_heart_rate_is_one_row_fetch(self):
+        with self.settings(SLEEP_HR_STORAGE='series'):
+            self._import(nights=1)
+        record = SleepRecord.objects.get()
+
+        with self.assertNumQueries(1):
+            times, bpm = read_night_heart_rate(record)
+        self.assertEqual(len(times), 48)
+        self.assertTrue((np.diff(times) == 600).all())
+
+    def test_streaming_import_matches_in_memory_import(self):
+        self._import(streaming=False)
+        expected = self._snapshot()
+
+        with self.settings(SLEEP_IMPORT_CHUNK_SIZE=40, SLEEP_IMPORT_BATCH_NIGHTS=1):
+            self._import(streaming=True, incremental=False)
+
+        self.assertEqual(self._snapshot(), expected)
+
+    def test_interrupted_import_resumes_from_last_checkpoint(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+        write_export_csv(path, nights=3)
+        store = tasks._store_sleep_batch
+        calls = []
+        fail_at = {'night': NIGHT_START + 86400}
+
+        def store_batch(*args, **kwargs):
+            night = args[2].index[0]
+            calls.append(night)
+            if night == fail_at['night']:
+                raise RuntimeError('worker lost')
+            return store(*args, **kwargs)
+
+        with self.settings(SLEEP_IMPORT_BATCH_NIGHTS=1):
+            with mock.patch.object(tasks, '_store_sleep_batch', side_effect=store_batch):
+                with self.assertRaises(RuntimeError):
+                    import_sleep_records.delay(self.user.id, path, streaming=False).get()
+
+            # Первая пачка зафиксирована, вторая откатилась, файл остался для повтора
+            journal = SleepImportJournal.objects.get(user=self.user)
+            self.assertEqual(journal.status, SleepImportJournal.STATUS_RUNNING)
+            self.assertEqual(list(journal.checkpoints.values_list('batch_number', flat=True)), [0])
+            self.assertEqual(SleepRecord.objects.filter(user=self.user).count(), 1)
+
+            fail_at['night'] = None
+            calls.clear()
+            with mock.patch.object(tasks, '_store_sleep_batch', side_effect=store_batch):
+                result = import_sleep_records.delay(self.user.id, path, streaming=False).get()
+
+        self.assertEqual(result, {'status': 'completed', 'imported': 3, 'skipped': 0})
+        # Повторный запуск не трогает уже записанную первую ночь
+        self.assertEqual(calls, [NIGHT_START + 86400, NIGHT_START + 2 * 86400])
+        self.assertEqual(SleepRecord.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(SleepStatistics.objects.filter(user=self.user).count(), 3)
+        journal.refresh_from_db()
+        self.assertEqual(journal.status, SleepImportJournal.STATUS_COMPLETED)
+        self.assertFalse(os.path.exists(path))
+
+    def test_import_fails_after_max_attempts(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+        write_export_csv(path, nights=2)
+
+        # Воркер каждый раз падает на этом файле: доставки ограничены журналом
+        with self.settings(SLEEP_IMPORT_MAX_ATTEMPTS=2), \
+                mock.patch.object(tasks, '_store_sleep_batch', side_effect=RuntimeError('worker lost')):
+            for _ in range(2):
+                with self.assertRaises(RuntimeError):
+                    import_sleep_records.delay(self.user.id, path).get()
+            result = import_sleep_records.delay(self.user.id, path).get()
+
+        self.assertEqual(result, {'status': 'error', 'message': 'Import failed after too many attempts'})
+        journal = SleepImportJournal.objects.get(user=self.user)
+        self.assertEqual((journal.status, journal.attempts), (SleepImportJournal.STATUS_FAILED, 3))
+        self.assertFalse(os.path.exists(path))
+
+        # Новая загрузка того же файла начинает журнал заново
+        self.assertEqual(self._import(nights=2), {'status': 'completed', 'imported': 2, 'skipped': 0})
+        journal.refresh_from_db()
+        self.assertEqual((journal.status, journal.attempts), (SleepImportJournal.STATUS_COMPLETED, 1))
+
+    def test_compressed_exports_import_like_plain_csv(self):
+        self._import(nights=3)
+        expected = self._snapshot()
+
+        for compress in (compress_gzip, compress_zip, compress_zstd):
+            SleepRecord.objects.all().delete()
+            SleepStatistics.objects.all().delete()
+            fd, path = tempfile.mkstemp(suffix='.csv')
+            os.close(fd)
+            write_export_csv(path, nights=3)
+            packed = compress(path)
+            os.remove(path)
+
+            self.assertIsNone(validate_sleep_export(packed))
+            result = import_sleep_records.delay(self.user.id, packed).get()
+
+            self.assertEqual(result, {'status': 'completed', 'imported': 3, 'skipped': 0}, compress.__name__)
+            self.assertEqual(self._snapshot(), expected)
+            self.assertFalse(os.path.exists(packed))
+
+    def test_reimport_of_same_file_reads_parse_cache(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+        write_export_csv(path, nights=3)
+        with open(path, 'rb') as f:
+            content = f.read()
+        import_sleep_records.delay(self.user.id, path, incremental=False).get()
+        expected = self._snapshot()
+
+        with open(path, 'wb') as f:
+            f.write(content)
+        with mock.patch.object(tasks, 'sleep_record_from_csv') as parse, \
+                mock.patch.object(tasks, 'sleep_record_batches_from_csv') as parse_streaming:
+            result = import_sleep_records.delay(self.user.id, path, incremental=False).get()
+
+        parse.assert_not_called()
+        parse_streaming.assert_not_called()
+        self.assertEqual(result, {'status': 'completed', 'imported': 3, 'skipped': 0})
+        self.assertEqual(self._snapshot(), expected)
+
+    def test_deleting_user_discards_parse_cache(self):
+        self._import(nights=2)
+        file_hash = SleepImportJournal.objects.get(user=self.user).file_hash
+        self.assertIsNotNone(load_parsed_export(file_hash))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+
+        self.assertIsNone(load_parsed_export(file_hash))
+
+    def test_recompute_statistics_from_parse_cache(self):
+        self._import(nights=3)
+        expected = self._snapshot()
+        SleepStatistics.objects.filter(user=self.user).update(sleep_efficiency=0)
+
+        result = recompute_sleep_statistics.delay(self.user.id).get()
+
+        self.assertEqual(result, {'status': 'completed', 'recomputed': 3, 'missing_cache': 0})
+        self.assertEqual(self._snapshot(), expected)
+
+    def test_sharded_import_matches_serial_import(self):
+        # 40 ночей с 14 ноября — два месяца, два шарда
+        self._import(nights=40, sharded=False)
+        expected = self._snapshot()
+        SleepRecord.objects.all().delete()
+        SleepStatistics.objects.all().delete()
+
+        tmp_dir = os.path.join(settings.MEDIA_ROOT, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        before = set(os.listdir(tmp_dir))
+
+        result = self._import(nights=40, sharded=True)
+
+        self.assertEqual(result, {'status': 'completed', 'imported': 40, 'skipped': 0})
+        self.assertEqual(self._snapshot(), expected)
+        # Шарды удаляются после завершения
+        self.assertEqual(set(os.listdir(tmp_dir)), before)
+
+        result = self._import(nights=41, sharded=True)
+        self.assertEqual(result, {'status': 'completed', 'imported': 1, 'skipped': 40})
+        self.assertEqual(SleepImportJournal.objects.filter(status=SleepImportJournal.STATUS_COMPLETED).count(), 2)
+
+    def test_sharded_import_reports_progress_per_shard(self):
+        with mock.patch.object(tasks._TaskState, 'update_state', autospec=True) as update_state:
+            self._import(nights=40, sharded=True)
+
+        # По обновлению на каждый из двух шардов, в задачу импорта, а не в подзадачу
+        metas = [call.kwargs['meta'] for call in update_state.call_args_list]
+        self.assertEqual([meta['description'] for meta in metas], ['Ночной пульс: 17/40', 'Ночной пульс: 40/40'])
+        self.assertEqual(metas[-1]['percent'], 85.0)
+
+    def test_failed_shard_keeps_file_and_resumes(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+        write_export_csv(path, nights=40)
+        tmp_dir = os.path.join(settings.MEDIA_ROOT, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        before = set(os.listdir(tmp_dir))
+        store = tasks._store_sleep_nights
+
+        with mock.patch.object(tasks, '_store_sleep_nights', side_effect=[None, RuntimeError('worker lost')]), \
+                self.assertRaises(RuntimeError):
+            import_sleep_records.apply((self.user.id, path), {'sharded': True}).get()
+        # Исходный файл не удаляется, пока chord не завершился; первый шард записан с контрольной точкой
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(SleepImportCheckpoint.objects.count(), 1)
+
+        # Обработчик ошибки chord-а (в eager-режиме он не вызывается) удаляет шарды и файл
+        shard_dir, = set(os.listdir(tmp_dir)) - before
+        discard_import_shards(os.path.join(tmp_dir, shard_dir), path)
+        self.assertEqual(set(os.listdir(tmp_dir)), before)
+        self.assertFalse(os.path.exists(path))
+
+        # Повторная загрузка того же файла продолжает импорт с незаписанного шарда
+        write_export_csv(path, nights=40)
+        with mock.patch.object(tasks, '_store_sleep_nights', side_effect=store) as written:
+            result = import_sleep_records.apply((self.user.id, path), {'sharded': True}).get()
+
+        self.assertEqual(written.call_count, 1)
+        self.assertEqual(result, {'status': 'completed', 'imported': 40, 'skipped': 0})
+        self.assertFalse(os.path.exists(path))
+
+    def test_import_builds_hr_pyramid(self):
+        self._import()
+        self._import(incremental=False)
+
+        per_level = dict(HeartRateAggregate.objects.values_list('resolution').annotate(n=Sum('sample_count')))
+        # Каждый уровень покрывает все отсчёты ровно один раз, повторный импорт не дублирует агрегаты
+        self.assertEqual(per_level, {60: 4 * 48, 300: 4 * 48, 3600: 4 * 48})
+        # По строке на уровень ночи
+        self.assertEqual(HeartRateAggregate.objects.count(), 4 * 3)
+
+        record = SleepRecord.objects.order_by('sleep_date_time').first()
+        times, bpm = read_night_heart_rate(record)
+        starts, counts, low, avg, high = HeartRateAggregate.objects.get(record=record, resolution=3600).to_arrays()
+        first_hour = times < starts[0] + 3600
+        self.assertEqual(counts[0], first_hour.sum())
+        self.assertEqual((low[0], high[0]), (bpm[first_hour].min(), bpm[first_hour].max()))
+        self.assertAlmostEqual(avg[0], bpm[first_hour].mean(), places=1)
+
+    def test_heart_rate_range_picks_level_by_max_points(self):
+        self._import()
+        self.client.login(username='importer', password='pass12345')
+        url = reverse('sleep_heart_rate_range')
+        params = {'start': (NIGHT_START - 86400) * 1000, 'end': (NIGHT_START + 5 * 86400) * 1000}
+
+        raw = self.client.get(url, {**params, 'max_points': 500}).json()
+        self.assertEqual(raw['level'], 'raw')
+        self.assertEqual(list(zip([t // 1000 for t in raw['time']], raw['avg'])), self._night_heart_rate())
+
+        hourly = self.client.get(url, {**params, 'max_points': 100}).json()
+        self.assertEqual(hourly['level'], '1h')
+        self.assertEqual(len(hourly['time']),
+                         HeartRateAggregate.objects.filter(resolution=3600).aggregate(n=Sum('bucket_count'))['n'])
+        self.assertEqual(min(hourly['min']), min(raw['min']))
+        self.assertEqual(max(hourly['max']), max(raw['max']))
+
+        thinned = self.client.get(url, {**params, 'max_points': 10}).json()
+        self.assertEqual(thinned['level'], '1h')
+        self.assertLessEqual(len(thinned['time']), 10)
+
+        # Окно в один час ночи отдаётся сырыми отсчётами только из этого часа
+        hour = self.client.get(url, {'start': (NIGHT_START + 3600) * 1000, 'end': (NIGHT_START + 7200) * 1000}).json()
+        self.assertEqual(hour['level'], 'raw')
+        self.assertTrue(all((NIGHT_START + 3600) * 1000 <= t < (NIGHT_START + 7200) * 1000 for t in hour['time']))
+
+        self.assertEqual(self.client.get(url, {'start': 'x', 'end': 1}).status_code, 400)
+        self.assertEqual(self.client.get(url, {**params, 'max_points': 10 ** 9}).status_code, 400)
+
+    def test_heart_rate_range_counts_only_samples_inside_range(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+        write_export_csv(path, nights=1, hr_step=60)
+        import_sleep_records.delay(self.user.id, path).get()
+        self.client.login(username='importer', password='pass12345')
+        url = reverse('sleep_heart_rate_range')
+
+        # Ночь целиком не укладывается в 100 точек сырыми отсчётами
+        night = self.client.get(url, {'start': (NIGHT_START - 86400) * 1000, 'end': (NIGHT_START + 86400) * 1000,
+                                      'max_points': 100}).json()
+        self.assertNotEqual(night['level'], 'raw')
+
+        # А час из неё — укладывается: уровень выбирается по отсчётам внутри диапазона, а не по всей ночи
+        start, end = NIGHT_START + 3600, NIGHT_START + 7200
+        hour = self.client.get(url, {'start': start * 1000, 'end': end * 1000, 'max_points': 100}).json()
+        self.assertEqual(hour['level'], 'raw')
+        self.assertEqual([t // 1000 for t in hour['time']], list(range(start, end, 60)))
+
+        # Диапазон между корзинами ночи отдаётся пустым
+        empty = self.client.get(url, {'start': (NIGHT_START + 5 * 86400) * 1000,
+                                      'end': (NIGHT_START + 6 * 86400) * 1000, 'max_points': 100}).json()
+        self.assertEqual(empty['time'], [])
+
+    def _aggregates(self):
+        return sorted((a.record_id, a.resolution, *(column.tolist() for column in a.to_arrays()))
+                      for a in HeartRateAggregate.objects.all())
+
+    def test_build_hr_aggregates_command_backfills_pyramid(self):
+        self._import()
+        expected = self._aggregates()
+        HeartRateAggregate.objects.filter(record__in=SleepRecord.objects.order_by('id')[:2]).delete()
+
+        out = StringIO()
+        call_command('build_hr_aggregates', stdout=out)
+
+        self.assertIn('для 2 записей', out.getvalue())
+        self.assertEqual(self._aggregates(), expected)
+
+    def test_benchmark_command_reports_stages_and_rolls_back(self):
+        out = StringIO()
+        call_command('benchmark_import', nights=[3], hr_step=600, stdout=out)
+
+        header, row = out.getvalue().splitlines()[:2]
+        self.assertIn('parse, s', header)
+        self.assertIn('statistics, s', header)
+        self.assertTrue(row.startswith('3 | '))
+        self.assertFalse(SleepRecord.objects.exists())
+        self.assertEqual(User.objects.count(), 1)
+
+
+class PartitionMaintenanceTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='partitions', password='pass12345')
+        UserData.objects.create(user=self.user, date_of_birth=date(1990, 1, 1), weight=70, gender=1, height=175)
+
+    @unittest.skipIf(connection.vendor == 'postgresql', 'проверка для БД без секционирования')
+    def test_command_is_noop_without_postgres(self):
+        out = StringIO()
+        call_command('maintain_sleep_partitions', stdout=out)
+        self.assertIn('только на PostgreSQL', out.getvalue())
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'секционирование есть только на PostgreSQL')
+    def test_rows_land_in_month_partitions(self):
+        table = 'sleep_tracking_app_nightheartrateentry'
+        self.assertTrue(all(is_partitioned(connection, name) for name in PARTITIONED_TABLES))
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+        write_export_csv(path, nights=2)
+
+        with self.settings(SLEEP_IMPORT_PARSE_CACHE=False):
+            import_sleep_records.delay(self.user.id, path).get()
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {table}_p202311')
+            self.assertEqual(cursor.fetchone()[0], 2 * 48)
+            cursor.execute(f'SELECT count(*) FROM {table}_default')
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'секционирование есть только на PostgreSQL')
+    def test_maintenance_creates_future_and_detaches_expired(self):
+        table = 'sleep_tracking_app_sleepsegment'
+        today = date(2031, 5, 17)
+
+        report = maintain_partitions(connection, months_ahead=2, retention_months=12, drop=True, today=today)
+
+        months = [month for month, _ in list_partitions(connection, table)]
+        self.assertEqual(months, [date(2031, 5, 1), date(2031, 6, 1), date(2031, 7, 1)])
+        self.assertEqual(len(report[table]['created']), 3)
+        # Секции, созданные миграцией под текущие месяцы, старше года относительно today
+        self.assertTrue(report[table]['detached'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,10 @@
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
 
 from sleep_tracking_app.sleep_statistic import (
+    downsample_min_max,
     get_sleep_phases_pie_data,
     get_heart_rate_bell_curve_data,
     get_sleep_duration_trend,
@@ -53,14 +56,41 @@ class PlotDiagramTests(unittest.TestCase):
         self.assertNotIn('REM', names)
 
     def test_get_heart_rate_bell_curve_data_empty(self):
-        self.assertEqual(get_heart_rate_bell_curve_data(None), {'date': [], 'bpm': []})
+        self.assertEqual(get_heart_rate_bell_curve_data(None), {'time': [], 'bpm': []})
 
     def test_get_heart_rate_bell_curve_data_with_entries(self):
-        entries = [DummyHR(datetime(2025, 11, 22, 23, 0), 60), DummyHR(datetime(2025, 11, 23, 0, 0), 62)]
+        entries = [DummyHR(datetime(2025, 11, 22, 23, 0, tzinfo=timezone.utc), 60),
+                   DummyHR(datetime(2025, 11, 23, 0, 0, tzinfo=timezone.utc), 62)]
         rec = DummyRecord(entries)
         res = get_heart_rate_bell_curve_data(rec)
         self.assertEqual(res['bpm'], [60, 62])
-        self.assertEqual(res['date'][0], '23:00')
+        self.assertEqual(res['time'][0], 1763852400000)
+        self.assertEqual((res['mean'], res['std']), (61.0, 1.0))
+
+    def test_get_heart_rate_bell_curve_data_is_downsampled(self):
+        # Отсчёт раз в секунду за 8 часов: на график уходит не больше max_points точек
+        start = datetime(2025, 11, 22, 23, 0, tzinfo=timezone.utc)
+        bpm = [60 + i % 7 for i in range(8 * 3600)]
+        bpm[12345], bpm[23456] = 140, 38
+        entries = [DummyHR(start + timedelta(seconds=i), value) for i, value in enumerate(bpm)]
+        res = get_heart_rate_bell_curve_data(DummyRecord(entries), max_points=200)
+        self.assertLessEqual(len(res['bpm']), 200)
+        self.assertEqual(len(res['time']), len(res['bpm']))
+        self.assertEqual(res['time'], sorted(res['time']))
+        self.assertIn(140, res['bpm'])
+        self.assertIn(38, res['bpm'])
+
+    def test_downsample_min_max_keeps_short_series_and_extremes(self):
+        times = np.arange(10)
+        values = np.array([5, 1, 9, 4, 4, 7, 2, 8, 3, 6])
+        same_times, same_values = downsample_min_max(times, values, 10)
+        self.assertIs(same_values, values)
+
+        kept_times, kept_values = downsample_min_max(times, values, 4)
+        self.assertLessEqual(len(kept_values), 4)
+        self.assertEqual(kept_values.min(), 1)
+        self.assertEqual(kept_values.max(), 9)
+        self.assertTrue((np.diff(kept_times) > 0).all())
 
     def test_get_sleep_duration_trend_empty(self):
         self.assertEqual(get_sleep_duration_trend([]), {"dates": [], "sleep_duration": []})
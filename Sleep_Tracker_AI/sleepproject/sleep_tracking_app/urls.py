@@ -5,7 +5,7 @@ from .tasks import send_reminder_email
 from .views import home, register, user_update, sleep_statistics_show, \
     profile, CustomPasswordResetView, CustomPasswordResetDoneView, CustomPasswordResetConfirmView, \
     CustomPasswordResetCompleteView, sleep_records_from_csv, custom_logout, sleep_history, sleep_fragmentation, \
-    sleep_chronotype
+    sleep_chronotype, sleep_heart_rate_range
 
 urlpatterns = [
     path('send_reminder_email/', send_reminder_email, name='send_reminder_email'),
@@ -21,6 +21,7 @@ urlpatterns = [
     path('logout/', custom_logout, name='custom_logout'),
 
     path('sleep-history/', sleep_history, name='sleep_history'),
+    path('sleep-heart-rate/', sleep_heart_rate_range, name='sleep_heart_rate_range'),
     path('sleep-fragmentation/', sleep_fragmentation, name='sleep_fragmentation'),
 
     path('sleep-chronotype/', sleep_chronotype, name='sleep_chronotype'),
@@ -1,30 +1,28 @@
+from datetime import datetime, timezone as dt_timezone
 import json
 import os
-from typing import Optional
 import uuid
 
-from cursor_pagination import CursorPaginator
-
-from django.views.decorators.cache import cache_page
+from django.conf import settings
 from django.contrib.auth import logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.views import PasswordResetConfirmView, PasswordResetCompleteView, PasswordResetView
-from django.http import HttpRequest, HttpResponse, JsonResponse
-from django.shortcuts import render, redirect, get_object_or_404
+from django.http import Http404, HttpRequest, HttpResponse, JsonResponse
+from django.shortcuts import render, redirect
 from django.urls import reverse_lazy
 from django.views.generic import TemplateView
 from django.utils import timezone
 from django.core.files.storage import FileSystemStorage
 
-from .sleep_statistic import get_sleep_phases_pie_data, get_heart_rate_bell_curve_data, chronotype_assessment, \
-    sleep_regularity, get_sleep_efficiency_trend, get_sleep_duration_trend, avg_sleep_duration
+from .dashboard import get_dashboard, get_sleep_history, load_heart_rate_range
 
 from .tasks import import_sleep_records, sleep_recommended
+from .csv_data_extraction import validate_sleep_export
 from sleepproject.settings import MEDIA_ROOT
 
 from .forms import UserRegistrationForm, UserDataForm, UserInfoUpdateForm, \
     CSVImportForm
-from .models import SleepRecord, SleepStatistics, UserData
+from .models import UserData
 
 # Create your views here.
 # python-benedict
@@ -110,6 +108,12 @@ def sleep_records_from_csv(request: HttpRequest) -> HttpResponse:
         filename = fs.save(unique_filename, csv_file)
         tmp_path = fs.path(filename)
 
+        # Неподходящий файл отклоняем сразу, не ставя задачу в очередь
+        error = validate_sleep_export(tmp_path)
+        if error is not None:
+            fs.delete(filename)
+            return JsonResponse({'status': 'error', 'message': error}, status=400)
+
         # запускаем Celery‑таску
         task = import_sleep_records.delay(request.user.id, tmp_path)
 
@@ -120,92 +124,35 @@ def sleep_records_from_csv(request: HttpRequest) -> HttpResponse:
 
 @login_required
 def sleep_statistics_show(request: HttpRequest) -> HttpResponse:
-    user = request.user
-    user_data = get_object_or_404(UserData, user=request.user)
-
-    sleep_statistics_list = SleepStatistics.objects.only('id', 'user', 'recommended', 'sleep_calories_burned',
-                                                    'sleep_efficiency', 'sleep_phases').filter(user=user).order_by(
-        '-date')
-
-    sleep_statistics = sleep_statistics_list.first() if sleep_statistics_list else None
-
-    # Получаем записи сна за 7 дней с сортировкой по убыванию даты
-    sleep_records = list(SleepRecord.get_last_sleep_records(user=user))
-
-
-    last_record = sleep_records[0] if sleep_records else None
-
-    rec = None
-    task_id = None
-
-    if sleep_statistics and not sleep_statistics.recommended and not request.GET.get("poll"):
-        # Создаём задачу Celery, если ещё нет рекомендации
-        task = sleep_recommended.delay(
-            user_data_id=user_data.id,
-            sleep_statistics_id=[s.id for s in sleep_statistics_list],
-            sleep_record_id=[r.id for r in sleep_records]
-        )
-        task_id = task.id
-    else:
-        rec = sleep_statistics.recommended if sleep_statistics else None
-
     # Пагинация
     page_size = int(request.GET.get('page_size', 7))
-    qs = SleepRecord.get_delta_days_sleep_records(user)
-
-    paginator = CursorPaginator(qs, ordering=('-sleep_date_time', '-id'))
-
     after = request.GET.get('after')
     before = request.GET.get('before')
 
-    if before:
-        page = paginator.page(last=page_size, before=before)
-    else:
-        page = paginator.page(first=page_size, after=after)
-
-    # Курсоры для ответа
-    next_cursor: Optional[str] = paginator.cursor(page[-1]) if page and page.has_next else None
-    prev_cursor: Optional[str] = paginator.cursor(page[0]) if page and page.has_previous else None
-
-    # Подготовка данных для графика
-    graph_data = get_sleep_duration_trend(page)
-
-    # Метрики
-    metric = {
-        'chronotype': chronotype_assessment(sleep_records=sleep_records) if sleep_records else {},
-        'sleep_regularity': sleep_regularity(sleep_records=sleep_records) if sleep_records else {},
-        'avg_sleep_duration': avg_sleep_duration(page) if page else 0,
-        'calories_burned': getattr(sleep_statistics, 'sleep_calories_burned', 0),
-        'sleep_efficiency': round(getattr(sleep_statistics, 'sleep_efficiency', 0), 2),
-    }
-
-    # Подготовка plot_data
-    first_date = graph_data['dates'][0] if graph_data.get('dates') else 0
-    last_date = graph_data['dates'][-1] if graph_data.get('dates') else 0
+    # Повторные просмотры отдаются из кеша без запросов к БД; импорт и новая рекомендация сбрасывают версию
+    dashboard = get_dashboard(request.user, page_size, after, before)
+    if dashboard is None:
+        raise Http404('Нет данных пользователя')
 
-    phases = get_sleep_phases_pie_data(sleep_statistics)
-    heart_rate = get_heart_rate_bell_curve_data(last_record)
+    rec = dashboard['rec']
+    task_id = None
 
-    plot_data = {
-        'phases': phases,
-        'graph_data': graph_data,
-        'heart_rate': heart_rate,
-        'first_date': first_date,
-        'last_date': last_date,
-    }
+    if dashboard['pending_recommendation'] and not request.GET.get("poll"):
+        # Создаём задачу Celery, если ещё нет рекомендации
+        task = sleep_recommended.delay(**dashboard['pending_recommendation'])
+        task_id = task.id
 
     # AJAX-ответ
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        rec = sleep_statistics.recommended if sleep_statistics else None
         return JsonResponse({
-            'has_next': page.has_next,
-            'has_previous': page.has_previous,
-            'next_cursor': next_cursor,
-            'prev_cursor': prev_cursor,
-            'graph_data': graph_data,
-            'first_date': first_date,
-            'last_date': last_date,
-            'metric': metric,
+            'has_next': dashboard['has_next'],
+            'has_previous': dashboard['has_previous'],
+            'next_cursor': dashboard['next_cursor'],
+            'prev_cursor': dashboard['prev_cursor'],
+            'graph_data': dashboard['graph_data'],
+            'first_date': dashboard['first_date'],
+            'last_date': dashboard['last_date'],
+            'metric': dashboard['metric'],
             'rec': rec,
             'task_id': task_id
 
@@ -213,15 +160,15 @@ def sleep_statistics_show(request: HttpRequest) -> HttpResponse:
 
     # Передаём контекст
     context = {
-        'page': page,
-        'graph_data': graph_data,
-        'metric': metric,
-        'plot_data': plot_data,
+        'page': dashboard['page'],
+        'graph_data': dashboard['graph_data'],
+        'metric': dashboard['metric'],
+        'plot_data': dashboard['plot_data'],
         'page_size': page_size,
         'rec': rec,
         'task_id': task_id,
-        'next_cursor': next_cursor,
-        'prev_cursor': prev_cursor,
+        'next_cursor': dashboard['next_cursor'],
+        'prev_cursor': dashboard['prev_cursor'],
 
     }
 
@@ -229,58 +176,47 @@ def sleep_statistics_show(request: HttpRequest) -> HttpResponse:
 
 
 @login_required
-@cache_page(60 * 15)
 def sleep_history(request: HttpRequest) -> HttpResponse:
-    user = request.user
-
     page_size = int(request.GET.get('page_size', 7))
 
-    qs = SleepStatistics.get_delta_days_sleep_statistics(user)
-
-    paginator = CursorPaginator(qs, ordering=('-date', '-id'))
-
     # Получаем курсоры из GET
     after = request.GET.get('after')  # ссылка на следующий блок (страница вперёд)
     before = request.GET.get('before')  # ссылка на предыдущий блок (страница назад)
 
-    if before:
-        # Если есть курсор before, то получаем предыдущую страницу
-        page = paginator.page(last=page_size, before=before)
-    else:
-        # Если курсора before нет, то получаем первую страницу
-        page = paginator.page(first=page_size, after=after)
-
-    next_cursor: Optional[str] = paginator.cursor(page[-1]) if page and page.has_next else None
-    prev_cursor: Optional[str] = paginator.cursor(page[0]) if page and page.has_previous else None
-
-    # Преобразуем в JSON для графика
-    graph_data_json = get_sleep_efficiency_trend(page)
+    # Кеш свой у каждого пользователя и курсора и сбрасывается при изменении его статистики
+    history = get_sleep_history(request.user, page_size, after, before)
 
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        # Если запрос AJAX, возвращаем только HTML таблицы и курсоры
-        return JsonResponse({
-
-            'has_next': page.has_next,
-            'has_previous': page.has_previous,
-            'next_cursor': next_cursor,
-            'prev_cursor': prev_cursor,
-            'graph_data_json': graph_data_json,
-        })
+        # Если запрос AJAX, возвращаем только данные графика и курсоры
+        return JsonResponse(history)
 
     context = {
-
-        'has_next': page.has_next,
-        'has_previous': page.has_previous,
-        'next_cursor': next_cursor,
-        'prev_cursor': prev_cursor,
-        'graph_data_json': json.dumps(graph_data_json),
+        **history,
+        'graph_data_json': json.dumps(history['graph_data_json']),
         'page_size': page_size,
-
     }
 
     return render(request, 'sleep_statistic/sleep_history.html', context)
 
 
+@login_required
+def sleep_heart_rate_range(request: HttpRequest) -> JsonResponse:
+    """
+    Пульс за диапазон start..end (миллисекунды UNIX) не более чем в max_points точках:
+    уровень пирамиды агрегатов выбирается по длине диапазона
+    """
+    try:
+        start = datetime.fromtimestamp(int(request.GET['start']) / 1000, tz=dt_timezone.utc)
+        end = datetime.fromtimestamp(int(request.GET['end']) / 1000, tz=dt_timezone.utc)
+        max_points = int(request.GET.get('max_points', settings.SLEEP_HR_CHART_POINTS))
+    except (KeyError, ValueError, OverflowError, OSError):
+        return JsonResponse({'status': 'error', 'message': 'Нужны целые start, end и max_points'}, status=400)
+    if end <= start or not 2 <= max_points <= settings.SLEEP_HR_RANGE_MAX_POINTS:
+        return JsonResponse({'status': 'error', 'message': 'Неверный диапазон или число точек'}, status=400)
+
+    return JsonResponse(load_heart_rate_range(request.user, start, end, max_points))
+
+
 @login_required
 def sleep_fragmentation(request: HttpRequest) -> HttpResponse:
     return render(request, 'sleep_statistic/sleep_fragmentation.html')
@@ -16,6 +16,10 @@ app.conf.beat_schedule = {
         'task': 'sleep_tracking_app.tasks.send_reminder_email',
         'schedule': crontab(minute=0, hour=20),  # Один раз в день
     },
+    'evict_import_parse_cache': {
+        'task': 'evict_import_parse_cache_task',
+        'schedule': crontab(minute=30, hour=3),  # Один раз в день
+    },
 
 }
 
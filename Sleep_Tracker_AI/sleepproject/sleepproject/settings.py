@@ -196,6 +196,41 @@ MISTRAL_MODEL = os.getenv("MISTRAL_MODEL", "mistral:7b-instruct-q4_K_M")
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/paraphrase-albert-small-v2")
 SLEEP_ARTICLES_FOLDER = os.getenv("SLEEP_ARTICLES_FOLDER", "sleep_articles")
 
+# Импорт экспорта Mi Fitness
+SLEEP_IMPORT_CHUNK_SIZE = int(os.getenv("SLEEP_IMPORT_CHUNK_SIZE", 50_000))  # строк CSV в одном куске
+SLEEP_IMPORT_BATCH_NIGHTS = int(os.getenv("SLEEP_IMPORT_BATCH_NIGHTS", 100))  # ночей в одной записи в БД
+# Файлы больше этого размера разбираются потоково, без загрузки всего CSV в память
+SLEEP_IMPORT_STREAMING_MIN_BYTES = int(os.getenv("SLEEP_IMPORT_STREAMING_MIN_BYTES", 32 * 1024 * 1024))
+# Колоночный кеш разобранных экспортов по отпечатку файла (по умолчанию MEDIA_ROOT/import_cache)
+SLEEP_IMPORT_PARSE_CACHE = os.getenv("SLEEP_IMPORT_PARSE_CACHE", "True") == "True"
+SLEEP_IMPORT_CACHE_DIR = os.getenv("SLEEP_IMPORT_CACHE_DIR")
+# Кеш разбора вытесняется, если не использовался дольше TTL (секунды) или весь кеш больше MAX_BYTES
+SLEEP_IMPORT_CACHE_TTL = int(os.getenv("SLEEP_IMPORT_CACHE_TTL", 30 * 24 * 60 * 60))
+SLEEP_IMPORT_CACHE_MAX_BYTES = int(os.getenv("SLEEP_IMPORT_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+# Запусков импорта одного файла (повторные доставки и повторы задачи), после которых импорт считается неудавшимся
+SLEEP_IMPORT_MAX_ATTEMPTS = int(os.getenv("SLEEP_IMPORT_MAX_ATTEMPTS", 5))
+# С этого числа ночей импорт раскладывается по месяцам и пишется параллельными подзадачами (chord)
+SLEEP_IMPORT_SHARD_MIN_NIGHTS = int(os.getenv("SLEEP_IMPORT_SHARD_MIN_NIGHTS", 730))
+# Прогресс импорта пишется в result backend не чаще раза в интервал (секунды) и при изменении хотя бы на дельту (%)
+SLEEP_IMPORT_PROGRESS_INTERVAL = float(os.getenv("SLEEP_IMPORT_PROGRESS_INTERVAL", 0.5))
+SLEEP_IMPORT_PROGRESS_MIN_DELTA = float(os.getenv("SLEEP_IMPORT_PROGRESS_MIN_DELTA", 1.0))
+# Хранение ночного пульса: 'rows' — строка на отсчёт (COPY, помесячные секции на PostgreSQL),
+# 'series' — по выбору одна строка на ночь с упакованным рядом
+SLEEP_HR_STORAGE = os.getenv("SLEEP_HR_STORAGE", "rows")
+# Хранение сегментов сна: 'rows' — строка на сегмент, 'hypnogram' — по выбору одна строка на ночь длинами серий
+SLEEP_SEGMENT_STORAGE = os.getenv("SLEEP_SEGMENT_STORAGE", "rows")
+# Помесячные секции таблиц отсчётов на PostgreSQL (manage.py maintain_sleep_partitions):
+# на сколько месяцев вперёд создавать и сколько месяцев хранить (пусто — хранить всё)
+SLEEP_PARTITION_MONTHS_AHEAD = int(os.getenv("SLEEP_PARTITION_MONTHS_AHEAD", 3))
+SLEEP_PARTITION_RETENTION_MONTHS = int(os.getenv("SLEEP_PARTITION_RETENTION_MONTHS", 0)) or None
+# Срок жизни закешированного дашборда статистики сна, секунд. Кеш сбрасывается раньше
+# по версии пользователя: после импорта и сохранения новой рекомендации
+SLEEP_DASHBOARD_CACHE_TIMEOUT = int(os.getenv("SLEEP_DASHBOARD_CACHE_TIMEOUT", 24 * 60 * 60))
+# Сколько точек ночного пульса отдаётся на график: более плотные ряды прореживаются с сохранением пиков
+SLEEP_HR_CHART_POINTS = int(os.getenv("SLEEP_HR_CHART_POINTS", 500))
+# Наибольшее число точек, которое можно запросить у диапазона пульса (sleep-heart-rate/)
+SLEEP_HR_RANGE_MAX_POINTS = int(os.getenv("SLEEP_HR_RANGE_MAX_POINTS", 5000))
+
 
 CACHES = {
     "default": {
@@ -16,6 +16,8 @@ TEMP_DIR = tempfile.gettempdir()
 MEDIA_ROOT = os.path.join(TEMP_DIR, 'test_media')
 MEDIA_URL = '/media/'
 DEFAULT_FILE_STORAGE = 'django.core.files.storage.FileSystemStorage'
+# Кеш разбора экспортов включают только тесты импорта, со своим временным каталогом
+SLEEP_IMPORT_PARSE_CACHE = False
 
 # ===== КЭШИРОВАНИЕ =====
 CACHES = {